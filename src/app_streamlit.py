@@ -1,216 +1,260 @@
-import asyncio
 import streamlit as st
 from pathlib import Path
-from pydantic_ai import Agent
-from pydantic_ai.mcp import MCPServerStdio
-from pydantic_ai.messages import (
-    PartDeltaEvent, TextPartDelta,
-    FunctionToolCallEvent, FunctionToolResultEvent,
-)
-from config import orch_model
-from tools_orchestrator import analyse_image_base64, show_reference_images_tool
-
-# ── Constants ─────────────────────────────────────────────────────────────
-DATA_DIR = Path(__file__).parent / "data"
-DATA_DIR.mkdir(exist_ok=True)
-
-SYSTEM_PROMPT = """
-ROLE
-You are a radiology assistant.
-
-TOOLS
-1. analyse_image_base64(path:str)            -> RadiologyReport
-2. show_reference_images_tool(path:str)      -> dict
-3. send_email(to:list[str], subject:str,
-              body:str, cc:list[str]|None=[],
-              bcc:list[str]|None=[])         -> Gmail message ID
-
-FLOW
-A) Get image
-• If no image path: ask “Which image file should I analyse? (default = data/image.jpg)”
-
-B) Analyse image
-• Once you have <PATH> call: {"name":"analyse_image_base64","arguments":{"path":"<PATH>"}}
-
-C) Present result
-• Tool returns {critical, diagnosis_description, clinical_recommendations}
-• Show this summary:
-    Diagnosis: <diagnosis_description>
-    Recommendations: <clinical_recommendations>
-    Critical: Yes/No
-
-D) Offer reference images ── ALWAYS happens first
-• Ask: “Would you like to view reference images from similar confirmed cases?”
-• If user replies yes/yep/“show them”… IMMEDIATELY call:
-    {"name":"show_reference_images_tool","arguments":{"confirm":"yes"}}
-• After the tool finishes —or if the user said “no” —continue to step E.
-
-E) Handle critical cases ── ONLY if critical == true
-• Ask: “This case is marked as critical. Would you like to send it for peer review?”
-• If user agrees:
-    1. Draft a plain-text email (from Dr. Mahdi Ghodsi) with the summary.
-    2. Show the draft and ask: “Would you like me to send this email?”
-    3. If user confirms sending:
-        Ask for recipient address.
-        Call IMMEDIATELY:
-        {"name":"send_email","arguments":{"to":["<EMAIL>"],"subject":"<SUBJECT>","body":"<BODY>"}}
-
-RULES
-• Never skip a step.
-• D must finish (or be declined) before E begins.
-• Never send an email without explicit confirmation.
-• Never invent clinical data.
-""".strip()
-
-
-async def build_orchestrator():
-    gmail_server = MCPServerStdio(
-        command="npx",
-        args=["-y", "@gongrzhe/server-gmail-autoauth-mcp"],
-    )
-
-    return Agent(
-        model=orch_model,
-        mcp_servers=[gmail_server],
-        tools=[analyse_image_base64, show_reference_images_tool],
-        system_prompt=SYSTEM_PROMPT,
-        instrument=True,
-    )
+from pydantic_ai.agent import AgentRunResult
+from pydantic_ai.messages import FunctionToolCallEvent, FunctionToolResultEvent
+import dicom_io
+import endpoint_router
+import orchestrator
+import runtime
+import telemetry
+import warmup
+from config import WARMUP
+from history import estimate_tokens
+from orchestrator import build_orchestrator
+from schema import PartialRadiologyReport
+from outbox import outbox
+from session_store import Session, session_store
+from upload_store import UploadTooLarge, upload_store
+from workflow import format_partial
+
+
+def reference_cases(result) -> list[dict] | None:
+    """Cases returned by show_reference_images_tool, if the call succeeded."""
+    content = getattr(result, "content", None)
+    return content.get("cases") if isinstance(content, dict) else None
+
+
+@st.cache_resource(show_spinner=False)
+def start_up() -> None:
+    """Once per process, on the first page load: resume the outbox and start warming up."""
+    runtime.run(outbox.start())  # resume deliveries left over from a previous run
+    if WARMUP:
+        runtime.submit(warmup.warm_up())  # in the background; the first turn need not wait for it
+
+
+@st.cache_resource(show_spinner="⏳ Initializing assistant...")
+def get_orchestrator():
+    """One orchestrator for the whole process, shared by every session and rerun."""
+    return runtime.run(build_orchestrator())
+
+
+def current_session() -> Session:
+    """
+    This tab's chat session, from ``session_store``.
+
+    Its id is kept in the URL (``?session=<id>``), so a reload or a restarted
+    server resumes the conversation from its log.
+    """
+    session_id = st.session_state.get("session_id") or st.query_params.get("session")
+    try:
+        session = session_store.get(session_id)
+    except ValueError:
+        session = session_store.get()
+    st.session_state["session_id"] = st.query_params["session"] = session.id
+    return session
 
 
 class StreamlitChatUI:
-    def __init__(self, show_tool_calls: bool = False):
+    def __init__(self, session: Session, show_tool_calls: bool = False):
         self.orchestrator = None
+        self.session = session
         self.show_tool_calls = show_tool_calls
-        st.session_state.setdefault("messages", [])
-        st.session_state.setdefault("internal_history", [])
 
-    async def initialize(self):
+    def initialize(self):
         if self.orchestrator is None:
-            with st.spinner("⏳ Initializing assistant..."):
-                self.orchestrator = await build_orchestrator()
+            self.orchestrator = get_orchestrator()
         return self.orchestrator
 
-    async def process_message(self, message: str):
-        await self.initialize()
+    def turn_events(self, message: str, history: list):
+        """One orchestrator turn on the runtime loop; rendered in the Streamlit thread (``runtime.iterate``)."""
+        return orchestrator.turn_events(self.orchestrator, message, history)
 
-        st.session_state.messages.append({"role": "user", "content": message})
+    def process_message(self, message: str):
+        self.initialize()
+
+        session = self.session
+        session.display.append({"role": "user", "content": message})
         assistant_placeholder = st.empty()
-        full_response = ""
 
-        async with self.orchestrator.run_mcp_servers():
-            async with self.orchestrator.iter(
-                user_prompt=message,
-                message_history=st.session_state.internal_history,
-            ) as run:
-                async for node in run:
-                    if Agent.is_call_tools_node(node):
-                        async with node.stream(run.ctx) as s:
-                            async for ev in s:
-                                if isinstance(ev, FunctionToolCallEvent) and self.show_tool_calls:
-                                    call = f"\n▶️ Tool call → {ev.part.tool_name}{ev.part.args}\n"
-                                    full_response += call
-                                    assistant_placeholder.markdown(full_response)
-                                elif isinstance(ev, FunctionToolResultEvent):
-                                    if self.show_tool_calls:
-                                        result_str = f"✅ Tool Result:\n{ev.result}\n\n"
-                                        full_response += result_str
-                                        assistant_placeholder.markdown(full_response)
-
-                                    if ev.result.tool_name == "show_reference_images_tool":
-                                        self.show_reference_images()
-                    elif Agent.is_model_request_node(node):
-                        async with node.stream(run.ctx) as s:
-                            async for ev in s:
-                                if isinstance(ev, PartDeltaEvent) and isinstance(ev.delta, TextPartDelta):
-                                    full_response += ev.delta.content_delta
-                                    assistant_placeholder.markdown(full_response)
-
-            st.session_state.internal_history.extend(run.result.all_messages())
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
+        try:
+            events = session.workflow.on_message(message, session.history, self.turn_events)
+            full_response = self.render_events(events, assistant_placeholder)
+            session.display.append({"role": "assistant", "content": full_response})
+        finally:
+            session_store.save(session)  # only what this turn added
         assistant_placeholder.markdown(full_response)
 
-    def show_reference_images(self):
-        st.markdown("### 🩻 Reference Cases (Confirmed Diagnoses)")
-        image_paths = [
-            "data/cancer/sample_1.jpg",
-            "data/cancer/sample_2.jpg",
-            "data/cancer/sample_3.jpg",
-            "data/cancer/sample_4.jpg",
-        ]
-        cols = st.columns(len(image_paths))
-        for col, path in zip(cols, image_paths):
-            with col:
-                st.image(path, use_container_width=True, caption="Case: " + path.split("/")[-1].split(".")[0].replace("_", " ").title())
-
-    async def process_upload_message(self, message: str, placeholder_container):
-        await self.initialize()
+    def render_events(self, events, placeholder=None) -> str:
+        """
+        Consume turn events in the Streamlit thread; returns the assistant text.
 
+        Text is streamed into ``placeholder`` when one is given, otherwise
+        only collected.
+        """
         full_response = ""
-        async with self.orchestrator.run_mcp_servers():
-            async with self.orchestrator.iter(
-                user_prompt=message,
-                message_history=st.session_state.internal_history,
-            ) as run:
-                async for node in run:
-                    if Agent.is_call_tools_node(node):
-                        async with node.stream(run.ctx) as s:
-                            async for ev in s:
-                                if isinstance(ev, FunctionToolResultEvent):
-                                    if ev.result.tool_name == "show_reference_images_tool":
-                                        self.show_reference_images()
-                    elif Agent.is_model_request_node(node):
-                        # 👇 DO NOT stream updates line by line
-                        async with node.stream(run.ctx) as s:
-                            async for ev in s:
-                                if isinstance(ev, PartDeltaEvent) and isinstance(ev.delta, TextPartDelta):
-                                    full_response += ev.delta.content_delta
-
-        # Save to state for chat history
-        st.session_state.internal_history.extend(run.result.all_messages())
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
-
-        # ✅ Show once, cleanly rendered
-        # with placeholder_container:
-        #     st.markdown("#### 📋 Radiology Report")
-        #     st.markdown(full_response.strip())
+        history = self.session.history
+        prompt_tokens = estimate_tokens(history.messages)
+        for ev in runtime.iterate(events):
+            if isinstance(ev, str):
+                full_response += ev
+                if placeholder is not None:
+                    placeholder.markdown(full_response)
+            elif isinstance(ev, FunctionToolCallEvent):
+                if self.show_tool_calls and placeholder is not None:
+                    call = f"\n▶️ Tool call → {ev.part.tool_name}{ev.part.args}\n"
+                    full_response += call
+                    placeholder.markdown(full_response)
+            elif isinstance(ev, FunctionToolResultEvent):
+                if self.show_tool_calls and placeholder is not None:
+                    result_str = f"✅ Tool Result:\n{ev.result}\n\n"
+                    full_response += result_str
+                    placeholder.markdown(full_response)
+
+                if ev.result.tool_name == "show_reference_images_tool":
+                    self.show_reference_images(reference_cases(ev.result))
+            elif isinstance(ev, PartialRadiologyReport):
+                if placeholder is not None:
+                    placeholder.markdown(format_partial(ev))
+            elif isinstance(ev, AgentRunResult):
+                history.append_run(ev, prompt_tokens_est=prompt_tokens)
+            elif isinstance(ev, telemetry.Turn):
+                st.session_state["last_turn_perf"] = ev.summary()
+        return full_response
+
+    def show_reference_images(self, cases: list[dict] | None = None):
+        st.markdown("### 🩻 Reference Cases (Confirmed Diagnoses)")
+        if not cases:
+            # no similarity index built yet – fall back to the bundled samples
+            cases = [{"path": f"data/cancer/sample_{i}.jpg"} for i in range(1, 5)]
+        cols = st.columns(len(cases))
+        for col, case in zip(cols, cases):
+            path = case["path"]
+            caption = "Case: " + Path(path).stem.replace("_", " ").title()
+            if "score" in case:
+                caption += f" (similarity {case['score']:.2f})"
+            with col:
+                st.image(path, use_container_width=True, caption=caption)
+
+    def process_upload(self, ref: str, placeholder_container):
+        """
+        Analyse an uploaded image (by its ``upload:<sha256>`` reference)
+        directly, with no orchestrator round trip.
+
+        The report is drawn field by field into ``placeholder_container`` while
+        the VLM streams; once complete it moves to the chat history.
+        """
+        self.initialize()
+        session = self.session
+        placeholder = placeholder_container.empty()
+        try:
+            full_response = self.render_events(session.workflow.on_upload(ref, session.history), placeholder)
+            session.display.append({"role": "assistant", "content": full_response})
+        finally:
+            session_store.save(session)
+        placeholder.empty()
+
+
+def show_performance_panel():
+    st.subheader("⏱️ Performance")
+    if last := st.session_state.get("last_turn_perf"):
+        st.markdown(f"**Last turn:** {last['duration_s'] * 1000:.0f} ms")
+        st.dataframe(
+            [{"stage": sp["name"], "ms": sp["ms"]} for sp in last["spans"]],
+            hide_index=True, use_container_width=True,
+        )
+        if last["counters"]:
+            st.json(last["counters"], expanded=False)
+    else:
+        st.caption("No turn measured yet.")
+
+    st.markdown("**Rolling percentiles**")
+    rows = [{"stage": name, **stats} for name, stats in telemetry.collector.percentiles().items()]
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+
+    if (state := warmup.status["state"]) in ("ready", "failed"):
+        st.markdown(f"**Warm-up:** {state} in {warmup.status['duration_s'] * 1000:.0f} ms")
+        st.dataframe(
+            [{"step": sp["name"], "ms": sp["ms"]} for sp in warmup.status["spans"]],
+            hide_index=True, use_container_width=True,
+        )
+        for step, error in warmup.status["errors"].items():
+            st.caption(f"{step}: {error}")
+    else:
+        st.markdown(f"**Warm-up:** {state}")
+
+    for role, router in endpoint_router.routers.items():
+        st.markdown(f"**{role} replicas**")
+        st.dataframe(router.stats(), hide_index=True, use_container_width=True)
+
+
+def show_outbox_status():
+    counts = outbox.stats()
+    pending = counts["queued"] + counts["sending"]
+    if not any(counts.values()):
+        return
+    st.markdown(f"• Email outbox: {pending} pending, {counts['sent']} sent, {counts['failed']} failed")
+    icons = {"queued": "⏳", "sending": "📤", "sent": "✅", "failed": "❌"}
+    with st.expander("📮 Recent emails", expanded=bool(pending or counts["failed"])):
+        for msg in outbox.recent(5):
+            line = f"{icons.get(msg['status'], '❓')} #{msg['id']} → {', '.join(msg['to'] or [])}: {msg['subject']}"
+            if msg["status"] != "sent" and msg["last_error"]:
+                line += f"  \n  _attempt {msg['attempts']}: {msg['last_error'][:120]}_"
+            st.markdown(line)
 
 
 def main():
-    st.session_state.setdefault("messages", [])
-    st.session_state.setdefault("internal_history", [])
-    st.session_state.setdefault("image_uploaded", False)
-
     st.set_page_config(page_title="Radiology Assistant", page_icon="🏥", layout="wide")
+    start_up()
+    session = current_session()
+    st.session_state.setdefault("image_uploaded", session.workflow.image_path is not None)
 
     with st.sidebar:
         st.header("🧾 Session Info")
         st.markdown("• Image uploaded: ✅" if st.session_state["image_uploaded"] else "• Awaiting image...")
-        st.markdown(f"• Messages: {len(st.session_state['messages'])}")
+        st.markdown(f"• Messages: {len(session.display)}")
         st.markdown("• Role: Assistant with tools")
+        if last_turn := session.history.last_turn:
+            st.markdown(f"• Prompt tokens (last turn): {last_turn['request_tokens']}")
+            st.markdown(f"• History size: ~{last_turn['history_tokens_est']} tokens")
+        if saved := session.workflow.stats["requests_saved"]:
+            st.markdown(f"• Orchestrator calls skipped: {saved}")
+        show_outbox_status()
         st.markdown("---")
         show_tool_calls = st.checkbox("Show Tool Call Logs", value=False)
+        show_performance = st.checkbox("Show Performance", value=False)
+        perf_container = st.container()
 
     st.title("🏥 Radiology Assistant")
     st.markdown("Analyze radiology images and manage critical follow-up workflows using AI tools.")
 
-    ui = StreamlitChatUI(show_tool_calls=show_tool_calls)
+    ui = StreamlitChatUI(session, show_tool_calls=show_tool_calls)
 
     with st.expander("📤 Upload Medical Image", expanded=True):
-        uploaded_file = st.file_uploader("Choose a medical image (.jpg or .png)", type=["jpg", "png"])
+        uploaded_file = st.file_uploader(
+            "Choose a medical image (.jpg, .png or DICOM .dcm)", type=["jpg", "png", "dcm", "dicom"],
+        )
         if uploaded_file and not st.session_state["image_uploaded"]:
-            save_path = DATA_DIR / uploaded_file.name
-            with open(save_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            st.image(uploaded_file, caption="Uploaded Image", use_container_width=True)
+            try:
+                upload = upload_store.save(uploaded_file, filename=uploaded_file.name)
+            except UploadTooLarge as exc:
+                st.error(str(exc))
+                st.stop()
+            if dicom_io.is_dicom_path(upload.path):
+                try:
+                    st.image(dicom_io.render_image(upload.path), caption="Uploaded Image (DICOM)", use_container_width=True)
+                except Exception as exc:
+                    st.error(f"Could not read the DICOM file: {exc}")
+                    st.stop()
+            else:
+                st.image(uploaded_file, caption="Uploaded Image", use_container_width=True)
             st.session_state["image_uploaded"] = True
             response_container = st.container()
             with st.spinner("Analyzing uploaded image..."):
-                asyncio.run(ui.process_upload_message(f"Analyze this image: {save_path}", response_container))
+                ui.process_upload(upload.ref, response_container)
 
     st.divider()
     avatar_map = {"user": "🧑", "assistant": "🤖"}
-    for message in st.session_state["messages"]:
+    for message in session.display:
         with st.chat_message(message["role"], avatar=avatar_map.get(message["role"], "❓")):
             st.markdown(message["content"])
 
@@ -219,7 +263,11 @@ def main():
             st.markdown(prompt)
         with st.chat_message("assistant", avatar="🤖"):
             with st.spinner("💭 Thinking..."):
-                asyncio.run(ui.process_message(prompt))
+                ui.process_message(prompt)
+
+    if show_performance:
+        with perf_container:
+            show_performance_panel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""
+Batch analysis of whole image directories without the chat UI.
+
+    python src/batch_analyse.py data/ --out results.jsonl --concurrency 8
+    python src/batch_analyse.py manifest.txt --out results.jsonl
+
+Images go straight to the radiology VLM (through the report cache) with at
+most ``--concurrency`` requests in flight.  Every result is appended to the
+JSONL output as soon as it finishes, so an interrupted run can simply be
+restarted: images that already have a successful record are skipped.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from config import BATCH_CONCURRENCY
+from telemetry import percentile
+from tools_orchestrator import analyse_image
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".dcm", ".dicom"}
+
+
+def collect_images(source: Path) -> list[Path]:
+    """
+    Expand a directory (recursively) or a manifest file into image paths.
+
+    A manifest is either plain text with one path per line or JSONL with a
+    ``path`` key per line; relative paths are resolved against the manifest.
+    """
+    if source.is_dir():
+        return sorted(p.resolve() for p in source.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+
+    paths = []
+    for line in source.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            line = json.loads(line)["path"]
+        path = Path(line).expanduser()
+        if not path.is_absolute():
+            path = source.parent / path
+        paths.append(path.resolve())
+    return paths
+
+
+def load_done(out_path: Path) -> set[str]:
+    """Paths that already have a successful record in the output file."""
+    done = set()
+    if not out_path.exists():
+        return done
+    with out_path.open() as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            if "report" in record:
+                done.add(record["path"])
+    return done
+
+
+async def run_batch(
+    paths: list[Path],
+    out_path: Path,
+    *,
+    concurrency: int = BATCH_CONCURRENCY,
+    use_cache: bool = True,
+) -> dict:
+    queue: asyncio.Queue[Path] = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+
+    latencies: list[float] = []
+    failures = 0
+
+    with out_path.open("a") as out:
+
+        async def worker():
+            nonlocal failures
+            while True:
+                try:
+                    path = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                t0 = time.perf_counter()
+                record = {"path": str(path)}
+                try:
+                    record["report"] = await analyse_image(str(path), use_cache=use_cache)
+                except Exception as exc:
+                    record["error"] = f"{type(exc).__name__}: {exc}"
+                    failures += 1
+                elapsed = time.perf_counter() - t0
+                record["latency_s"] = round(elapsed, 4)
+                latencies.append(elapsed)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+        t_start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        wall = time.perf_counter() - t_start
+
+    return {
+        "images": len(latencies),
+        "failures": failures,
+        "wall_s": round(wall, 3),
+        "images_per_s": round(len(latencies) / wall, 3) if wall else 0.0,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Analyse every image in a directory or manifest.")
+    parser.add_argument("source", type=Path, help="image directory or manifest file")
+    parser.add_argument("--out", type=Path, default=Path("results.jsonl"), help="JSONL output (appended)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="max VLM requests in flight")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached reports")
+    args = parser.parse_args(argv)
+
+    paths = collect_images(args.source)
+    done = load_done(args.out)
+    todo = [p for p in paths if str(p) not in done]
+    print(f"{len(paths)} images, {len(paths) - len(todo)} already done, {len(todo)} to analyse", file=sys.stderr)
+
+    summary = asyncio.run(run_batch(todo, args.out, concurrency=args.concurrency, use_cache=not args.no_cache))
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
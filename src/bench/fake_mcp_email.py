@@ -0,0 +1,54 @@
+"""
+Fake Gmail MCP server for offline runs.
+
+Exposes the same ``send_email`` tool as ``@gongrzhe/server-gmail-autoauth-mcp``
+over stdio, but only appends the message to ``FAKE_MCP_OUTBOX`` (JSONL)
+after sleeping ``FAKE_MCP_LATENCY`` seconds.  ``FAKE_MCP_FAIL_RATE`` makes
+that fraction of sends fail, to exercise the outbox retries;
+``FAKE_MCP_FAIL_FIRST=n`` deterministically fails the first ``n`` sends of
+every distinct message (same recipients, subject and body).
+
+    MCPServerStdio(command=sys.executable, args=["-m", "bench.fake_mcp_email"])
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from mcp.server.fastmcp import FastMCP
+
+mcp = FastMCP("fake-gmail")
+attempts: dict[str, int] = {}
+
+
+@mcp.tool()
+async def send_email(
+    to: list[str],
+    subject: str,
+    body: str,
+    cc: list[str] | None = None,
+    bcc: list[str] | None = None,
+) -> str:
+    """Send an email (recorded locally, nothing leaves the machine)."""
+    await asyncio.sleep(float(os.getenv("FAKE_MCP_LATENCY", "0.2")))
+    if random.random() < float(os.getenv("FAKE_MCP_FAIL_RATE", "0")):
+        raise RuntimeError("Gmail API error: 503 backend unavailable")
+    key = json.dumps([to, subject, body])
+    attempts[key] = attempts.get(key, 0) + 1
+    if attempts[key] <= int(os.getenv("FAKE_MCP_FAIL_FIRST", "0")):
+        raise RuntimeError("Gmail API error: 503 backend unavailable")
+    message_id = uuid.uuid4().hex[:16]
+    outbox = os.getenv("FAKE_MCP_OUTBOX")
+    if outbox:
+        with open(outbox, "a") as f:
+            f.write(json.dumps({
+                "id": message_id, "to": to, "cc": cc or [], "bcc": bcc or [],
+                "subject": subject, "body": body, "ts": time.time(),
+            }) + "\n")
+    return f"Email sent successfully with ID: {message_id}"
+
+
+if __name__ == "__main__":
+    mcp.run()
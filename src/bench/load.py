@@ -0,0 +1,159 @@
+"""
+Load generator for the HTTP service (``service.py``).
+
+Each simulated client uploads an image with ``POST /v1/analyses`` and
+follows ``/v1/analyses/{id}/events`` until the report arrives; a 429 is
+counted and retried after its Retry-After.  Reported: accepted/rejected
+submissions, completed analyses per second and p50/p95/p99 end-to-end
+latency (first POST to report, including any backoff).
+
+Against a running service:
+
+    python -m bench.load --url http://127.0.0.1:8080 --requests 200 --concurrency 32
+
+Or self-contained, with a stub RAD server and the service on this loop:
+
+    cd src && python -m bench.load --self-host --workers 4 --queue-size 16 --requests 100 --concurrency 48
+
+``--distinct`` makes every image's bytes unique (trailing bytes after the
+JPEG end marker), so nothing is served from the report cache or coalesced.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from telemetry import percentile
+
+DEFAULT_IMAGE = Path(__file__).resolve().parent.parent.parent / "data" / "image.jpg"
+
+
+async def _events(resp: aiohttp.ClientResponse):
+    """Parse a server-sent event stream into (event, data) pairs."""
+    event, data = "message", []
+    async for raw in resp.content:
+        line = raw.decode().rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+async def client(session: aiohttp.ClientSession, url: str, image: bytes, stats: dict) -> None:
+    t0 = time.perf_counter()
+    while True:
+        async with session.post(f"{url}/v1/analyses", data=image, headers={"Content-Type": "image/jpeg"}) as resp:
+            if resp.status == 429:
+                stats["rejected"] += 1
+                await asyncio.sleep(float(resp.headers.get("Retry-After", "1")))
+                continue
+            resp.raise_for_status()
+            job = await resp.json()
+            stats["accepted"] += 1
+            break
+    async with session.get(f"{url}{job['links']['events']}") as resp:
+        async for event, data in _events(resp):
+            if event in ("report", "error"):
+                stats["failed" if event == "error" else "done"] += 1
+                break
+    stats["latency"].append(time.perf_counter() - t0)
+
+
+async def generate(url: str, image: bytes, requests: int, concurrency: int, distinct: bool) -> dict:
+    stats = {"accepted": 0, "rejected": 0, "done": 0, "failed": 0, "latency": []}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            data = image + os.urandom(16) if distinct else image
+            await client(session, url, data, stats)
+
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - t0
+        async with session.get(f"{url}/healthz") as resp:
+            health = await resp.json()
+
+    latency = stats.pop("latency")
+    return {
+        **stats,
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "analyses_per_s": round(stats["done"] / wall, 3),
+        "p50_ms": round(1000 * percentile(latency, 50), 1),
+        "p95_ms": round(1000 * percentile(latency, 95), 1),
+        "p99_ms": round(1000 * percentile(latency, 99), 1),
+        "server": health["analyses"],
+    }
+
+
+async def self_hosted(args, image: bytes) -> dict:
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    from bench.stub_openai import StubConfig, StubServer
+    from outbox import outbox
+    from radiology_agent import radiology_agent, repair_agent
+    from report_cache import report_cache
+    from service import Service
+    from session_store import session_store
+    from upload_store import upload_store
+
+    tmp = Path(tempfile.mkdtemp(prefix="radload-"))
+    report_cache.directory = tmp / "reports"  # never touch the real stores
+    upload_store.directory = tmp / "uploads"
+    outbox.path = tmp / "outbox.sqlite3"
+    session_store.directory = tmp / "sessions"
+
+    stub_runner, stub_url = await StubServer(StubConfig(ttft=args.rad_ttft, tokens_per_s=args.rad_tps)).start()
+    model = OpenAIModel("stub-rad", provider=OpenAIProvider(base_url=stub_url, api_key="stub"))
+    runner = web.AppRunner(Service(workers=args.workers, max_queued=args.queue_size, warm_up=False).app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        with radiology_agent.override(model=model), repair_agent.override(model=model):
+            return await generate(url, image, args.requests, args.concurrency, args.distinct)
+    finally:
+        await runner.cleanup()
+        await stub_runner.cleanup()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Load generator for the analysis service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--image", type=Path, default=DEFAULT_IMAGE)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated clients")
+    parser.add_argument("--distinct", action="store_true", help="unique bytes per request (no cache hits)")
+    parser.add_argument("--self-host", action="store_true", help="run a stub RAD server and the service in-process")
+    parser.add_argument("--workers", type=int, default=4, help="service workers (--self-host)")
+    parser.add_argument("--queue-size", type=int, default=16, help="service queue size (--self-host)")
+    parser.add_argument("--rad-ttft", type=float, default=0.3)
+    parser.add_argument("--rad-tps", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    image = args.image.read_bytes()
+    if args.self_host:
+        results = asyncio.run(self_hosted(args, image))
+    else:
+        results = asyncio.run(generate(args.url, image, args.requests, args.concurrency, args.distinct))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
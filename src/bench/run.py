@@ -0,0 +1,557 @@
+"""
+Offline end-to-end benchmarks.
+
+Starts two stub model servers (``bench.stub_openai``) and the fake Gmail
+MCP server (``bench.fake_mcp_email``), then drives the real code paths:
+
+• radiology_agent  – ``analyse_bytes`` against the RAD stub
+• radiology_stream – ``stream_bytes``: time to the critical flag, to the
+  first diagnosis text and to the complete report
+• report_repair    – ``analyse_bytes`` against stubs that answer with
+  fenced, prose-wrapped, re-cased or broken JSON: requests and tokens per
+  call spent on repairs
+• series           – an 8-image study one by one, fanned out, and fanned
+  out with 4-slice montages: VLM calls and wall time
+• analyse_image    – per-stage timings (read, preprocess, VLM) plus a
+  cached re-run
+• coalescing       – ``--callers`` concurrent uncached analyses of one image:
+  VLM requests sent and callers that joined the shared request
+• orchestrator     – N concurrent sessions walking the SYSTEM_PROMPT flow
+  (upload → reference images → peer-review draft → send email), once
+  LLM-only and once through the ``workflow`` fast paths; emails go
+  through the outbox and are delivered to the fake MCP server
+• session_store    – ``--stored-sessions`` sessions walking the same flow
+  with ``session_store`` saving every turn: bytes and time per save, log
+  size against the plain JSON history, memory per live session (and per
+  evicted one) and resume latency from the log
+• outbox           – enqueue latency and time to deliver a burst (with
+  duplicates) while the fake server fails ``--mcp-fail-rate`` of sends
+• routing          – ``analyse_bytes`` over RAD replicas with a latency tail
+  (``--slow-rate`` / ``--slow-delay``), one failing with 503s and one not
+  listening: a single replica vs ``EndpointRouter`` with and without hedging
+
+Results are printed as JSON; ``--save NAME`` stores them under
+``bench/baselines/NAME.json`` and ``--compare NAME`` fails (exit 1) when a
+metric is more than ``--tolerance`` worse than that baseline.
+
+    cd src && python -m bench.run --sessions 8 --save local
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+from pydantic_ai import Agent
+from pydantic_ai.agent import AgentRunResult
+from pydantic_ai.mcp import MCPServerStdio
+from pydantic_ai.messages import ModelMessagesTypeAdapter
+from pydantic_ai.models.openai import OpenAIModel
+from pydantic_ai.providers.openai import OpenAIProvider
+
+import preprocess
+import series
+import telemetry
+from bench.stub_openai import StubConfig, StubServer
+from endpoint_router import EndpointRouter
+from history import ConversationHistory
+from mcp_pool import MCPServerPool
+from orchestrator import SYSTEM_PROMPT
+from outbox import Outbox, outbox
+from radiology_agent import analyse_bytes, radiology_agent, repair_agent, stream_bytes
+from report_cache import report_cache
+from session_store import SessionStore
+from telemetry import percentile
+from tools_orchestrator import (
+    analyse_image,
+    analyse_image_base64,
+    analyse_image_data,
+    analyse_series_tool,
+    resolve_image_path,
+    send_email,
+    show_reference_images_tool,
+)
+from workflow import Workflow
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASELINE_DIR = BENCH_DIR / "baselines"
+DEFAULT_IMAGE = BENCH_DIR.parent.parent / "data" / "image.jpg"
+
+SESSION_SCRIPT = [
+    "Analyze this image: {image}",
+    "yes, show them",
+    "yes",
+    "send it to reviewer@example.com",
+]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarise(seconds: list[float]) -> dict:
+    return {
+        "n": len(seconds),
+        "mean_ms": round(1000 * sum(seconds) / len(seconds), 2) if seconds else 0.0,
+        "p50_ms": round(1000 * percentile(seconds, 50), 2),
+        "p95_ms": round(1000 * percentile(seconds, 95), 2),
+    }
+
+
+# ── scenarios ─────────────────────────────────────────────────────────────
+async def bench_radiology(image: Path, repeats: int) -> dict:
+    data = image.read_bytes()
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        await analyse_bytes(data, preprocess.sniff_media_type(data))
+        timings.append(time.perf_counter() - t0)
+    return summarise(timings)
+
+
+async def bench_stream(image: Path, repeats: int) -> dict:
+    data = image.read_bytes()
+    stages = {"critical": [], "diagnosis": [], "complete": []}
+    for _ in range(repeats):
+        seen = set()
+        t0 = time.perf_counter()
+        async for item in stream_bytes(data, preprocess.sniff_media_type(data)):
+            elapsed = time.perf_counter() - t0
+            if "critical" not in seen and item.critical is not None:
+                seen.add("critical")
+                stages["critical"].append(elapsed)
+            if "diagnosis" not in seen and item.diagnosis_description:
+                seen.add("diagnosis")
+                stages["diagnosis"].append(elapsed)
+        stages["complete"].append(time.perf_counter() - t0)
+    return {name: summarise(values) for name, values in stages.items()}
+
+
+async def bench_repair(image: Path, repeats: int, args) -> dict:
+    data = image.read_bytes()
+    out = {}
+    for style in ("json", "fenced", "prose", "cased", "broken"):
+        runner, url = await StubServer(StubConfig(ttft=args.rad_ttft, tokens_per_s=args.rad_tps, report_style=style)).start()
+        model = OpenAIModel("stub-rad", provider=OpenAIProvider(base_url=url, api_key="stub"))
+        timings = []
+        try:
+            with radiology_agent.override(model=model), repair_agent.override(model=model), telemetry.turn("bench") as t:
+                for _ in range(repeats):
+                    t0 = time.perf_counter()
+                    await analyse_bytes(data, preprocess.sniff_media_type(data))
+                    timings.append(time.perf_counter() - t0)
+        finally:
+            await runner.cleanup()
+        out[style] = {
+            **summarise(timings),
+            "requests_per_call": round(t.counters["vlm.requests"] / repeats, 2),
+            "retry_request_tokens_per_call": round(t.counters["vlm.retry_request_tokens"] / repeats, 1),
+            "image_retries": t.counters["vlm.image_retries"],
+        }
+    return out
+
+
+async def bench_series(image: Path, tmp: Path, n: int = 8) -> dict:
+    from PIL import Image, ImageOps
+
+    study = tmp / "series"
+    study.mkdir(exist_ok=True)
+    with Image.open(image) as img:
+        base = img.convert("L")
+    for i in range(n):  # distinct bytes per slice, so nothing is served from the cache
+        ImageOps.autocontrast(base.rotate(i * 3), cutoff=i % 3).save(study / f"slice_{i:02d}.jpg")
+    items = series.collect_series(study)
+
+    async def fresh(data: bytes) -> dict:
+        return await analyse_image_data(data, use_cache=False)
+
+    out = {}
+    for name, concurrency, montage in (("one_by_one", 1, 0), ("fan_out", 4, 0), ("montage", 4, 4)):
+        stats = (await series.analyse_series(items, fresh, concurrency=concurrency, montage=montage))["stats"]
+        out[name] = {"calls": stats["calls"], "wall_s": stats["wall_s"]}
+    for name in ("fan_out", "montage"):  # against the measured one-by-one run, not an estimate
+        out[name]["speedup"] = round(out["one_by_one"]["wall_s"] / out[name]["wall_s"], 2)
+    return out
+
+
+async def bench_analyse_image(image: Path, repeats: int) -> dict:
+    stages = {"read": [], "preprocess": [], "vlm": [], "end_to_end": [], "cached": []}
+    path = resolve_image_path(str(image))
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        raw = await preprocess.read_bytes(path)
+        t1 = time.perf_counter()
+        prepared = await preprocess.prepare(raw)
+        t2 = time.perf_counter()
+        await analyse_bytes(prepared.data, prepared.media_type)
+        t3 = time.perf_counter()
+        stages["read"].append(t1 - t0)
+        stages["preprocess"].append(t2 - t1)
+        stages["vlm"].append(t3 - t2)
+
+        t0 = time.perf_counter()
+        await analyse_image(str(path), use_cache=False)
+        stages["end_to_end"].append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        await analyse_image(str(path))
+        stages["cached"].append(time.perf_counter() - t0)
+
+    out = {name: summarise(values) for name, values in stages.items()}
+    out["payload"] = {"bytes_in": prepared.original_bytes, "bytes_out": len(prepared.data)}
+    return out
+
+
+async def bench_coalescing(image: Path, callers: int) -> dict:
+    data = image.read_bytes()
+    with telemetry.turn("bench") as t:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(analyse_image_data(data, use_cache=False) for _ in range(callers)))
+        wall = time.perf_counter() - t0
+    return {
+        "callers": callers,
+        "wall_s": round(wall, 3),
+        "vlm_requests": t.counters["vlm.requests"],
+        "coalesced": t.counters["analyse.coalesced"],
+    }
+
+
+async def bench_sessions(
+    orchestrator: Agent,
+    image: Path,
+    sessions: int,
+    rounds: int,
+    *,
+    fast_path: bool = False,
+) -> dict:
+    """Concurrent sessions through the LLM-only flow, or through ``workflow.Workflow`` with ``fast_path``."""
+    per_turn: dict[int, list[float]] = {i: [] for i in range(len(SESSION_SCRIPT))}
+    requests = []
+
+    async def llm_turn(text, messages):
+        yield await orchestrator.run(text, message_history=messages)
+
+    async def session():
+        history = ConversationHistory()
+        flow = Workflow(SYSTEM_PROMPT)
+        for i, template in enumerate(SESSION_SCRIPT):
+            text = template.format(image=image)
+            t0 = time.perf_counter()
+            if fast_path:
+                events = flow.on_upload(str(image), history) if i == 0 else flow.on_message(text, history, llm_turn)
+            else:
+                events = llm_turn(text, history.messages)
+            async for ev in events:
+                if isinstance(ev, AgentRunResult):
+                    history.append_run(ev)
+                    requests.append(ev.usage().requests)
+            per_turn[i].append(time.perf_counter() - t0)
+
+    rss = [rss_mb()]
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(session() for _ in range(sessions)))
+        rss.append(rss_mb())
+    wall = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    await outbox.drain(timeout=60)
+    delivery = time.perf_counter() - t1
+
+    turns = sum(len(v) for v in per_turn.values())
+    return {
+        "sessions": sessions,
+        "rounds": rounds,
+        "turns_per_s": round(turns / wall, 3),
+        "orchestrator_requests_per_session": round(sum(requests) / (sessions * rounds), 2),
+        "turns": {SESSION_SCRIPT[i].split(":")[0]: summarise(v) for i, v in per_turn.items()},
+        "email_delivery_after_s": round(delivery, 3),
+        "rss_mb_start": round(rss[0], 1),
+        "rss_mb_end": round(rss[-1], 1),
+        "rss_mb_growth": round(rss[-1] - rss[0], 1),
+    }
+
+
+async def bench_session_store(orchestrator: Agent, image: Path, tmp: Path, n: int) -> dict:
+    store = SessionStore(tmp / "sessions", max_live=n)
+    ids = [f"bench-{i}" for i in range(n)]
+    saves, written = [], []
+
+    async def llm_turn(text, messages):
+        yield await orchestrator.run(text, message_history=messages)
+
+    async def session(session_id: str):
+        s = store.get(session_id)
+        for i, template in enumerate(SESSION_SCRIPT):
+            text = template.format(image=image)
+            events = s.workflow.on_upload(str(image), s.history) if i == 0 else s.workflow.on_message(text, s.history, llm_turn)
+            reply = ""
+            async for ev in events:
+                if isinstance(ev, str):
+                    reply += ev
+                elif isinstance(ev, AgentRunResult):
+                    s.history.append_run(ev)
+            s.display += [{"role": "user", "content": text}, {"role": "assistant", "content": reply}]
+            t0 = time.perf_counter()
+            written.append(store.save(s))
+            saves.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(session(sid) for sid in ids))
+    json_bytes = sum(len(ModelMessagesTypeAdapter.dump_json(store.get(sid).history.messages)) for sid in ids)
+    log_bytes = sum(path.stat().st_size for path in (tmp / "sessions").glob("*/*.log"))
+
+    def evict_all():
+        for sid in ids:
+            store.evict(sid)
+        gc.collect()
+
+    evict_all()
+    resumes = []
+    for sid in ids:
+        t0 = time.perf_counter()
+        store.get(sid)
+        resumes.append(time.perf_counter() - t0)
+
+    evict_all()  # again, with allocations traced
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for sid in ids:
+        store.get(sid)
+    live = tracemalloc.get_traced_memory()[0] - base
+    evict_all()
+    evicted = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    return {
+        "sessions": n,
+        "save": summarise(saves),
+        "bytes_per_save": round(sum(written) / len(written)),
+        "log_kb_per_session": round(log_bytes / n / 1024, 2),
+        "json_kb_per_session": round(json_bytes / n / 1024, 2),
+        "live_kb_per_session": round(live / n / 1024, 1),
+        "evicted_kb_per_session": round(max(evicted, 0) / n / 1024, 2),
+        "resume": summarise(resumes),
+    }
+
+
+async def bench_outbox(tmp: Path, args) -> dict:
+    """A burst of emails (every fifth one a duplicate) through a flaky fake MCP server."""
+    sent_file = tmp / "outbox-burst.jsonl"
+    pool = MCPServerPool(MCPServerStdio(
+        command=sys.executable,
+        args=[str(BENCH_DIR / "fake_mcp_email.py")],
+        env={**os.environ, "FAKE_MCP_OUTBOX": str(sent_file), "FAKE_MCP_LATENCY": str(args.mcp_latency),
+             "FAKE_MCP_FAIL_RATE": str(args.mcp_fail_rate)},
+    ))
+    box = Outbox(tmp / "burst.sqlite3", pool, base_delay=0.05, max_delay=1.0, max_attempts=20, rate_per_min=0)
+    enqueue = []
+    try:
+        with telemetry.turn("bench") as t:
+            await box.start()  # the worker task inherits the turn, so its counters land on t
+            t0 = time.perf_counter()
+            for i in range(args.emails):
+                n = i - i % 5 if i % 5 == 4 else i
+                e0 = time.perf_counter()
+                box.enqueue({"to": [f"reviewer{n}@example.com"], "subject": "Peer review request", "body": f"Case {n}"})
+                enqueue.append(time.perf_counter() - e0)
+            await box.drain(timeout=120)
+            wall = time.perf_counter() - t0
+    finally:
+        await box.stop()
+        await pool.close()
+    delivered = sum(1 for _ in sent_file.open()) if sent_file.exists() else 0
+    return {
+        "emails": args.emails,
+        "enqueue": summarise(enqueue),
+        "drain_s": round(wall, 3),
+        "delivered": delivered,
+        "duplicates": t.counters["outbox.duplicates"],
+        "retries": t.counters["outbox.retries"],
+        **box.stats(),
+    }
+
+
+async def bench_routing(image: Path, args) -> dict:
+    data = image.read_bytes()
+    media_type = preprocess.sniff_media_type(data)
+    stubs = [
+        StubServer(StubConfig(ttft=args.rad_ttft, tokens_per_s=args.rad_tps,
+                              slow_rate=args.slow_rate, slow_delay=args.slow_delay))
+        for _ in range(2)
+    ]
+    stubs.append(StubServer(StubConfig(fail_rate=1.0)))
+    started = [await stub.start() for stub in stubs]
+    healthy, failing = [url for _, url in started[:2]], started[2][1]
+    dead = "http://127.0.0.1:9/v1"  # nothing listens on the discard port
+
+    out = {}
+    try:
+        for name, urls, hedge in (
+            ("single", healthy[:1], False),
+            ("routed", [dead, failing, *healthy], False),
+            ("routed_hedged", [dead, failing, *healthy], True),
+        ):
+            random.seed(0)  # same slow responses for every configuration
+            router = EndpointRouter(urls, hedge=hedge, hedge_min_samples=10, health_interval=0, cooldown=60)
+            model = OpenAIModel("stub-rad", provider=OpenAIProvider(
+                base_url=urls[0], api_key="stub", http_client=httpx.AsyncClient(transport=router),
+            ))
+            semaphore = asyncio.Semaphore(4)
+            timings = []
+
+            async def call():
+                async with semaphore:
+                    t0 = time.perf_counter()
+                    await analyse_bytes(data, media_type)
+                    timings.append(time.perf_counter() - t0)
+
+            with radiology_agent.override(model=model), repair_agent.override(model=model):
+                await asyncio.gather(*(call() for _ in range(args.routed_calls)))
+            await router.aclose()
+            out[name] = {
+                **summarise(timings),
+                "p99_ms": round(1000 * percentile(timings, 99), 1),
+                "failovers": router.failovers,
+                "hedges": sum(ep["hedges"] for ep in router.stats()),
+                "replicas": {ep["endpoint"]: {k: ep[k] for k in ("state", "requests", "errors", "hedge_wins")}
+                             for ep in router.stats()},
+            }
+    finally:
+        for runner, _ in started:
+            await runner.cleanup()
+    return out
+
+
+async def run(args) -> dict:
+    rad_runner, rad_url = await StubServer(StubConfig(ttft=args.rad_ttft, tokens_per_s=args.rad_tps)).start()
+    orch_runner, orch_url = await StubServer(StubConfig(ttft=args.orch_ttft, tokens_per_s=args.orch_tps)).start()
+    rad_model = OpenAIModel("stub-rad", provider=OpenAIProvider(base_url=rad_url, api_key="stub"))
+    orch_model = OpenAIModel("stub-orch", provider=OpenAIProvider(base_url=orch_url, api_key="stub"))
+
+    tmp = Path(tempfile.mkdtemp(prefix="radbench-"))
+    report_cache.directory = tmp / "reports"  # never touch the real cache
+    report_cache.clear()
+    outbox.path = tmp / "outbox.sqlite3"  # nor the real outbox
+
+    pool = MCPServerPool(MCPServerStdio(
+        command=sys.executable,
+        args=[str(BENCH_DIR / "fake_mcp_email.py")],
+        env={**os.environ, "FAKE_MCP_OUTBOX": str(tmp / "outbox.jsonl"), "FAKE_MCP_LATENCY": str(args.mcp_latency)},
+    ))
+    orchestrator = Agent(
+        model=orch_model,
+        tools=[analyse_image_base64, analyse_series_tool, show_reference_images_tool, send_email],
+        system_prompt=SYSTEM_PROMPT,
+    )
+
+    results = {}
+    try:
+        with radiology_agent.override(model=rad_model), repair_agent.override(model=rad_model):
+            results["radiology_agent"] = await bench_radiology(args.image, args.repeats)
+            results["radiology_stream"] = await bench_stream(args.image, args.repeats)
+            results["report_repair"] = await bench_repair(args.image, args.repeats, args)
+            results["analyse_image"] = await bench_analyse_image(args.image, args.repeats)
+            results["series"] = await bench_series(args.image, tmp)
+            results["coalescing"] = await bench_coalescing(args.image, args.callers)
+            t0 = time.perf_counter()
+            await pool.ensure_running()
+            results["mcp_start_s"] = round(time.perf_counter() - t0, 3)
+            outbox.pool = pool
+            await outbox.start()
+            report_cache.clear()
+            results["orchestrator"] = await bench_sessions(orchestrator, args.image, args.sessions, args.rounds)
+            report_cache.clear()
+            results["orchestrator_fast_path"] = await bench_sessions(
+                orchestrator, args.image, args.sessions, args.rounds, fast_path=True,
+            )
+            results["outbox"] = await bench_outbox(tmp, args)
+            results["session_store"] = await bench_session_store(orchestrator, args.image, tmp, args.stored_sessions)
+        results["routing"] = await bench_routing(args.image, args)
+    finally:
+        await outbox.stop()
+        await pool.close()
+        await rad_runner.cleanup()
+        await orch_runner.cleanup()
+    return results
+
+
+# ── baselines ─────────────────────────────────────────────────────────────
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Metrics more than ``tolerance`` worse than the baseline."""
+    regressions = []
+    new, old = _flatten(results), _flatten(baseline)
+    for key, before in old.items():
+        after = new.get(key)
+        if after is None or not before:
+            continue
+        if key.endswith("_per_s"):
+            worse = after < before * (1 - tolerance)
+        elif key.endswith(("_ms", "_s", "rss_mb_growth")):
+            worse = after > before * (1 + tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append(f"{key}: {before} -> {after}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks with stub servers.")
+    parser.add_argument("--image", type=Path, default=DEFAULT_IMAGE)
+    parser.add_argument("--repeats", type=int, default=5, help="calls per single-image scenario")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent chat sessions")
+    parser.add_argument("--rounds", type=int, default=2, help="times the session batch is repeated")
+    parser.add_argument("--rad-ttft", type=float, default=0.3)
+    parser.add_argument("--rad-tps", type=float, default=60.0)
+    parser.add_argument("--orch-ttft", type=float, default=0.1)
+    parser.add_argument("--orch-tps", type=float, default=120.0)
+    parser.add_argument("--mcp-latency", type=float, default=0.2)
+    parser.add_argument("--mcp-fail-rate", type=float, default=0.2, help="fraction of fake sends that fail")
+    parser.add_argument("--callers", type=int, default=8, help="concurrent callers in the coalescing scenario")
+    parser.add_argument("--stored-sessions", type=int, default=50, help="sessions in the session store scenario")
+    parser.add_argument("--emails", type=int, default=50, help="emails in the outbox burst")
+    parser.add_argument("--slow-rate", type=float, default=0.04, help="fraction of slow replica responses")
+    parser.add_argument("--slow-delay", type=float, default=5.0, help="extra seconds for a slow response")
+    parser.add_argument("--routed-calls", type=int, default=60, help="calls per routing configuration")
+    parser.add_argument("--save", metavar="NAME", help="store results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    args.image = args.image.resolve()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        (BASELINE_DIR / f"{args.save}.json").write_text(json.dumps(results, indent=2))
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text())
+        if regressions := compare(results, baseline, args.tolerance):
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Startup benchmarks: import time and time to first response.
+
+• import         – ``import <module>`` in a fresh interpreter, median of
+  ``--repeats``, for the modules a process starts from
+• first_response – a fresh process imports ``orchestrator`` and sends one
+  chat message against stub RAD/ORCH servers whose first completion is
+  ``--cold-start`` seconds slower (a model server loading weights or
+  filling its caches):
+    cold   – the message is sent right after the imports
+    warmed – ``warmup.warm_up()`` runs first (MCP step off); its duration
+             is reported as ``warmup_ms``
+  ``first_delta_ms`` is message to first streamed text and ``total_ms``
+  process start to first text, medians of ``--repeats`` processes, each
+  against fresh stubs
+
+Results are printed as JSON; ``--save`` / ``--compare`` work as in
+``bench.run``.
+
+    cd src && python -m bench.startup --save local
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# nothing heavy at module level: the child process below is what is measured
+SRC_DIR = Path(__file__).resolve().parent.parent
+MODULES = ["config", "tools_orchestrator", "orchestrator", "service", "app_streamlit"]
+
+
+def import_ms(module: str, repeats: int) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    runs = [
+        float(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True,
+                             cwd=SRC_DIR).stdout.split()[-1])
+        for _ in range(repeats)
+    ]
+    return round(1000 * statistics.median(runs), 1)
+
+
+async def first_response(mode: str, args) -> dict:
+    from bench.stub_openai import StubConfig, StubServer
+
+    stubs = [
+        await StubServer(StubConfig(ttft=args.ttft, cold_start=args.cold_start)).start()
+        for _ in ("RAD", "ORCH")
+    ]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "bench.startup", "_child", mode, stubs[0][1], stubs[1][1],
+            cwd=SRC_DIR, stdout=asyncio.subprocess.PIPE,
+        )
+        out, _ = await proc.communicate()
+        if proc.returncode:
+            raise RuntimeError(f"{mode} child exited with {proc.returncode}")
+        return json.loads(out.decode().splitlines()[-1])
+    finally:
+        for runner, _ in stubs:
+            await runner.cleanup()
+
+
+def _child(mode: str, rad_url: str, orch_url: str) -> None:
+    t0 = time.perf_counter()
+    import config
+
+    # the project's .env wins over the environment, so point the roles at the stubs here
+    config.RAD_API_BASES, config.RAD_MODEL_NAME = [rad_url], "stub-rad"
+    config.ORCH_API_BASES, config.ORCH_MODEL_NAME = [orch_url], "stub-orch"
+    os.environ["RAD_API_KEY"] = os.environ["ORCH_API_KEY"] = "stub"
+
+    import orchestrator
+    result = {"import_ms": round(1000 * (time.perf_counter() - t0), 1)}
+
+    async def main() -> None:
+        if mode == "warmed":
+            import warmup
+
+            t1 = time.perf_counter()
+            status = await warmup.warm_up(mcp=False)
+            result["warmup_ms"] = round(1000 * (time.perf_counter() - t1), 1)
+            result["warmup_errors"] = status["errors"]
+        agent = await orchestrator.build_orchestrator()
+        t1 = time.perf_counter()
+        async for event in orchestrator.turn_events(agent, "hello", []):
+            if isinstance(event, str) and "first_delta_ms" not in result:
+                now = time.perf_counter()
+                result["first_delta_ms"] = round(1000 * (now - t1), 1)
+                result["total_ms"] = round(1000 * (now - t0), 1)
+
+    asyncio.run(main())
+    print(json.dumps(result))
+
+
+async def run(args) -> dict:
+    results: dict = {"import": {f"{m}_ms": import_ms(m, args.repeats) for m in MODULES}, "first_response": {}}
+    for mode in ("cold", "warmed"):
+        runs = [await first_response(mode, args) for _ in range(args.repeats)]
+        summary = {
+            key: round(statistics.median(r[key] for r in runs), 1)
+            for key in runs[0] if key.endswith("_ms")
+        }
+        if errors := [r["warmup_errors"] for r in runs if r.get("warmup_errors")]:
+            summary["warmup_errors"] = errors[0]
+        results["first_response"][mode] = summary
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    from bench.run import BASELINE_DIR, compare
+
+    parser = argparse.ArgumentParser(description="Import time and time-to-first-response benchmarks.")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh processes per measurement")
+    parser.add_argument("--ttft", type=float, default=0.1, help="stub time to first token")
+    parser.add_argument("--cold-start", type=float, default=1.0, help="extra seconds for a stub's first completion")
+    parser.add_argument("--save", metavar="NAME", help="store results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        (BASELINE_DIR / f"startup-{args.save}.json").write_text(json.dumps(results, indent=2))
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"startup-{args.compare}.json").read_text())
+        if regressions := compare(results, baseline, args.tolerance):
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["_child"]:
+        _child(*sys.argv[2:5])
+    else:
+        main()
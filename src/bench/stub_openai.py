@@ -0,0 +1,272 @@
+"""
+Local OpenAI-compatible stand-in for the RAD and ORCH model servers.
+
+Only ``POST /v1/chat/completions`` (streaming and non-streaming) and
+``GET /v1/models`` are implemented.  Latency is modelled as
+
+    time-to-first-token = ttft + prompt_tokens / prefill_tps
+    generation          = completion_tokens / tokens_per_s
+
+Answers are canned:
+
+• a request offering the ``final_result`` tool (pydantic-ai structured
+  output) gets ``report`` back as that tool call
+• a request for JSON-schema output (``response_format`` / ``guided_json``)
+  gets ``report`` as text; requests carrying an image get it in
+  ``report_style`` ("json", "fenced", "prose", "cased" or "broken"), so the
+  local repair and text-only retries can be exercised
+• otherwise the last user message is matched against ``rules`` in order;
+  a rule either calls a tool (``args`` may use named regex groups) or
+  replies with ``text``
+• a request ending in a tool result gets ``after_tool`` text
+
+``slow_rate`` of the requests take ``slow_delay`` seconds longer (a latency
+tail) and ``fail_rate`` of them get a 503, for exercising the endpoint router.
+The first completion takes ``cold_start`` seconds longer, like a server
+that loads the model or fills its caches on first use.
+
+    python -m bench.stub_openai --port 8001 --ttft 0.3 --tokens-per-s 60
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+DEFAULT_REPORT = {
+    "critical": True,
+    "diagnosis_description": (
+        "Frontal chest radiograph shows a 2.5 cm spiculated opacity in the right upper lobe. "
+        "The cardiomediastinal silhouette is within normal limits. "
+        "No pleural effusion or pneumothorax is seen."
+    ),
+    "clinical_recommendations": "Contrast-enhanced chest CT and referral to pulmonology for biopsy planning.",
+}
+
+DEFAULT_RULES = [
+    {"match": r"Analy[sz]e this image: (?P<path>\S+)", "tool": "analyse_image_base64", "args": {"path": "{path}"}},
+    {"match": r"show (them|reference)", "tool": "show_reference_images_tool", "args": {"confirm": "yes"}},
+    {"match": r"send (it|this|the email) to (?P<to>\S+@\S+)", "tool": "send_email",
+     "args": {"to": ["{to}"], "subject": "Peer review request", "body": "Please review this critical case."}},
+    {"match": r"peer review|draft", "text": (
+        "Subject: Peer review request\n\nDear colleague,\n\nPlease review the attached critical case.\n\n"
+        "Would you like me to send this email?"
+    )},
+    {"match": r".*", "text": "Understood. Is there anything else you would like to know about this case?"},
+]
+
+DEFAULT_AFTER_TOOL = (
+    "Diagnosis: see report above.\nCritical: Yes\n\n"
+    "Would you like to view reference images from similar confirmed cases?"
+)
+
+
+@dataclass
+class StubConfig:
+    ttft: float = 0.2
+    prefill_tps: float = 20000.0
+    tokens_per_s: float = 80.0
+    report: dict = field(default_factory=lambda: dict(DEFAULT_REPORT))
+    rules: list[dict] = field(default_factory=lambda: list(DEFAULT_RULES))
+    after_tool: str = DEFAULT_AFTER_TOOL
+    report_style: str = "json"
+    slow_rate: float = 0.0
+    slow_delay: float = 0.0
+    fail_rate: float = 0.0
+    cold_start: float = 0.0
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _has_image(messages: list[dict]) -> bool:
+    return any(
+        isinstance(msg.get("content"), list) and any(p.get("type") == "image_url" for p in msg["content"])
+        for msg in messages
+    )
+
+
+def styled_report(report: dict, style: str) -> str:
+    """The report as a model that ignores (or lacks) constrained decoding might write it."""
+    text = json.dumps(report)
+    if style == "fenced":
+        return f"```json\n{text}\n```"
+    if style == "prose":
+        return f"Here is the report:\n{text}\nLet me know if you need anything else."
+    if style == "cased":
+        return json.dumps({"".join(w.title() for w in k.split("_")): v for k, v in report.items()})
+    if style == "broken":
+        return text[:-1] + ',"clinical_recommendations"'
+    return text
+
+
+def _last_user_text(messages: list[dict]) -> str:
+    for msg in reversed(messages):
+        if msg.get("role") != "user":
+            continue
+        content = msg.get("content")
+        if isinstance(content, str):
+            return content
+        return " ".join(p.get("text", "") for p in content or [] if p.get("type") == "text")
+    return ""
+
+
+class StubServer:
+    def __init__(self, config: StubConfig | None = None):
+        self.config = config or StubConfig()
+        self.requests = 0
+        self._cold = True
+        self._ids = itertools.count()
+
+    # ── answer selection ──────────────────────────────────────────────────
+    def answer(self, body: dict) -> tuple[str | None, dict | None]:
+        """Return (text, tool_call) for a chat request."""
+        tools = {t["function"]["name"] for t in body.get("tools", [])}
+        messages = body.get("messages", [])
+
+        if "final_result" in tools:
+            return None, {"name": "final_result", "arguments": json.dumps(self.config.report)}
+        if "response_format" in body or "guided_json" in body:
+            style = self.config.report_style if _has_image(messages) else "json"
+            return styled_report(self.config.report, style), None
+        if messages and messages[-1].get("role") == "tool":
+            return self.config.after_tool, None
+
+        text = _last_user_text(messages)
+        for rule in self.config.rules:
+            m = re.search(rule["match"], text, re.IGNORECASE)
+            if not m:
+                continue
+            if "tool" in rule and (not tools or rule["tool"] in tools):
+                args = _fill(rule.get("args", {}), m.groupdict())
+                return None, {"name": rule["tool"], "arguments": json.dumps(args)}
+            if "text" in rule:
+                return rule["text"], None
+        return "OK.", None
+
+    # ── HTTP handlers ─────────────────────────────────────────────────────
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        try:
+            body = await request.json()
+        except ConnectionResetError:  # the client gave up (e.g. a cancelled hedge)
+            return web.Response(status=499)
+        if random.random() < self.config.fail_rate:
+            return web.json_response({"error": {"message": "stub replica unavailable"}}, status=503)
+        prompt_tokens = _tokens(json.dumps(body.get("messages", [])))
+        text, tool_call = self.answer(body)
+        completion = text if text is not None else tool_call["arguments"]
+        completion_tokens = _tokens(completion)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        cid = f"chatcmpl-{next(self._ids)}"
+        call_id = f"call_{cid}"
+        model = body.get("model", "stub")
+        finish = "tool_calls" if tool_call else "stop"
+
+        slow = self.config.slow_delay if random.random() < self.config.slow_rate else 0.0
+        if self._cold:
+            self._cold, slow = False, slow + self.config.cold_start
+        await asyncio.sleep(self.config.ttft + prompt_tokens / self.config.prefill_tps + slow)
+
+        if not body.get("stream"):
+            await asyncio.sleep(completion_tokens / self.config.tokens_per_s)
+            message = {"role": "assistant", "content": text}
+            if tool_call:
+                message["tool_calls"] = [{"id": call_id, "type": "function", "function": tool_call}]
+            return web.json_response({
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+                "usage": usage,
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+
+        async def send(delta: dict, finish_reason: str | None = None, **extra):
+            chunk = {
+                "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra,
+            }
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        pieces = [completion[i:i + 4] for i in range(0, len(completion), 4)]
+        if tool_call:
+            await send({"role": "assistant", "tool_calls": [{
+                "index": 0, "id": call_id, "type": "function",
+                "function": {"name": tool_call["name"], "arguments": ""},
+            }]})
+        for piece in pieces:
+            await asyncio.sleep(1 / self.config.tokens_per_s)
+            if tool_call:
+                await send({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+            else:
+                await send({"role": "assistant", "content": piece})
+        await send({}, finish, usage=usage)
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_get("/v1/models", self.models)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+        """Serve on the running loop; returns the runner and the ``/v1`` base URL."""
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{port}/v1"
+
+
+def _fill(value, groups: dict):
+    if isinstance(value, str):
+        return value.format(**groups)
+    if isinstance(value, list):
+        return [_fill(v, groups) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill(v, groups) for k, v in value.items()}
+    return value
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub model server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--prefill-tps", type=float, default=20000.0, help="prompt tokens processed per second")
+    parser.add_argument("--tokens-per-s", type=float, default=80.0, help="generation speed")
+    parser.add_argument("--report-style", default="json", help="json, fenced, prose, cased or broken")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that are slow")
+    parser.add_argument("--slow-delay", type=float, default=0.0, help="extra seconds for a slow request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--cold-start", type=float, default=0.0, help="extra seconds for the first completion")
+    parser.add_argument("--script", type=argparse.FileType(), help="JSON with report / rules / after_tool overrides")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(ttft=args.ttft, prefill_tps=args.prefill_tps, tokens_per_s=args.tokens_per_s,
+                        report_style=args.report_style, slow_rate=args.slow_rate, slow_delay=args.slow_delay,
+                        fail_rate=args.fail_rate, cold_start=args.cold_start)
+    if args.script:
+        for key, value in json.load(args.script).items():
+            setattr(config, key, value)
+    web.run_app(StubServer(config).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,245 @@
+from __future__ import annotations
+
 import os
+from typing import TYPE_CHECKING
+
 from dotenv import load_dotenv
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 from pathlib import Path
 
-# Load environment variables from .env
-load_dotenv()
-load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env", override=True)
+if TYPE_CHECKING:  # httpx, pydantic-ai and the router are imported where they are used
+    import httpx
+    from pydantic_ai.models import Model
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Load environment variables from the project's .env (they win over the shell's)
+load_dotenv(dotenv_path=PROJECT_ROOT / ".env", override=True)
+
+
+# ───────────────────────────────────────────────
+# Endpoint Routing Config
+# ───────────────────────────────────────────────
+ROUTER_FAIL_THRESHOLD = int(os.getenv("ROUTER_FAIL_THRESHOLD", "3"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+ROUTER_HEALTH_INTERVAL = float(os.getenv("ROUTER_HEALTH_INTERVAL", "15"))  # 0 = passive checks only
+ROUTER_HEALTH_TIMEOUT = float(os.getenv("ROUTER_HEALTH_TIMEOUT", "5"))
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "0") not in ("0", "false", "no")
+ROUTER_HEDGE_QUANTILE = float(os.getenv("ROUTER_HEDGE_QUANTILE", "95"))
+ROUTER_HEDGE_MIN_DELAY = float(os.getenv("ROUTER_HEDGE_MIN_DELAY", "0.05"))
+
+
+def api_bases(prefix: str) -> list[str]:
+    """Replicas of one role: ``<prefix>_API_BASES`` (comma-separated), else ``<prefix>_API_BASE``."""
+    value = os.getenv(f"{prefix}_API_BASES") or os.getenv(f"{prefix}_API_BASE") or ""
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+def make_http_client(prefix: str, base_urls: list[str] | None = None) -> httpx.AsyncClient:
+    """
+    Pooled keep-alive client for one model endpoint.
+
+    Pool sizes come from ``<prefix>_HTTP_MAX_CONNECTIONS`` /
+    ``<prefix>_HTTP_MAX_KEEPALIVE``; HTTP/2 is used when ``h2`` is installed.
+    With several ``base_urls`` the client routes over them with an
+    ``EndpointRouter`` (one pool per replica), registered under ``prefix``.
+    """
+    import httpx
+
+    import endpoint_router
+
+    try:
+        import h2  # noqa: F401
+        http2 = os.getenv("HTTP2", "1") not in ("0", "false", "no")
+    except ImportError:
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv(f"{prefix}_HTTP_MAX_CONNECTIONS", "32")),
+        max_keepalive_connections=int(os.getenv(f"{prefix}_HTTP_MAX_KEEPALIVE", "16")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "120")),
+    )
+    timeout = httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "600")), connect=10.0)
+    if not base_urls or len(base_urls) < 2:
+        return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+    router = endpoint_router.routers[prefix] = endpoint_router.EndpointRouter(
+        base_urls,
+        transport_factory=lambda: httpx.AsyncHTTPTransport(http2=http2, limits=limits),
+        fail_threshold=ROUTER_FAIL_THRESHOLD,
+        cooldown=ROUTER_COOLDOWN,
+        health_interval=ROUTER_HEALTH_INTERVAL,
+        health_timeout=ROUTER_HEALTH_TIMEOUT,
+        hedge=ROUTER_HEDGE,
+        hedge_quantile=ROUTER_HEDGE_QUANTILE,
+        hedge_min_delay=ROUTER_HEDGE_MIN_DELAY,
+    )
+    return httpx.AsyncClient(transport=router, timeout=timeout)
+
+
+def openai_model(prefix: str, model_name: str | None, base_urls: list[str]) -> Model:
+    """An ``OpenAIModel`` for one role, on that role's pooled (and possibly routed) client."""
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    provider = OpenAIProvider(
+        base_url=base_urls[0] if base_urls else None,
+        api_key=os.getenv(f"{prefix}_API_KEY"),
+        http_client=make_http_client(prefix, base_urls),
+    )
+    return OpenAIModel(model_name, provider=provider)
 
 # ───────────────────────────────────────────────
 # Radiology Agent Config
 # ───────────────────────────────────────────────
-rad_provider = OpenAIProvider(
-    base_url=os.getenv("RAD_API_BASE"),
-    api_key=os.getenv("RAD_API_KEY"),
-)
-vlm_model = OpenAIModel(os.getenv("RAD_MODEL_NAME"), provider=rad_provider)
+RAD_MODEL_NAME = os.getenv("RAD_MODEL_NAME")
+
+RAD_API_BASES = api_bases("RAD")
+
+# vlm_model: created on first access, see __getattr__ below
 
 # ───────────────────────────────────────────────
 # Orchestrator Agent Config
 # ───────────────────────────────────────────────
-orc_provider = OpenAIProvider(
-    base_url=os.getenv("ORCH_API_BASE"),
-    api_key=os.getenv("ORCH_API_KEY"),
-)
-orch_model = OpenAIModel(os.getenv("ORCH_MODEL_NAME"), provider=orc_provider)
+ORCH_MODEL_NAME = os.getenv("ORCH_MODEL_NAME")
+
+ORCH_API_BASES = api_bases("ORCH")
+
+# orch_model: created on first access, see __getattr__ below
 
+_MODELS = {
+    "vlm_model": lambda: openai_model("RAD", RAD_MODEL_NAME, RAD_API_BASES),
+    "orch_model": lambda: openai_model("ORCH", ORCH_MODEL_NAME, ORCH_API_BASES),
+}
+
+
+def __getattr__(name: str):
+    """
+    ``vlm_model`` / ``orch_model`` are ``LazyModel``s, which import pydantic-ai,
+    so they are created on first access and a bare ``import config`` stays cheap.
+    """
+    if name in _MODELS:
+        from lazy_model import LazyModel
+
+        model = globals()[name] = LazyModel(_MODELS[name])
+        return model
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ───────────────────────────────────────────────
+# Warm-up Config
+# ───────────────────────────────────────────────
+WARMUP = os.getenv("WARMUP", "1") not in ("0", "false", "no")  # warm up when the app / service starts
+WARMUP_PROBE = os.getenv("WARMUP_PROBE", "1") not in ("0", "false", "no")  # one-token completion per role
+WARMUP_MCP = os.getenv("WARMUP_MCP", "1") not in ("0", "false", "no")  # pre-fetch the npx package
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))  # per model request
+WARMUP_MCP_TIMEOUT = float(os.getenv("WARMUP_MCP_TIMEOUT", "300"))
+
+# ───────────────────────────────────────────────
+# Radiology Output Config
+# ───────────────────────────────────────────────
+RAD_GUIDED_DECODING = os.getenv("RAD_GUIDED_DECODING", "json_schema")  # json_schema | guided_json | off
+RAD_REPAIR_RETRIES = int(os.getenv("RAD_REPAIR_RETRIES", "2"))
+RAD_IMAGE_RETRIES = int(os.getenv("RAD_IMAGE_RETRIES", "1"))
+
+# ───────────────────────────────────────────────
+# Report Cache Config
+# ───────────────────────────────────────────────
+REPORT_CACHE_ENABLED = os.getenv("REPORT_CACHE_ENABLED", "1") not in ("0", "false", "no")
+REPORT_CACHE_DIR = PROJECT_ROOT / os.getenv("REPORT_CACHE_DIR", ".cache/reports")
+REPORT_CACHE_MEMORY_ITEMS = int(os.getenv("REPORT_CACHE_MEMORY_ITEMS", "256"))
+REPORT_CACHE_MAX_MB = float(os.getenv("REPORT_CACHE_MAX_MB", "256"))
+REPORT_CACHE_MAX_AGE_DAYS = float(os.getenv("REPORT_CACHE_MAX_AGE_DAYS", "30"))
+
+# ───────────────────────────────────────────────
+# Upload Store Config
+# ───────────────────────────────────────────────
+UPLOAD_DIR = PROJECT_ROOT / os.getenv("UPLOAD_DIR", ".cache/uploads")
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "200"))  # per file
+UPLOAD_QUOTA_MB = float(os.getenv("UPLOAD_QUOTA_MB", "2048"))  # whole store
+UPLOAD_MAX_AGE_DAYS = float(os.getenv("UPLOAD_MAX_AGE_DAYS", "7"))
+
+# ───────────────────────────────────────────────
+# HTTP Service Config
+# ───────────────────────────────────────────────
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4"))  # analyses running at once
+SERVICE_QUEUE_SIZE = int(os.getenv("SERVICE_QUEUE_SIZE", "64"))  # waiting analyses before 429
+SERVICE_CHAT_CONCURRENCY = int(os.getenv("SERVICE_CHAT_CONCURRENCY", "8"))
+SERVICE_JOB_TTL = float(os.getenv("SERVICE_JOB_TTL", "3600"))  # seconds a finished job stays pollable
+SERVICE_ALLOW_PATHS = os.getenv("SERVICE_ALLOW_PATHS", "0") not in ("0", "false", "no")
+
+# ───────────────────────────────────────────────
+# Session Store Config
+# ───────────────────────────────────────────────
+SESSION_DIR = PROJECT_ROOT / os.getenv("SESSION_DIR", ".cache/sessions")
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "900"))  # idle seconds before a session leaves memory
+SESSION_MAX_LIVE = int(os.getenv("SESSION_MAX_LIVE", "1000"))  # sessions kept in memory
+SESSION_MAX_AGE_DAYS = float(os.getenv("SESSION_MAX_AGE_DAYS", "30"))  # unused logs are deleted after this
+
+# ───────────────────────────────────────────────
+# Batch Analysis Config
+# ───────────────────────────────────────────────
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# ───────────────────────────────────────────────
+# Series Analysis Config
+# ───────────────────────────────────────────────
+SERIES_CONCURRENCY = int(os.getenv("SERIES_CONCURRENCY", "4"))
+SERIES_MONTAGE = int(os.getenv("SERIES_MONTAGE", "0"))  # slices per montage; 0/1 = one call per image
+SERIES_MAX_IMAGES = int(os.getenv("SERIES_MAX_IMAGES", "32"))
+
+# ───────────────────────────────────────────────
+# Image Preprocessing Config
+# ───────────────────────────────────────────────
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") not in ("0", "false", "no")
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") not in ("0", "false", "no")
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# ───────────────────────────────────────────────
+# DICOM Config
+# ───────────────────────────────────────────────
+DICOM_FRAME = os.getenv("DICOM_FRAME", "middle")  # middle | first | <index>
+
+# ───────────────────────────────────────────────
+# MCP Server Pool Config
+# ───────────────────────────────────────────────
+MCP_HEALTH_INTERVAL = float(os.getenv("MCP_HEALTH_INTERVAL", "30"))
+MCP_HEALTH_TIMEOUT = float(os.getenv("MCP_HEALTH_TIMEOUT", "5"))
+MCP_START_TIMEOUT = float(os.getenv("MCP_START_TIMEOUT", "120"))
+
+# ───────────────────────────────────────────────
+# Email Outbox Config
+# ───────────────────────────────────────────────
+OUTBOX_DB = PROJECT_ROOT / os.getenv("OUTBOX_DB", ".cache/outbox.sqlite3")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BASE_DELAY = float(os.getenv("OUTBOX_BASE_DELAY", "5"))
+OUTBOX_MAX_DELAY = float(os.getenv("OUTBOX_MAX_DELAY", "600"))
+OUTBOX_RATE_PER_MIN = float(os.getenv("OUTBOX_RATE_PER_MIN", "20"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "300"))
+
+# ───────────────────────────────────────────────
+# Conversation History Config
+# ───────────────────────────────────────────────
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "2"))
+
+# ───────────────────────────────────────────────
+# Reference Case Index Config
+# ───────────────────────────────────────────────
+REFERENCE_INDEX_DIR = PROJECT_ROOT / os.getenv("REFERENCE_INDEX_DIR", ".cache/reference_index")
+REFERENCE_TOP_K = int(os.getenv("REFERENCE_TOP_K", "4"))
+REFERENCE_N_PROBE = int(os.getenv("REFERENCE_N_PROBE", "8"))
+
+# ───────────────────────────────────────────────
+# Telemetry Config
+# ───────────────────────────────────────────────
+TELEMETRY_JSONL = os.getenv("TELEMETRY_JSONL")
+TELEMETRY_PROM_FILE = os.getenv("TELEMETRY_PROM_FILE")
+TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", "500"))
+
+# ───────────────────────────────────────────────
+# Streaming Analysis Config
+# ───────────────────────────────────────────────
+ANALYSE_STREAM = os.getenv("ANALYSE_STREAM", "1") not in ("0", "false", "no")
+ANALYSE_STREAM_DEBOUNCE = float(os.getenv("ANALYSE_STREAM_DEBOUNCE", "0.05"))
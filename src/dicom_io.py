@@ -0,0 +1,363 @@
+"""
+DICOM ingestion without loading whole studies into memory.
+
+Headers are parsed with ``stop_before_pixels``.  Uncompressed pixel data is
+memory-mapped straight from the file (only the pages of the frame being
+rendered are ever read); compressed transfer syntaxes are decoded one frame
+at a time with ``pydicom.pixels.pixel_array(index=...)`` (pydicom ≥ 3, older
+versions fall back to decoding the whole dataset).  Large frames are
+subsampled before the modality LUT (rescale slope/intercept) and VOI
+windowing are applied as whole-array NumPy operations, and the result goes
+through the usual preprocessing as an 8-bit grayscale JPEG.
+
+    python src/dicom_io.py info study.dcm
+    python src/dicom_io.py render study.dcm out.jpg --frame 12
+    python src/dicom_io.py bench --frames 100 --size 1024
+
+``pydicom`` is optional and only imported when the first DICOM file is
+read; without it DICOM files are rejected with a clear error and everything
+else keeps working.
+"""
+import argparse
+import io
+import json
+import math
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from config import DICOM_FRAME, IMAGE_MAX_EDGE
+
+pydicom = None  # optional dependency, imported by _require_pydicom
+_decode_frame = None
+
+DICOM_SUFFIXES = {".dcm", ".dicom"}
+PIXEL_DATA = 0x7FE00010
+
+
+def is_dicom(head: bytes) -> bool:
+    """Part 10 files carry "DICM" after a 128-byte preamble."""
+    return head[128:132] == b"DICM"
+
+
+def is_dicom_path(path: Path) -> bool:
+    suffix = path.suffix.lower()
+    if suffix in DICOM_SUFFIXES:
+        return True
+    if suffix in (".jpg", ".jpeg", ".png"):
+        return False
+    with open(path, "rb") as f:
+        return is_dicom(f.read(132))
+
+
+def _require_pydicom() -> None:
+    global pydicom, _decode_frame
+    if pydicom is not None:
+        return
+    try:
+        import pydicom as module
+        import pydicom.uid  # noqa: F401
+    except ImportError:
+        raise RuntimeError("DICOM support needs the optional 'pydicom' package (pip install pydicom)") from None
+    try:
+        from pydicom.pixels import pixel_array as _decode_frame
+    except ImportError:
+        pass
+    pydicom = module
+
+
+@dataclass
+class DicomInfo:
+    rows: int
+    columns: int
+    frames: int
+    samples_per_pixel: int
+    bits_allocated: int
+    bits_stored: int
+    signed: bool
+    photometric: str
+    transfer_syntax: str
+    compressed: bool
+    slope: float = 1.0
+    intercept: float = 0.0
+    window_center: float | None = None
+    window_width: float | None = None
+    modality: str = ""
+    body_part: str = ""
+    sop_instance_uid: str = ""
+    series_instance_uid: str = ""
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def _first(value) -> float | None:
+    """First value of a possibly multi-valued numeric attribute (e.g. WindowCenter)."""
+    if value is not None and not isinstance(value, (str, bytes, int, float)):
+        value = value[0] if len(value) else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_info(path: Path) -> DicomInfo:
+    """Parse the header only; pixel data is never read."""
+    _require_pydicom()
+    ds = pydicom.dcmread(path, stop_before_pixels=True)
+    syntax = pydicom.uid.UID(ds.file_meta.TransferSyntaxUID)
+    return DicomInfo(
+        rows=int(ds.Rows),
+        columns=int(ds.Columns),
+        frames=int(getattr(ds, "NumberOfFrames", 1) or 1),
+        samples_per_pixel=int(getattr(ds, "SamplesPerPixel", 1)),
+        bits_allocated=int(ds.BitsAllocated),
+        bits_stored=int(getattr(ds, "BitsStored", ds.BitsAllocated)),
+        signed=bool(getattr(ds, "PixelRepresentation", 0)),
+        photometric=str(getattr(ds, "PhotometricInterpretation", "MONOCHROME2")),
+        transfer_syntax=str(syntax),
+        compressed=bool(syntax.is_compressed),
+        slope=_first(getattr(ds, "RescaleSlope", None)) or 1.0,
+        intercept=_first(getattr(ds, "RescaleIntercept", None)) or 0.0,
+        window_center=_first(getattr(ds, "WindowCenter", None)),
+        window_width=_first(getattr(ds, "WindowWidth", None)),
+        modality=str(getattr(ds, "Modality", "")),
+        body_part=str(getattr(ds, "BodyPartExamined", "")),
+        sop_instance_uid=str(getattr(ds, "SOPInstanceUID", "")),
+        series_instance_uid=str(getattr(ds, "SeriesInstanceUID", "")),
+    )
+
+
+def _memmappable(info: DicomInfo) -> bool:
+    return (
+        not info.compressed
+        and info.bits_allocated in (8, 16, 32)
+        and (not info.signed or info.bits_stored == info.bits_allocated)
+    )
+
+
+def open_frames(path: Path, info: DicomInfo | None = None) -> np.ndarray:
+    """
+    Memory-mapped ``(frames, rows, cols[, samples])`` view of uncompressed pixel data.
+
+    Raises ``ValueError`` for compressed or bit-packed data; use ``read_frame``.
+    """
+    _require_pydicom()
+    info = info or read_info(path)
+    if not _memmappable(info):
+        raise ValueError(f"pixel data in {info.transfer_syntax} cannot be memory-mapped")
+    ds = pydicom.dcmread(path, defer_size=1024)
+    try:
+        elem = ds.get_item(PIXEL_DATA, keep_deferred=True)  # pydicom >= 3
+    except TypeError:
+        elem = ds.get_item(PIXEL_DATA)  # still raw and deferred in pydicom 2
+    little = ds.file_meta.TransferSyntaxUID != pydicom.uid.ExplicitVRBigEndian
+    dtype = np.dtype(f"{'<' if little else '>'}{'i' if info.signed else 'u'}{info.bits_allocated // 8}")
+    spp = info.samples_per_pixel
+    planar = spp > 1 and int(getattr(ds, "PlanarConfiguration", 0)) == 1
+    shape = (info.frames, spp, info.rows, info.columns) if planar else (info.frames, info.rows, info.columns, spp)
+    frames = np.memmap(path, dtype=dtype, mode="r", offset=elem.value_tell, shape=shape)
+    if planar:
+        frames = frames.transpose(0, 2, 3, 1)
+    return frames[..., 0] if spp == 1 else frames
+
+
+def read_frame(path: Path, index: int, info: DicomInfo | None = None) -> np.ndarray:
+    """One frame as an array, touching as little of the file as the transfer syntax allows."""
+    _require_pydicom()
+    info = info or read_info(path)
+    if not 0 <= index < info.frames:
+        raise IndexError(f"frame {index} out of range (0..{info.frames - 1})")
+    if _memmappable(info):
+        return open_frames(path, info)[index]
+    if _decode_frame is not None:
+        return _decode_frame(path, index=index)
+    arr = pydicom.dcmread(path).pixel_array  # pydicom < 3 decodes everything
+    return arr[index] if info.frames > 1 else arr
+
+
+def pick_frame(info: DicomInfo, frame: str | int = DICOM_FRAME) -> int:
+    """"middle", "first" or an explicit index."""
+    if frame == "first":
+        return 0
+    if frame == "middle":
+        return info.frames // 2
+    return min(max(int(frame), 0), info.frames - 1)
+
+
+def to_display(frame: np.ndarray, info: DicomInfo, max_edge: int = IMAGE_MAX_EDGE) -> np.ndarray:
+    """
+    Subsample, apply modality LUT + VOI window and return 8-bit pixels.
+
+    Subsampling first means a 4k mammogram is windowed at roughly twice the
+    output resolution instead of in full; LANCZOS does the final resize.
+    """
+    step = max(1, math.floor(max(frame.shape[:2]) / (2 * max_edge)))
+    frame = frame[::step, ::step]
+
+    if info.samples_per_pixel > 1:  # colour (e.g. secondary capture): already display values
+        if frame.dtype != np.uint8:
+            frame = (frame >> max(0, info.bits_stored - 8)).astype(np.uint8)
+        return np.ascontiguousarray(frame)
+
+    values = frame.astype(np.float32)
+    if not info.signed and info.bits_stored < info.bits_allocated:
+        values = (frame & ((1 << info.bits_stored) - 1)).astype(np.float32)
+    if info.slope != 1.0:
+        values *= info.slope
+    if info.intercept:
+        values += info.intercept
+
+    if info.window_center is not None and info.window_width and info.window_width > 1:
+        # PS3.3 C.11.2.1.2 linear VOI function
+        low = info.window_center - 0.5 - (info.window_width - 1) / 2
+        scale = 255.0 / (info.window_width - 1)
+    else:
+        low, high = np.percentile(values, (0.5, 99.5))
+        scale = 255.0 / (high - low) if high > low else 0.0
+    values -= low
+    values *= scale
+    np.clip(values, 0, 255, out=values)
+    out = values.astype(np.uint8)
+    if info.photometric == "MONOCHROME1":
+        np.subtract(255, out, out=out)
+    return out
+
+
+def render_image(path: Path, frame: str | int = DICOM_FRAME, max_edge: int = IMAGE_MAX_EDGE) -> Image.Image:
+    info = read_info(path)
+    pixels = to_display(read_frame(path, pick_frame(info, frame), info), info, max_edge)
+    img = Image.fromarray(pixels)
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    return img
+
+
+def render_jpeg(path: Path, frame: str | int = DICOM_FRAME, *, max_edge: int = IMAGE_MAX_EDGE, quality: int = 95) -> bytes:
+    """The frame as a JPEG ready for ``preprocess.prepare``."""
+    buf = io.BytesIO()
+    render_image(path, frame, max_edge).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+# ── benchmark ─────────────────────────────────────────────────────────────
+def write_synthetic(path: Path, frames: int, size: int, *, compressed: bool = False) -> Path:
+    """A multi-frame 16-bit CT-like study for benchmarks."""
+    _require_pydicom()
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, RLELossless, generate_uid
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2.1"  # enhanced CT
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = pydicom.Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID, ds.SOPInstanceUID = meta.MediaStorageSOPClassUID, meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = generate_uid()
+    ds.Modality, ds.BodyPartExamined = "CT", "CHEST"
+    ds.Rows = ds.Columns = size
+    ds.NumberOfFrames = frames
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+    ds.WindowCenter, ds.WindowWidth = 40, 400
+
+    yy, xx = np.mgrid[0:size, 0:size]
+    body = ((xx - size / 2) ** 2 + (yy - size / 2) ** 2 < (size * 0.4) ** 2) * 1064
+    rng = np.random.default_rng(0)
+    with open(path, "wb") as f:
+        pixels = np.empty((frames, size, size), dtype=np.uint16)
+        for i in range(frames):
+            pixels[i] = body + rng.integers(0, 60, (size, size), dtype=np.uint16)
+        ds.PixelData = pixels.tobytes()
+        if compressed:
+            ds.compress(RLELossless)
+        ds.save_as(f, enforce_file_format=True)
+    return path
+
+
+def _measure(mode: str, path: Path) -> dict:
+    """Run one decode strategy in a fresh interpreter so its peak RSS is its own."""
+    out = subprocess.run(
+        [sys.executable, __file__, "_measure", mode, str(path)],
+        check=True, capture_output=True, text=True, cwd=Path(__file__).parent,
+    )
+    return json.loads(out.stdout)
+
+
+def _measure_child(mode: str, path: Path) -> dict:
+    import resource
+
+    _require_pydicom()  # before t0, so every mode (and the baseline) pays the import outside the timing
+    t0 = time.perf_counter()
+    if mode == "header":
+        read_info(path)
+    elif mode == "lazy":
+        render_jpeg(path)
+    elif mode == "full":  # what a naive converter does
+        ds = pydicom.dcmread(path)
+        arr = ds.pixel_array
+        info = read_info(path)
+        pixels = to_display(arr[pick_frame(info)], info)
+        Image.fromarray(pixels).save(io.BytesIO(), format="JPEG")
+    seconds = time.perf_counter() - t0
+    try:  # ru_maxrss can carry over the parent's peak across fork/exec; VmHWM cannot
+        with open("/proc/self/status") as f:
+            peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"ms": round(seconds * 1000, 1), "peak_rss_mb": round(peak_kb / 1024, 1)}
+
+
+def benchmark(frames: int, size: int, *, compressed: bool = False) -> dict:
+    with tempfile.TemporaryDirectory(prefix="dicombench-") as tmp:
+        path = write_synthetic(Path(tmp) / "study.dcm", frames, size, compressed=compressed)
+        result = {
+            "frames": frames,
+            "size": size,
+            "compressed": compressed,
+            "file_mb": round(path.stat().st_size / 2**20, 1),
+            "baseline": _measure("none", path),
+        }
+        for mode in ("header", "lazy", "full"):
+            result[mode] = _measure(mode, path)
+    return result
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect, render or benchmark DICOM files.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    info = sub.add_parser("info", help="print header fields")
+    info.add_argument("path", type=Path)
+    render = sub.add_parser("render", help="write one frame as JPEG")
+    render.add_argument("path", type=Path)
+    render.add_argument("out", type=Path)
+    render.add_argument("--frame", default=DICOM_FRAME)
+    bench = sub.add_parser("bench", help="decode time and peak RSS on a synthetic multi-frame study")
+    bench.add_argument("--frames", type=int, default=100)
+    bench.add_argument("--size", type=int, default=1024)
+    bench.add_argument("--compressed", action="store_true", help="RLE-compress the synthetic study")
+    measure = sub.add_parser("_measure")
+    measure.add_argument("mode")
+    measure.add_argument("path", type=Path)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "info":
+        print(json.dumps(read_info(args.path).as_dict(), indent=2))
+    elif args.cmd == "render":
+        frame = args.frame if args.frame in ("first", "middle") else int(args.frame)
+        args.out.write_bytes(render_jpeg(args.path, frame))
+    elif args.cmd == "bench":
+        print(json.dumps(benchmark(args.frames, args.size, compressed=args.compressed), indent=2))
+    elif args.cmd == "_measure":
+        print(json.dumps(_measure_child(args.mode, args.path)))
+
+
+if __name__ == "__main__":
+    main()
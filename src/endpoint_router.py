@@ -0,0 +1,333 @@
+"""
+Client-side routing over several replicas of one OpenAI-compatible server.
+
+``RAD_API_BASES`` / ``ORCH_API_BASES`` list the replicas of a role.  The
+provider is built for the first one and its httpx client gets an
+``EndpointRouter`` as transport, which sends every request to one replica:
+
+• least outstanding requests, ties broken by the lower p50 latency
+• passive health checks: a connection error, timeout, 429 or 5xx counts as a
+  failure, and ``fail_threshold`` failures in a row open the replica's
+  circuit for ``cooldown`` seconds; after that one trial request (half-open)
+  either closes it again or re-opens it
+• active health checks: every ``health_interval`` seconds ``GET <base>/models``
+  is probed on each replica; a failed probe opens the circuit, a passing one
+  closes it
+• a request that could not connect, or was turned away with 429/502/503/504,
+  is re-sent to another replica
+• with ``hedge=True`` a request still waiting for its response headers after
+  the p95 response time of recent requests is duplicated to a second
+  replica; the first good response wins and the other is cancelled
+
+Latency is time to response headers, which for streamed completions is
+time to first token.  ``stats()`` returns per-replica counters.
+
+The router depends on neither ``config`` nor ``telemetry`` so it can be
+built while ``config`` is being imported.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Callable
+
+import httpx
+
+RETRYABLE = (httpx.ConnectError, httpx.ConnectTimeout)
+REJECTED = {429, 502, 503, 504}  # the replica turned the request away without running it
+PROBE_HEADERS = ("authorization", "api-key")
+
+# role prefix ("RAD", "ORCH") -> router, for the UI and benchmarks
+routers: dict[str, "EndpointRouter"] = {}
+
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _bad(response: httpx.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class Endpoint:
+    def __init__(self, base_url: str, transport: httpx.AsyncBaseTransport, window: int):
+        self.base_url = base_url.rstrip("/")
+        self.transport = transport
+        self.latencies: deque[float] = deque(maxlen=window)
+
+        self.circuit = "closed"  # closed | open | half_open
+        self.open_until = 0.0
+        self.trial = False  # a half-open trial request is in flight
+        self.failures = 0  # consecutive
+
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0  # requests hedged away from this replica
+        self.hedge_wins = 0  # hedges this replica answered first
+
+    @property
+    def p50(self) -> float:
+        return _percentile(self.latencies, 50)
+
+
+class EndpointRouter(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        base_urls: list[str],
+        *,
+        transport_factory: Callable[[], httpx.AsyncBaseTransport] = httpx.AsyncHTTPTransport,
+        fail_threshold: int = 3,
+        cooldown: float = 30.0,
+        health_interval: float = 15.0,
+        health_timeout: float = 5.0,
+        health_path: str = "models",
+        hedge: bool = False,
+        hedge_quantile: float = 95.0,
+        hedge_min_delay: float = 0.05,
+        hedge_min_samples: int = 20,
+        window: int = 200,
+    ):
+        if not base_urls:
+            raise ValueError("EndpointRouter needs at least one base URL")
+        self.endpoints = [Endpoint(url, transport_factory(), window) for url in base_urls]
+        self.fail_threshold = fail_threshold
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health_path = health_path.strip("/")
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+
+        self._latencies: deque[float] = deque(maxlen=window)  # all replicas, for the hedge delay
+        self._probe_headers: dict[str, str] = {}
+        self._health_task: asyncio.Task | None = None
+        self.failovers = 0
+
+    @property
+    def base_url(self) -> str:
+        """The URL the provider is built for; requests under it are routed."""
+        return self.endpoints[0].base_url
+
+    # ── httpx transport ───────────────────────────────────────────────────
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._ensure_health_task()
+        self._probe_headers = {k: v for k, v in request.headers.items() if k.lower() in PROBE_HEADERS}
+        body = await request.aread()
+        tried: set[Endpoint] = set()
+        error: Exception | None = None
+        while (endpoint := self._pick(tried)) is not None:
+            tried.add(endpoint)
+            try:
+                if self.hedge:
+                    response = await self._hedged(endpoint, request, body, tried)
+                else:
+                    response = await self._send(endpoint, request, body)
+            except RETRYABLE as exc:  # nothing reached the replica, so another one may take it
+                error = exc
+                self.failovers += 1
+                continue
+            if response.status_code not in REJECTED or not self._has_spare(tried):
+                return response
+            await response.aclose()
+            self.failovers += 1
+        if error is not None:
+            raise error
+        raise httpx.ConnectError("no replica is available (all circuits open)", request=request)
+
+    async def probe(self) -> None:
+        """Health-check every replica now, as the ``health_interval`` loop does."""
+        await asyncio.gather(*(self._probe(ep) for ep in self.endpoints))
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for endpoint in self.endpoints:
+            await endpoint.transport.aclose()
+
+    # ── stats ─────────────────────────────────────────────────────────────
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "endpoint": ep.base_url,
+                "state": ep.circuit,
+                "outstanding": ep.outstanding,
+                "requests": ep.requests,
+                "errors": ep.errors,
+                "error_rate": round(ep.errors / ep.requests, 3) if ep.requests else 0.0,
+                "p50_ms": round(1000 * ep.p50, 1),
+                "p95_ms": round(1000 * _percentile(ep.latencies, 95), 1),
+                "hedges": ep.hedges,
+                "hedge_wins": ep.hedge_wins,
+            }
+            for ep in self.endpoints
+        ]
+
+    # ── routing ───────────────────────────────────────────────────────────
+    def _pick(self, exclude: set[Endpoint]) -> Endpoint | None:
+        now = time.monotonic()
+        candidates = [ep for ep in self.endpoints if ep not in exclude and self._available(ep, now)]
+        if not candidates:
+            return None
+        endpoint = min(candidates, key=lambda ep: (ep.outstanding, ep.failures, ep.p50, random.random()))
+        if endpoint.circuit != "closed":
+            endpoint.circuit, endpoint.trial = "half_open", True
+        return endpoint
+
+    def _has_spare(self, exclude: set[Endpoint]) -> bool:
+        now = time.monotonic()
+        return any(ep not in exclude and self._available(ep, now) for ep in self.endpoints)
+
+    @staticmethod
+    def _available(endpoint: Endpoint, now: float) -> bool:
+        if endpoint.circuit == "closed":
+            return True
+        if endpoint.circuit == "open":
+            return now >= endpoint.open_until
+        return not endpoint.trial
+
+    def _rewrite(self, request: httpx.Request, endpoint: Endpoint, body: bytes) -> httpx.Request:
+        url = str(request.url)
+        if url.startswith(self.base_url):
+            url = endpoint.base_url + url[len(self.base_url):]
+        headers = [(k, v) for k, v in request.headers.multi_items() if k.lower() != "host"]
+        return httpx.Request(request.method, url, headers=headers, content=body, extensions=request.extensions)
+
+    async def _send(self, endpoint: Endpoint, request: httpx.Request, body: bytes) -> httpx.Response:
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        t0 = time.perf_counter()
+        try:
+            response = await endpoint.transport.handle_async_request(self._rewrite(request, endpoint, body))
+        except asyncio.CancelledError:  # a hedge that lost is not the replica's fault
+            endpoint.outstanding -= 1
+            endpoint.trial = False
+            raise
+        except Exception:
+            endpoint.outstanding -= 1
+            self._failed(endpoint)
+            raise
+        if _bad(response):
+            self._failed(endpoint)
+        else:
+            self._succeeded(endpoint, time.perf_counter() - t0)
+        response.stream = _Tracked(response.stream, endpoint)
+        return response
+
+    async def _hedged(self, first: Endpoint, request: httpx.Request, body: bytes, tried: set) -> httpx.Response:
+        primary = asyncio.create_task(self._send(first, request, body))
+        if len(self._latencies) < self.hedge_min_samples:
+            return await primary
+        delay = max(self.hedge_min_delay, _percentile(self._latencies, self.hedge_quantile))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or (second := self._pick(tried)) is None:
+            return await primary
+
+        tried.add(second)
+        first.hedges += 1
+        backup = asyncio.create_task(self._send(second, request, body))
+        pending = {primary, backup}
+        fallback: asyncio.Task | None = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None and not _bad(t.result())), None)
+                for task in done:
+                    if task is winner:
+                        continue
+                    if winner is None and (fallback is None or fallback.exception() is not None):
+                        fallback = task  # an error response beats an exception
+                    elif task.exception() is None:
+                        await task.result().aclose()
+                if winner is not None:
+                    if winner is backup:
+                        second.hedge_wins += 1
+                    if fallback is not None and fallback.exception() is None:
+                        await fallback.result().aclose()
+                    return winner.result()
+            return await fallback  # neither replica answered well; pass the failure on
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                try:
+                    response = await task
+                except BaseException:
+                    continue
+                await response.aclose()
+
+    def _failed(self, endpoint: Endpoint) -> None:
+        endpoint.errors += 1
+        endpoint.failures += 1
+        endpoint.trial = False
+        if endpoint.circuit == "half_open" or endpoint.failures >= self.fail_threshold:
+            self._open(endpoint)
+
+    def _succeeded(self, endpoint: Endpoint, latency: float) -> None:
+        endpoint.latencies.append(latency)
+        self._latencies.append(latency)
+        endpoint.failures = 0
+        endpoint.trial = False
+        endpoint.circuit = "closed"
+
+    def _open(self, endpoint: Endpoint) -> None:
+        endpoint.circuit = "open"
+        endpoint.open_until = time.monotonic() + self.cooldown
+
+    # ── active health checks ──────────────────────────────────────────────
+    def _ensure_health_task(self) -> None:
+        if self.health_interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._health_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._health_task = loop.create_task(self._health_loop(), name="endpoint-health")
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.probe()
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        timeout = {"connect": self.health_timeout, "read": self.health_timeout,
+                   "write": self.health_timeout, "pool": self.health_timeout}
+        request = httpx.Request(
+            "GET", f"{endpoint.base_url}/{self.health_path}", headers=self._probe_headers,
+            extensions={"timeout": timeout},
+        )
+        try:
+            response = await asyncio.wait_for(endpoint.transport.handle_async_request(request), self.health_timeout)
+            await response.aread()
+            await response.aclose()
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        if ok and endpoint.circuit != "closed" and not endpoint.trial:
+            endpoint.circuit, endpoint.failures = "closed", 0
+        elif not ok and endpoint.circuit != "open":
+            self._open(endpoint)
+
+
+class _Tracked(httpx.AsyncByteStream):
+    """Response body that releases the replica's outstanding slot when closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, endpoint: Endpoint):
+        self._stream = stream
+        self._endpoint = endpoint
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._endpoint.outstanding -= 1
+        await self._stream.aclose()
@@ -0,0 +1,141 @@
+"""
+Bounded conversation history for the orchestrator.
+
+Only the messages a turn actually produced (``new_messages()``) are
+appended, and once the estimated prompt size exceeds ``HISTORY_TOKEN_BUDGET``
+older turns are compacted:
+
+• the system prompt is always kept (pydantic-ai does not re-add it when a
+  history is passed)
+• the latest ``analyse_image_base64`` call/result and every other tool
+  call/result are kept verbatim
+• older radiology reports and free-text chit-chat are dropped; the user
+  messages are folded into a one-line-each summary
+• the last ``HISTORY_KEEP_TURNS`` turns are never touched
+"""
+from dataclasses import dataclass, field, replace
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from config import HISTORY_KEEP_TURNS, HISTORY_TOKEN_BUDGET
+
+REPORT_TOOL = "analyse_image_base64"
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(messages: list[ModelMessage]) -> int:
+    """Cheap size estimate (~4 characters per token of serialised history)."""
+    if not messages:
+        return 0
+    return len(ModelMessagesTypeAdapter.dump_json(messages)) // CHARS_PER_TOKEN
+
+
+def _split_turns(messages: list[ModelMessage]) -> list[list[ModelMessage]]:
+    turns: list[list[ModelMessage]] = []
+    for msg in messages:
+        starts_turn = isinstance(msg, ModelRequest) and any(isinstance(p, UserPromptPart) for p in msg.parts)
+        if starts_turn or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+@dataclass
+class ConversationHistory:
+    token_budget: int = HISTORY_TOKEN_BUDGET
+    keep_turns: int = HISTORY_KEEP_TURNS
+    messages: list[ModelMessage] = field(default_factory=list)
+    turn_stats: list[dict] = field(default_factory=list)
+    compactions: int = 0  # times older turns were rewritten (``session_store`` then snapshots)
+
+    def append_run(self, result, *, prompt_tokens_est: int | None = None) -> None:
+        """Store one finished run: its new messages and its prompt size."""
+        self.messages.extend(result.new_messages())
+        usage = result.usage()
+        self.turn_stats.append({
+            "history_tokens_est": prompt_tokens_est,
+            "request_tokens": usage.request_tokens,
+            "response_tokens": usage.response_tokens,
+            "requests": usage.requests,
+        })
+        self.compact()
+
+    def append_messages(self, messages: list[ModelMessage]) -> None:
+        """Store messages produced without a model run (e.g. workflow fast paths)."""
+        self.messages.extend(messages)
+        self.compact()
+
+    @property
+    def last_turn(self) -> dict | None:
+        return self.turn_stats[-1] if self.turn_stats else None
+
+    def compact(self) -> bool:
+        """Shrink older turns until the history fits the budget. Returns True if anything changed."""
+        if estimate_tokens(self.messages) <= self.token_budget:
+            return False
+
+        turns = _split_turns(self.messages)
+        if len(turns) <= self.keep_turns:
+            return False
+        head = [m for turn in turns[:-self.keep_turns] for m in turn]
+        recent = [m for turn in turns[-self.keep_turns:] for m in turn]
+
+        returned = {
+            p.tool_call_id: p.tool_name
+            for m in self.messages if isinstance(m, ModelRequest)
+            for p in m.parts if isinstance(p, ToolReturnPart)
+        }
+        report_ids = [cid for cid, name in returned.items() if name == REPORT_TOOL]
+        latest_report = report_ids[-1] if report_ids else None
+
+        def keep(part) -> bool:
+            if part.tool_call_id not in returned:
+                return False  # unanswered or retried call; can't be replayed on its own
+            return part.tool_name != REPORT_TOOL or part.tool_call_id == latest_report
+
+        system_parts = []
+        user_lines = []
+        kept: list[ModelMessage] = []
+        for msg in head:
+            if isinstance(msg, ModelRequest):
+                system_parts += [p for p in msg.parts if isinstance(p, SystemPromptPart)]
+                user_lines += [
+                    p.content if isinstance(p.content, str) else "[non-text content]"
+                    for p in msg.parts if isinstance(p, UserPromptPart)
+                ]
+                parts = [p for p in msg.parts if isinstance(p, ToolReturnPart) and keep(p)]
+            else:
+                parts = [p for p in msg.parts if isinstance(p, ToolCallPart) and keep(p)]
+            if parts:
+                kept.append(replace(msg, parts=parts))
+
+        summary = "Earlier in this conversation the user said:\n" + "\n".join(
+            f"- {line[:160]}" for line in user_lines
+        )
+        compacted = [ModelRequest(parts=[*system_parts, UserPromptPart(content=summary)]), *kept]
+
+        # still too big: drop the oldest non-report tool exchanges
+        while kept and estimate_tokens(compacted + recent) > self.token_budget:
+            victim = next((m for m in kept if isinstance(m, ModelResponse) and not any(
+                p.tool_call_id == latest_report for p in m.parts)), None)
+            if victim is None:
+                break
+            ids = {p.tool_call_id for p in victim.parts}
+            kept = [
+                m for m in kept
+                if m is not victim and not (isinstance(m, ModelRequest) and {p.tool_call_id for p in m.parts} <= ids)
+            ]
+            compacted = [compacted[0], *kept]
+
+        self.messages = compacted + recent
+        self.compactions += 1
+        return True
@@ -0,0 +1,35 @@
+"""
+``LazyModel``: a pydantic-ai model built on first use.
+
+Kept out of ``config`` because subclassing ``WrapperModel`` imports
+pydantic-ai, and ``config`` is imported by every module (and process) that
+only needs a setting.
+"""
+from typing import Callable
+
+from pydantic_ai.models import Model
+from pydantic_ai.models.wrapper import WrapperModel
+
+
+class LazyModel(WrapperModel):
+    """
+    A model built on first use.
+
+    Agents are declared at import time, but building an ``OpenAIModel``
+    imports the OpenAI SDK and opens a provider; ``LazyModel`` defers both
+    until the first request (or ``warmup.warm_up``).
+    """
+
+    def __init__(self, factory: Callable[[], Model]):
+        self._factory = factory
+        self._model: Model | None = None
+
+    @property
+    def wrapped(self) -> Model:
+        if self._model is None:
+            self._model = self._factory()
+        return self._model
+
+    @property
+    def built(self) -> bool:
+        return self._model is not None
@@ -0,0 +1,153 @@
+"""
+Process-wide pool of long-lived MCP servers.
+
+Starting ``npx -y @gongrzhe/server-gmail-autoauth-mcp`` and doing the MCP
+handshake costs seconds, so the server is started once on the runtime loop
+and shared by every turn, session and Streamlit rerun.  Turns ``borrow``
+it; a borrow pings the server (at most every ``MCP_HEALTH_INTERVAL``
+seconds) and lazily restarts the subprocess if it has died.  A start that does not finish within ``MCP_START_TIMEOUT``
+seconds (``npx`` hanging on the network, a stuck handshake) is abandoned
+and reported to the borrower, and the next borrow tries again.
+
+The server object itself never changes, so agents built with
+``mcp_servers=[pool.server]`` keep working across restarts.  It may be
+given as a factory, in which case it (and ``pydantic_ai.mcp``) is only
+created on first access.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Callable
+
+from config import MCP_HEALTH_INTERVAL, MCP_HEALTH_TIMEOUT, MCP_START_TIMEOUT
+
+if TYPE_CHECKING:
+    from pydantic_ai.mcp import MCPServer
+
+GMAIL_MCP_PACKAGE = "@gongrzhe/server-gmail-autoauth-mcp"
+
+
+class MCPServerPool:
+    def __init__(
+        self,
+        server: MCPServer | Callable[[], MCPServer],
+        *,
+        health_interval: float = 30.0,
+        health_timeout: float = 5.0,
+        start_timeout: float = 120.0,
+    ):
+        self._server = server
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.start_timeout = start_timeout
+
+        self.starts = 0
+        self._owner: asyncio.Task | None = None
+        self._stop: asyncio.Event | None = None
+        self._lock: asyncio.Lock | None = None
+        self._last_ok = 0.0
+
+    @property
+    def server(self) -> MCPServer:
+        if callable(self._server):
+            self._server = self._server()
+        return self._server
+
+    @asynccontextmanager
+    async def borrow(self) -> AsyncIterator[MCPServer]:
+        """Yield the server, (re)starting it first if it is not healthy."""
+        await self.ensure_running()
+        yield self.server
+
+    async def ensure_running(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._owner is not None and not self._owner.done():
+                if time.monotonic() - self._last_ok < self.health_interval:
+                    return
+                if await self._healthy():
+                    return
+                await self._stop_owner()
+            await self._start()
+
+    async def close(self) -> None:
+        if self._lock is None:
+            return
+        async with self._lock:
+            await self._stop_owner()
+
+    # ── internals ─────────────────────────────────────────────────────────
+    async def _healthy(self) -> bool:
+        # An MCP ping is answered by the server process itself; tool listings may be
+        # served from a client-side cache and would pass with a dead subprocess.
+        try:
+            await asyncio.wait_for(self.server._client.send_ping(), self.health_timeout)
+        except Exception:
+            return False
+        self._last_ok = time.monotonic()
+        return True
+
+    async def _start(self) -> None:
+        ready = asyncio.get_running_loop().create_future()
+        self._stop = asyncio.Event()
+        self._owner = asyncio.create_task(self._own(ready, self._stop), name="mcp-server-owner")
+        try:
+            await asyncio.wait_for(ready, self.start_timeout)
+        except BaseException:
+            await self._cancel_owner()
+            raise
+        self.starts += 1
+        self._last_ok = time.monotonic()
+
+    async def _own(self, ready: asyncio.Future, stop: asyncio.Event) -> None:
+        # The stdio transport uses anyio task groups, which must be entered and
+        # exited from the same task, so a dedicated task holds the server open.
+        try:
+            async with self.server:
+                ready.set_result(None)
+                await stop.wait()
+        except asyncio.CancelledError:
+            if not ready.done():
+                ready.set_exception(ConnectionError("MCP server start was cancelled"))
+            raise
+        except Exception as exc:
+            if not ready.done():
+                ready.set_exception(exc)
+            # otherwise it died after startup; the next borrow notices and restarts
+
+    async def _stop_owner(self) -> None:
+        if self._owner is None:
+            return
+        self._stop.set()
+        done, _ = await asyncio.wait({self._owner}, timeout=self.health_timeout)
+        if not done:
+            self._owner.cancel()
+        self._owner = None
+
+    async def _cancel_owner(self) -> None:
+        owner, self._owner = self._owner, None
+        owner.cancel()
+        try:
+            await owner
+        except asyncio.CancelledError:
+            if not owner.cancelled():
+                raise  # the caller itself is being cancelled
+        except Exception:
+            pass
+
+
+def _gmail_server() -> MCPServer:
+    from pydantic_ai.mcp import MCPServerStdio
+
+    return MCPServerStdio(command="npx", args=["-y", GMAIL_MCP_PACKAGE])
+
+
+gmail_pool = MCPServerPool(
+    _gmail_server,
+    health_interval=MCP_HEALTH_INTERVAL,
+    health_timeout=MCP_HEALTH_TIMEOUT,
+    start_timeout=MCP_START_TIMEOUT,
+)
@@ -0,0 +1,121 @@
+"""
+The chat orchestrator: its system prompt, the agent and one streamed turn.
+
+Shared by the Streamlit UI (``app_streamlit``) and the HTTP service
+(``service``), which only differ in how they render the events.
+"""
+import time
+from typing import AsyncIterator
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import FunctionToolCallEvent, FunctionToolResultEvent, PartDeltaEvent, TextPartDelta
+
+import telemetry
+from config import orch_model
+from tools_orchestrator import analyse_image_base64, analyse_series_tool, send_email, show_reference_images_tool
+
+SYSTEM_PROMPT = """
+ROLE
+You are a radiology assistant.
+
+TOOLS
+1. analyse_image_base64(path:str)            -> RadiologyReport
+2. show_reference_images_tool(path:str)      -> dict  (similar confirmed cases)
+3. send_email(to:list[str], subject:str,
+              body:str, cc:list[str]|None=[],
+              bcc:list[str]|None=[])         -> outbox id (delivered in the background)
+4. analyse_series_tool(paths:list[str]|None,
+              folder:str|None)               -> merged RadiologyReport for a multi-image study
+
+FLOW
+A) Get image
+• If no image path: ask “Which image file should I analyse? (default = data/image.jpg)”
+• Uploaded images are referenced as upload:<sha256>; use that string as <PATH> unchanged.
+
+B) Analyse image
+• Once you have <PATH> call: {"name":"analyse_image_base64","arguments":{"path":"<PATH>"}}
+• If the user gives several images, a folder or a multi-frame study, call instead:
+    {"name":"analyse_series_tool","arguments":{"folder":"<FOLDER>"}}  or  {"paths":["<PATH>", ...]}
+  and present the merged report the same way.
+
+C) Present result
+• Tool returns {critical, diagnosis_description, clinical_recommendations}
+• Show this summary:
+    Diagnosis: <diagnosis_description>
+    Recommendations: <clinical_recommendations>
+    Critical: Yes/No
+
+D) Offer reference images ── ALWAYS happens first
+• Ask: “Would you like to view reference images from similar confirmed cases?”
+• If user replies yes/yep/“show them”… IMMEDIATELY call:
+    {"name":"show_reference_images_tool","arguments":{"path":"<PATH>","confirm":"yes"}}
+• After the tool finishes —or if the user said “no” —continue to step E.
+
+E) Handle critical cases ── ONLY if critical == true
+• Ask: “This case is marked as critical. Would you like to send it for peer review?”
+• If user agrees:
+    1. Draft a plain-text email (from Dr. Mahdi Ghodsi) with the summary.
+    2. Show the draft and ask: “Would you like me to send this email?”
+    3. If user confirms sending:
+        Ask for recipient address.
+        Call IMMEDIATELY:
+        {"name":"send_email","arguments":{"to":["<EMAIL>"],"subject":"<SUBJECT>","body":"<BODY>"}}
+
+RULES
+• Never skip a step.
+• D must finish (or be declined) before E begins.
+• Never send an email without explicit confirmation.
+• Never invent clinical data.
+""".strip()
+
+
+async def build_orchestrator():
+    return Agent(
+        model=orch_model,
+        tools=[analyse_image_base64, analyse_series_tool, show_reference_images_tool, send_email],
+        system_prompt=SYSTEM_PROMPT,
+        instrument=True,
+    )
+
+
+async def turn_events(orchestrator: Agent, message: str, history: list) -> AsyncIterator:
+    """
+    Run one orchestrator turn and yield its events: text deltas (``str``),
+    tool call/result events, the ``AgentRunResult`` and finally the turn's
+    ``telemetry.Turn`` with its stage timings.
+
+    Emails are only queued here and delivered by the ``outbox`` worker.
+    """
+    with telemetry.turn("chat") as perf:
+        async with orchestrator.iter(
+            user_prompt=message,
+            message_history=history,
+        ) as run:
+            async for node in run:
+                if Agent.is_call_tools_node(node):
+                    started = {}
+                    async with node.stream(run.ctx) as s:
+                        async for ev in s:
+                            if isinstance(ev, FunctionToolCallEvent):
+                                started[ev.part.tool_call_id] = time.perf_counter()
+                                yield ev
+                            elif isinstance(ev, FunctionToolResultEvent):
+                                if (t0 := started.pop(ev.tool_call_id, None)) is not None:
+                                    telemetry.record(f"tool.{ev.result.tool_name}", time.perf_counter() - t0)
+                                yield ev
+                elif Agent.is_model_request_node(node):
+                    with telemetry.span("orchestrator.model") as attrs:
+                        t0 = time.perf_counter()
+                        async with node.stream(run.ctx) as s:
+                            async for ev in s:
+                                if "ttft_ms" not in attrs:
+                                    attrs["ttft_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                                if isinstance(ev, PartDeltaEvent) and isinstance(ev.delta, TextPartDelta):
+                                    yield ev.delta.content_delta
+
+        usage = run.result.usage()
+        telemetry.count("orchestrator.requests", usage.requests)
+        telemetry.count("orchestrator.request_tokens", usage.request_tokens or 0)
+        telemetry.count("orchestrator.response_tokens", usage.response_tokens or 0)
+        yield run.result
+    yield perf
@@ -0,0 +1,344 @@
+"""
+Durable outbox for peer-review emails.
+
+The orchestrator's ``send_email`` tool only writes the message to a local
+SQLite queue (``OUTBOX_DB``) and returns; a background worker on the
+runtime loop delivers it through the Gmail MCP server:
+
+• due messages are drained in batches over one borrowed MCP connection,
+  at most ``OUTBOX_RATE_PER_MIN`` sends per minute
+• a failed send is retried with exponential backoff (``OUTBOX_BASE_DELAY``
+  doubling up to ``OUTBOX_MAX_DELAY``) and marked failed after
+  ``OUTBOX_MAX_ATTEMPTS``
+• an identical message (same recipients, subject and body) that is already
+  queued or sent is not queued again
+• a worker claims messages with a lease (``OUTBOX_LEASE`` seconds, renewed
+  while its batch is in progress); a message whose lease expired because
+  its worker crashed is re-queued, so delivery is at-least-once, while
+  one still leased by a live worker sharing the database is left alone
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import telemetry
+from config import (
+    OUTBOX_BASE_DELAY,
+    OUTBOX_DB,
+    OUTBOX_LEASE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_MAX_DELAY,
+    OUTBOX_RATE_PER_MIN,
+)
+from mcp_pool import MCPServerPool, gmail_pool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key    TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'queued',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error   TEXT,
+    result       TEXT,
+    owner        TEXT,
+    lease_until  REAL,
+    created      REAL NOT NULL,
+    updated      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS emails_due ON emails (status, next_attempt);
+CREATE INDEX IF NOT EXISTS emails_dedup ON emails (dedup_key);
+"""
+
+BATCH_SIZE = 20
+
+
+def dedup_key(payload: dict) -> str:
+    norm = {
+        "to": sorted(a.strip().lower() for a in payload.get("to") or []),
+        "cc": sorted(a.strip().lower() for a in payload.get("cc") or []),
+        "bcc": sorted(a.strip().lower() for a in payload.get("bcc") or []),
+        "subject": (payload.get("subject") or "").strip(),
+        "body": (payload.get("body") or "").strip(),
+    }
+    return hashlib.sha256(json.dumps(norm, sort_keys=True).encode()).hexdigest()
+
+
+class Outbox:
+    def __init__(
+        self,
+        path: Path,
+        pool: MCPServerPool,
+        *,
+        tool_name: str = "send_email",
+        max_attempts: int = 6,
+        base_delay: float = 5.0,
+        max_delay: float = 600.0,
+        rate_per_min: float = 20.0,
+        lease: float = 300.0,
+    ):
+        self.path = Path(path)
+        self.pool = pool
+        self.tool_name = tool_name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_per_min = rate_per_min
+        self.lease = lease
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._worker: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._last_send = 0.0
+
+    # ── queue ─────────────────────────────────────────────────────────────
+    def enqueue(self, payload: dict) -> dict:
+        """Store a message for delivery; returns its id, status and whether it was a duplicate."""
+        key = dedup_key(payload)
+        now = time.time()
+        with self._conn() as db:
+            row = db.execute(
+                "SELECT id, status FROM emails WHERE dedup_key = ? AND status != 'failed' ORDER BY id DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                telemetry.count("outbox.duplicates")
+                return {"id": row[0], "status": row[1], "duplicate": True}
+            cur = db.execute(
+                "INSERT INTO emails (dedup_key, payload, next_attempt, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(payload), now, now, now),
+            )
+        telemetry.count("outbox.enqueued")
+        self._notify()
+        return {"id": cur.lastrowid, "status": "queued", "duplicate": False}
+
+    def stats(self) -> dict[str, int]:
+        with self._conn() as db:
+            rows = db.execute("SELECT status, COUNT(*) FROM emails GROUP BY status").fetchall()
+        return {"queued": 0, "sending": 0, "sent": 0, "failed": 0, **dict(rows)}
+
+    def recent(self, n: int = 5) -> list[dict]:
+        with self._conn() as db:
+            rows = db.execute(
+                "SELECT id, payload, status, attempts, last_error, updated FROM emails ORDER BY id DESC LIMIT ?", (n,),
+            ).fetchall()
+        return [
+            {
+                "id": id_, "to": json.loads(payload).get("to"), "subject": json.loads(payload).get("subject"),
+                "status": status, "attempts": attempts, "last_error": error, "updated": updated,
+            }
+            for id_, payload, status, attempts, error, updated in rows
+        ]
+
+    # ── worker ────────────────────────────────────────────────────────────
+    async def start(self) -> None:
+        """Start the delivery worker on the running loop (idempotent)."""
+        if self._worker is not None and not self._worker.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._requeue_expired()
+        self._worker = asyncio.create_task(self._run(), name="outbox-worker")
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def drain(self, timeout: float | None = None) -> None:
+        """Wait until nothing is queued or being sent (for tests and shutdown)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            counts = self.stats()
+            if not counts["queued"] and not counts["sending"]:
+                return
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"outbox not drained: {counts}")
+            await asyncio.sleep(0.05)
+
+    async def _run(self) -> None:
+        while True:
+            batch = self._claim_due()
+            if batch:
+                with telemetry.span("outbox.batch", size=len(batch)):
+                    await self._deliver(batch)
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._next_due())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, batch: list[tuple[int, dict, int]]) -> None:
+        pending = {id_: attempts for id_, _, attempts in batch}
+        try:
+            async with self.pool.borrow() as server:
+                for id_, payload, attempts in batch:
+                    await self._throttle()
+                    self._renew(pending)
+                    t0 = time.perf_counter()
+                    try:
+                        result = await server.call_tool(self.tool_name, payload)
+                    except asyncio.CancelledError:
+                        raise  # left 'sending'; re-queued once its lease expires
+                    except Exception as exc:
+                        self._retry(id_, attempts, f"{type(exc).__name__}: {exc}")
+                    else:
+                        telemetry.record("outbox.send", time.perf_counter() - t0)
+                        self._finish(id_, "sent", result=str(result))
+                    del pending[id_]
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # the MCP server could not be started
+            for id_, attempts in pending.items():
+                self._retry(id_, attempts, f"{type(exc).__name__}: {exc}")
+
+    async def _throttle(self) -> None:
+        if self.rate_per_min <= 0:
+            return
+        wait = self._last_send + 60.0 / self.rate_per_min - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_send = time.monotonic()
+
+    # ── bookkeeping ───────────────────────────────────────────────────────
+    def _claim_due(self) -> list[tuple[int, dict, int]]:
+        self._requeue_expired()
+        now = time.time()
+        with self._conn() as db:
+            rows = db.execute(
+                "SELECT id, payload, attempts FROM emails WHERE status = 'queued' AND next_attempt <= ? "
+                "ORDER BY next_attempt LIMIT ?",
+                (now, BATCH_SIZE),
+            ).fetchall()
+            db.executemany(
+                "UPDATE emails SET status = 'sending', owner = ?, lease_until = ?, updated = ? WHERE id = ?",
+                [(self.owner, now + self.lease, now, id_) for id_, _, _ in rows],
+            )
+        return [(id_, json.loads(payload), attempts) for id_, payload, attempts in rows]
+
+    def _renew(self, ids) -> None:
+        """Push the lease of this worker's in-flight messages ``lease`` seconds ahead."""
+        ids = list(ids)
+        with self._conn() as db:
+            db.execute(
+                f"UPDATE emails SET lease_until = ? WHERE status = 'sending' AND owner = ? "
+                f"AND id IN ({', '.join('?' * len(ids))})",
+                (time.time() + self.lease, self.owner, *ids),
+            )
+
+    def _requeue_expired(self) -> None:
+        """Re-queue messages whose worker stopped renewing their lease (it crashed or was killed)."""
+        now = time.time()
+        with self._conn() as db:
+            cur = db.execute(
+                "UPDATE emails SET status = 'queued', owner = NULL, lease_until = NULL, updated = ? "
+                "WHERE status = 'sending' AND COALESCE(lease_until, 0) < ?",
+                (now, now),
+            )
+        if cur.rowcount > 0:
+            telemetry.count("outbox.lease_expired", cur.rowcount)
+
+    def _next_due(self) -> float | None:
+        with self._conn() as db:
+            (due,) = db.execute(
+                "SELECT MIN(due) FROM (SELECT MIN(next_attempt) AS due FROM emails WHERE status = 'queued' "
+                "UNION ALL SELECT MIN(lease_until) FROM emails WHERE status = 'sending')"
+            ).fetchone()
+        return None if due is None else max(0.0, due - time.time())
+
+    def _retry(self, id_: int, attempts: int, error: str) -> None:
+        attempts += 1
+        if attempts >= self.max_attempts:
+            telemetry.count("outbox.failed")
+            self._finish(id_, "failed", attempts=attempts, error=error)
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        telemetry.count("outbox.retries")
+        with self._conn() as db:
+            db.execute(
+                "UPDATE emails SET status = 'queued', attempts = ?, next_attempt = ?, last_error = ?, owner = NULL, "
+                "lease_until = NULL, updated = ? WHERE id = ?",
+                (attempts, time.time() + delay, error, time.time(), id_),
+            )
+
+    def _finish(self, id_: int, status: str, *, attempts: int | None = None, error: str | None = None,
+                result: str | None = None) -> None:
+        if status == "sent":
+            telemetry.count("outbox.sent")
+        with self._conn() as db:
+            db.execute(
+                "UPDATE emails SET status = ?, attempts = COALESCE(?, attempts + 1), last_error = COALESCE(?, last_error), "
+                "result = ?, owner = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                (status, attempts, error, result, time.time(), id_),
+            )
+
+    def _notify(self) -> None:
+        if self._wake is None or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _conn(self) -> "_Locked":
+        with self._db_lock:
+            if self._db is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.executescript(SCHEMA)
+        return _Locked(self._db, self._db_lock)
+
+
+class _Locked:
+    """``with`` block holding the connection lock inside one transaction."""
+
+    def __init__(self, db: sqlite3.Connection, lock: threading.Lock):
+        self.db, self.lock = db, lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+
+
+outbox = Outbox(
+    OUTBOX_DB,
+    gmail_pool,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    base_delay=OUTBOX_BASE_DELAY,
+    max_delay=OUTBOX_MAX_DELAY,
+    rate_per_min=OUTBOX_RATE_PER_MIN,
+    lease=OUTBOX_LEASE,
+)
@@ -0,0 +1,151 @@
+"""
+Image preprocessing before the VLM call.
+
+Scans are often far larger than what the vision encoder actually looks at,
+so we decode, downscale to ``IMAGE_MAX_EDGE``, drop to grayscale and
+re-encode as JPEG before the bytes are base64'd into the request.  DICOM
+files are rendered to a JPEG of one frame by ``dicom_io`` when they are
+read.  All of the work is blocking (file I/O + Pillow), so callers on the
+event loop go through ``read_bytes`` / ``prepare`` which run it in a worker
+thread.
+"""
+import asyncio
+import io
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import dicom_io
+from config import IMAGE_GRAYSCALE, IMAGE_JPEG_QUALITY, IMAGE_MAX_EDGE, IMAGE_PREPROCESS
+
+_HIGH_DEPTH_MODES = {"I", "I;16", "I;16B", "I;16L", "I;16N", "F"}
+
+_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+}
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    media_type: str
+    original_bytes: int
+    width: int | None = None
+    height: int | None = None
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def sniff_media_type(data: bytes) -> str:
+    for magic, media_type in _SIGNATURES.items():
+        if data.startswith(magic):
+            return media_type
+    return "application/octet-stream"
+
+
+def settings() -> dict:
+    """Preprocessing knobs; part of the report cache key since they change what the model sees."""
+    return {
+        "preprocess": IMAGE_PREPROCESS,
+        "max_edge": IMAGE_MAX_EDGE,
+        "grayscale": IMAGE_GRAYSCALE,
+        "quality": IMAGE_JPEG_QUALITY,
+    }
+
+
+def prepare_image(
+    raw: bytes,
+    *,
+    max_edge: int = IMAGE_MAX_EDGE,
+    grayscale: bool = IMAGE_GRAYSCALE,
+    quality: int = IMAGE_JPEG_QUALITY,
+) -> PreparedImage:
+    """
+    Downscale/re-encode ``raw``; falls back to the original bytes if that would
+    not shrink them, except for 16-bit input, which is always rescaled to 8 bits.
+    """
+    with Image.open(io.BytesIO(raw)) as img:
+        img = ImageOps.exif_transpose(img)
+        rescaled = img.mode in _HIGH_DEPTH_MODES
+        if rescaled:  # the original is no fallback: viewers clip it just like convert("L")
+            img = to_8bit(img)
+        resized = max(img.size) > max_edge
+        if resized:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        if grayscale:
+            img = img.convert("L")
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        width, height = img.size
+
+    data = buf.getvalue()
+    if not resized and not rescaled and len(data) >= len(raw):
+        return PreparedImage(raw, sniff_media_type(raw), len(raw), width, height)
+    return PreparedImage(data, "image/jpeg", len(raw), width, height)
+
+
+def to_8bit(img: Image.Image) -> Image.Image:
+    """
+    Stretch a 16-bit / 32-bit grayscale image to 8-bit ``L`` by its min/max.
+
+    Pillow's own ``convert("L")`` clips these modes at 255 instead of
+    rescaling, which turns most 16-bit scans almost entirely white.
+    """
+    values = np.asarray(img, dtype=np.float32)
+    low, high = float(values.min()), float(values.max())
+    if high > low:
+        values = (values - low) * (255.0 / (high - low))
+    else:
+        values = np.zeros_like(values)
+    return Image.fromarray(values.round().astype(np.uint8), mode="L")
+
+
+# ── running totals so the savings can be measured ─────────────────────────
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def stats() -> dict:
+    with _stats_lock:
+        out = dict(_stats)
+    out["ratio"] = out["bytes_out"] / out["bytes_in"] if out["bytes_in"] else 1.0
+    return out
+
+
+def _prepare(raw: bytes) -> PreparedImage:
+    if IMAGE_PREPROCESS:
+        prepared = prepare_image(raw)
+    else:
+        prepared = PreparedImage(raw, sniff_media_type(raw), len(raw))
+
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += prepared.original_bytes
+        _stats["bytes_out"] += len(prepared.data)
+    return prepared
+
+
+def _read(path: Path) -> bytes:
+    if dicom_io.is_dicom_path(path):
+        return dicom_io.render_jpeg(path)
+    return path.read_bytes()
+
+
+async def read_bytes(path: Path) -> bytes:
+    """Image bytes for ``path``; a DICOM file yields its rendered frame as JPEG."""
+    return await asyncio.to_thread(_read, path)
+
+
+async def prepare(raw: bytes) -> PreparedImage:
+    """Preprocess already-read image bytes off the event loop."""
+    return await asyncio.to_thread(_prepare, raw)
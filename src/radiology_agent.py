@@ -1,31 +1,148 @@
 # radiology_agent.py (concise + echo patient ID)
-from pydantic_ai import Agent
-from config import vlm_model
-from schema import RadiologyReport
+import json
+from typing import AsyncIterator
+from pydantic_ai import Agent, BinaryContent
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.settings import ModelSettings
+from config import ANALYSE_STREAM_DEBOUNCE, RAD_GUIDED_DECODING, RAD_IMAGE_RETRIES, RAD_REPAIR_RETRIES, vlm_model
+from report_parser import REPORT_SCHEMA, ReportParseError, parse_partial, parse_report, repair_prompt
+from schema import PartialRadiologyReport, RadiologyReport
+import telemetry
 import textwrap
+import time
 
 
 system_prompt = ("""
     You are an **AI radiologist**. Analyze the image and create a structured report in the exact JSON schema provided.
-    
+
     Guidelines:
     • **diagnosis_description** – abnormal findings + anatomical structures visualized. Minimum 3 sentences or longer.
-    • **clinical_recommendations** – clinical‑correlation suggestions  
+    • **clinical_recommendations** – clinical‑correlation suggestions
     • Set `"critical": true` for any abnormal finding.
 
-    Respond **only** with the single JSON tool‑call.
+    Respond **only** with a single JSON object, no code fences or commentary.
     **IMPORTANT*** For the diagnosis_description field, make sure to make it detailed and make it 3 sentences long or longer.
 
-    Format reference:
-    ```json
-    { "...": "See RadiologyReport Pydantic schema" }"""
+    JSON schema:
+    """ + json.dumps(REPORT_SCHEMA)
 )
 
 
+def constrained_output() -> dict:
+    """Request-body fields that make OpenAI-compatible servers decode straight into the schema."""
+    if RAD_GUIDED_DECODING == "json_schema":
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "RadiologyReport", "schema": REPORT_SCHEMA, "strict": True},
+        }}
+    if RAD_GUIDED_DECODING == "guided_json":  # older vLLM
+        return {"guided_json": REPORT_SCHEMA}
+    return {}
+
+
+# The report is returned as plain text and parsed by report_parser, so a
+# near-miss is repaired locally or with a text-only request instead of an
+# output_retries re-ask that would re-send the image.
 radiology_agent = Agent(
     model=vlm_model,
-    output_type=RadiologyReport,
+    output_type=str,
     system_prompt=system_prompt,
-    output_retries=3,
-    temperature=0.0,
+    model_settings=ModelSettings(temperature=0.0, extra_body=constrained_output()),
 )
+
+repair_agent = Agent(
+    model=vlm_model,
+    output_type=str,
+    model_settings=ModelSettings(temperature=0.0, extra_body=constrained_output()),
+)
+
+
+async def analyse_bytes(image_bytes: bytes, media_type: str = "image/jpeg") -> RadiologyReport:
+    """Send one image to the VLM and return the parsed report."""
+    with telemetry.span("analyse.vlm", bytes=len(image_bytes)) as attrs:
+        run = await radiology_agent.run([BinaryContent(data=image_bytes, media_type=media_type)])
+        _count_usage(run.usage(), attrs)
+        return await _parse_or_repair(run.output, image_bytes, media_type, attrs)
+
+
+async def stream_bytes(
+    image_bytes: bytes,
+    media_type: str = "image/jpeg",
+    *,
+    debounce_by: float | None = ANALYSE_STREAM_DEBOUNCE,
+) -> AsyncIterator[PartialRadiologyReport | RadiologyReport]:
+    """
+    Like ``analyse_bytes`` but yields ``PartialRadiologyReport`` snapshots as
+    the report streams in; the last item is the validated report.  An empty
+    stream goes through the same retry path as an unparseable one.
+    """
+    t0 = time.perf_counter()
+    shown = PartialRadiologyReport()
+    text = ""
+    with telemetry.span("analyse.vlm", bytes=len(image_bytes), stream=True) as attrs:
+        async with radiology_agent.run_stream([BinaryContent(data=image_bytes, media_type=media_type)]) as run:
+            async for message, last in run.stream_structured(debounce_by=debounce_by):
+                text = _text(message)
+                partial = parse_partial(text)
+                if last or partial is None or partial == shown:
+                    continue
+                if shown.critical is None and partial.critical is not None:
+                    attrs["first_field_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                shown = partial
+                yield partial
+            _count_usage(run.usage(), attrs)
+        report = await _parse_or_repair(text, image_bytes, media_type, attrs)
+    yield report
+
+
+async def _parse_or_repair(text: str, image_bytes: bytes, media_type: str, attrs: dict) -> RadiologyReport:
+    """
+    Parse the output, asking for text-only repairs (``RAD_REPAIR_RETRIES``)
+    before re-sending the image (``RAD_IMAGE_RETRIES``) as a last resort.
+    Empty output has nothing to repair and goes straight to the image retry.
+    """
+    repairs = image_retries = 0
+    while True:
+        try:
+            report, fixes = parse_report(text)
+            break
+        except ReportParseError as exc:
+            error = exc if text.strip() else ReportParseError("the model returned no output")
+        if repairs < RAD_REPAIR_RETRIES and text.strip():
+            repairs += 1
+            run = await repair_agent.run(repair_prompt(text, error))
+        elif image_retries < RAD_IMAGE_RETRIES:
+            image_retries += 1
+            run = await radiology_agent.run([BinaryContent(data=image_bytes, media_type=media_type)])
+        else:
+            raise UnexpectedModelBehavior(
+                f"Radiology report still invalid after {repairs} repairs and {image_retries} image retries: {error}"
+            )
+        _count_usage(run.usage(), attrs, retry=True)
+        text = run.output
+
+    attrs.update(local_fixes=fixes, repairs=repairs, image_retries=image_retries)
+    telemetry.count("vlm.local_fixes", len(fixes))
+    telemetry.count("vlm.repairs", repairs)
+    telemetry.count("vlm.image_retries", image_retries)
+    telemetry.count("vlm.image_bytes", len(image_bytes) * (1 + image_retries))
+    return report
+
+
+def _text(message: ModelResponse) -> str:
+    return "".join(p.content for p in message.parts if isinstance(p, TextPart))
+
+
+def _count_usage(usage, attrs: dict, *, retry: bool = False) -> None:
+    """Add one run's usage to the span; retries are also tallied separately as their cost."""
+    for name, value in (
+        ("requests", usage.requests),
+        ("request_tokens", usage.request_tokens or 0),
+        ("response_tokens", usage.response_tokens or 0),
+    ):
+        attrs[name] = attrs.get(name, 0) + value
+        telemetry.count(f"vlm.{name}", value)
+        if retry:
+            attrs[f"retry_{name}"] = attrs.get(f"retry_{name}", 0) + value
+            telemetry.count(f"vlm.retry_{name}", value)
@@ -0,0 +1,228 @@
+"""
+Similarity index over a library of confirmed reference cases.
+
+Each image is reduced to a compact "tiny image" embedding (grayscale,
+downsampled to ``EMBED_SIDE``², mean-centred, L2-normalised) so cosine
+similarity is a single matrix-vector product.  The index directory holds:
+
+• embeddings.npy   – float32 [N, D], opened with ``mmap_mode="r"``
+• metadata.jsonl   – one {"path", "case"} record per row
+• centroids.npy    – optional coarse partitioning (spherical k-means);
+  rows are stored grouped by list so each list is a contiguous slice
+• offsets.npy      – start row of every list (+ N at the end)
+• meta.json        – build settings
+
+    python src/reference_index.py build data/cancer
+    python src/reference_index.py query data/image.jpg -k 4
+    python src/reference_index.py bench data/cancer --lists 64
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import dicom_io
+from config import REFERENCE_INDEX_DIR, REFERENCE_N_PROBE
+
+EMBED_SIDE = 16
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", *dicom_io.DICOM_SUFFIXES}
+
+
+def embed_image(path: Path) -> np.ndarray:
+    if dicom_io.is_dicom_path(path):
+        img = dicom_io.render_image(path, max_edge=EMBED_SIDE * 8).convert("L")
+        img = img.resize((EMBED_SIDE, EMBED_SIDE), Image.Resampling.BOX)
+    else:
+        with Image.open(path) as img:
+            img.draft("L", (EMBED_SIDE * 8, EMBED_SIDE * 8))  # JPEG: decode at reduced scale
+            img = img.convert("L").resize((EMBED_SIDE, EMBED_SIDE), Image.Resampling.BOX)
+    vec = np.asarray(img, dtype=np.float32).ravel()
+    vec -= vec.mean()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def _kmeans(data: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors; returns [n_lists, D] unit centroids."""
+    rng = np.random.default_rng(seed)
+    sample = data[rng.choice(len(data), size=min(len(data), 50 * n_lists), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for j in range(n_lists):
+            members = sample[assign == j]
+            if len(members):
+                c = members.sum(axis=0)
+                centroids[j] = c / (np.linalg.norm(c) or 1.0)
+    return centroids
+
+
+def build_index(source: Path, out_dir: Path = REFERENCE_INDEX_DIR, *, n_lists: int = 0, workers: int = 8) -> dict:
+    """Embed every image under ``source`` and write the index to ``out_dir``."""
+    t0 = time.perf_counter()
+    source = source.resolve()
+    paths = sorted(p for p in source.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise ValueError(f"no images found under {source}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        vectors = np.stack(list(pool.map(embed_image, paths)))
+    t_embed = time.perf_counter() - t0
+
+    order = np.arange(len(paths))
+    offsets = None
+    centroids = None
+    n_lists = min(n_lists, len(paths))
+    if n_lists > 1:
+        centroids = _kmeans(vectors, n_lists)
+        assign = np.concatenate([
+            np.argmax(vectors[i:i + 8192] @ centroids.T, axis=1) for i in range(0, len(vectors), 8192)
+        ])
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(n_lists + 1))
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    emb = np.lib.format.open_memmap(out_dir / "embeddings.npy", mode="w+", dtype=np.float32, shape=vectors.shape)
+    emb[:] = vectors[order]
+    emb.flush()
+    del emb
+
+    with (out_dir / "metadata.jsonl").open("w") as f:
+        for i in order:
+            rel = paths[i].relative_to(source)
+            f.write(json.dumps({"path": str(rel), "case": paths[i].stem}) + "\n")
+    for name in ("centroids.npy", "offsets.npy"):
+        (out_dir / name).unlink(missing_ok=True)
+    if centroids is not None:
+        np.save(out_dir / "centroids.npy", centroids)
+        np.save(out_dir / "offsets.npy", offsets)
+
+    meta = {"root": str(source), "count": len(paths), "embed_side": EMBED_SIDE, "n_lists": n_lists}
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    get_index.cache_clear()
+
+    return {**meta, "embed_s": round(t_embed, 3), "build_s": round(time.perf_counter() - t0, 3)}
+
+
+class ReferenceIndex:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.meta = json.loads((self.directory / "meta.json").read_text())
+        self.root = Path(self.meta["root"])
+        self.embeddings = np.load(self.directory / "embeddings.npy", mmap_mode="r")
+        with (self.directory / "metadata.jsonl").open() as f:
+            self.metadata = [json.loads(line) for line in f]
+
+        self.centroids = None
+        self.offsets = None
+        if (self.directory / "centroids.npy").exists():
+            self.centroids = np.load(self.directory / "centroids.npy")
+            self.offsets = np.load(self.directory / "offsets.npy")
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def query(self, vector: np.ndarray, k: int = 4, n_probe: int = REFERENCE_N_PROBE) -> list[dict]:
+        """Top-k most similar cases by cosine similarity."""
+        if n_probe < 1:
+            raise ValueError(f"n_probe must be at least 1, got {n_probe}")
+        if self.centroids is not None and n_probe < len(self.centroids):
+            lists = np.argpartition(-(self.centroids @ vector), n_probe)[:n_probe]
+            rows = np.concatenate([np.arange(self.offsets[j], self.offsets[j + 1]) for j in lists])
+            scores = self.embeddings[rows] @ vector
+        else:
+            rows = None
+            scores = self.embeddings @ vector
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            row = int(rows[i]) if rows is not None else int(i)
+            record = self.metadata[row]
+            results.append({
+                "path": str(self.root / record["path"]),
+                "case": record["case"],
+                "score": round(float(scores[i]), 4),
+            })
+        return results
+
+    def query_image(self, path: Path, k: int = 4, n_probe: int = REFERENCE_N_PROBE) -> list[dict]:
+        return self.query(embed_image(path), k=k, n_probe=n_probe)
+
+
+@lru_cache(maxsize=1)
+def get_index() -> ReferenceIndex | None:
+    """The configured index, or None if it has not been built yet."""
+    if not (REFERENCE_INDEX_DIR / "meta.json").exists():
+        return None
+    return ReferenceIndex(REFERENCE_INDEX_DIR)
+
+
+def benchmark(index: ReferenceIndex, *, queries: int = 200, k: int = 4, n_probe: int = REFERENCE_N_PROBE) -> dict:
+    """Query latency using rows of the index itself as queries."""
+    if queries < 2:
+        raise ValueError(f"queries must be at least 2 to report a p95, got {queries}")
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(index), size=queries)
+    out = {}
+    modes = [("brute_force", len(index.centroids) if index.centroids is not None else 1)]
+    if index.centroids is not None:
+        modes.append(("partitioned", n_probe))
+    for name, probe in modes:
+        timings = []
+        for row in picks:
+            vec = np.asarray(index.embeddings[row])
+            t0 = time.perf_counter()
+            index.query(vec, k=k, n_probe=probe)
+            timings.append((time.perf_counter() - t0) * 1000)
+        qs = statistics.quantiles(timings, n=20)
+        out[name] = {"p50_ms": round(statistics.median(timings), 3), "p95_ms": round(qs[18], 3)}
+    return out
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Build and query the reference-case similarity index.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_build = sub.add_parser("build", help="embed a reference directory")
+    p_build.add_argument("source", type=Path)
+    p_build.add_argument("--out", type=Path, default=REFERENCE_INDEX_DIR)
+    p_build.add_argument("--lists", type=int, default=0, help="coarse partitions (0 = brute force)")
+
+    p_query = sub.add_parser("query", help="find the cases most similar to an image")
+    p_query.add_argument("image", type=Path)
+    p_query.add_argument("-k", type=int, default=4)
+    p_query.add_argument("--index", type=Path, default=REFERENCE_INDEX_DIR)
+
+    p_bench = sub.add_parser("bench", help="build into the index dir and time queries")
+    p_bench.add_argument("source", type=Path)
+    p_bench.add_argument("--out", type=Path, default=REFERENCE_INDEX_DIR)
+    p_bench.add_argument("--lists", type=int, default=0)
+    p_bench.add_argument("--queries", type=int, default=200)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "build":
+        print(json.dumps(build_index(args.source, args.out, n_lists=args.lists)))
+    elif args.cmd == "query":
+        index = ReferenceIndex(args.index)
+        print(json.dumps(index.query_image(args.image, k=args.k), indent=2))
+    else:
+        build = build_index(args.source, args.out, n_lists=args.lists)
+        print(json.dumps({"build": build, "query": benchmark(ReferenceIndex(args.out), queries=args.queries)}),
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Content-addressed cache for radiology reports.
+
+Reports are keyed on the image bytes plus everything that shapes the VLM
+answer (model name, system prompt, output schema), so changing any of them
+naturally misses.  Two tiers:
+
+• memory – small LRU dict, lives for the process
+• disk   – one JSON file per key, evicted by age and total size
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from config import (
+    REPORT_CACHE_DIR,
+    REPORT_CACHE_ENABLED,
+    REPORT_CACHE_MAX_AGE_DAYS,
+    REPORT_CACHE_MAX_MB,
+    REPORT_CACHE_MEMORY_ITEMS,
+)
+
+
+def make_key(
+    image_bytes: bytes,
+    *,
+    model_name: str | None,
+    system_prompt: str,
+    schema: dict,
+    options: dict | None = None,
+) -> str:
+    """Hash the image together with the model settings that produced the report."""
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(image_bytes).digest())
+    h.update(str(model_name).encode())
+    h.update(system_prompt.encode())
+    h.update(json.dumps(schema, sort_keys=True).encode())
+    if options:
+        h.update(json.dumps(options, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class ReportCache:
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        memory_items: int = 256,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: float = 30 * 24 * 3600,
+        enabled: bool = True,
+    ):
+        self.directory = Path(directory)
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes: int | None = None  # computed lazily on first write
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+    # ── lookup ────────────────────────────────────────────────────────────
+    def get(self, key: str) -> dict | None:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return self._memory[key]
+
+        report = self._read_disk(key)
+        with self._lock:
+            if report is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._remember(key, report)
+        return report
+
+    def put(self, key: str, report: dict) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._remember(key, report)
+            self._counters["writes"] += 1
+        self._write_disk(key, report)
+
+    # ── invalidation ──────────────────────────────────────────────────────
+    def invalidate(self, key: str) -> bool:
+        """Drop one entry from both tiers. Returns True if anything was removed."""
+        with self._lock:
+            removed = self._memory.pop(key, None) is not None
+        path = self._path(key)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return removed
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._disk_bytes = 0
+        for path in self.directory.glob("*/*.json"):
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = lookups - self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # ── internals ─────────────────────────────────────────────────────────
+    def _remember(self, key: str, report: dict) -> None:
+        self._memory[key] = report
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            st = path.stat()
+            if time.time() - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                return None
+            report = json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # refresh mtime so size eviction drops the least recently used files first
+        os.utime(path)
+        return report
+
+    def _write_disk(self, key: str, report: dict) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(report))
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(p.stat().st_size for p in self.directory.glob("*/*.json"))
+            else:
+                self._disk_bytes += path.stat().st_size
+            over_budget = self._disk_bytes > self.max_bytes
+        if over_budget:
+            self.prune()
+
+    def prune(self) -> int:
+        """Remove expired entries, then the oldest ones until under the size budget."""
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.directory.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._disk_bytes = total
+            self._counters["evictions"] += removed
+        return removed
+
+
+report_cache = ReportCache(
+    REPORT_CACHE_DIR,
+    memory_items=REPORT_CACHE_MEMORY_ITEMS,
+    max_bytes=int(REPORT_CACHE_MAX_MB * 1024 * 1024),
+    max_age=REPORT_CACHE_MAX_AGE_DAYS * 24 * 3600,
+    enabled=REPORT_CACHE_ENABLED,
+)
@@ -0,0 +1,113 @@
+"""
+Tolerant parsing of the radiology VLM's JSON output.
+
+Near misses are fixed locally instead of asking the model again (which
+would re-send the image):
+
+• Markdown code fences and prose before or after the JSON object
+• key casing / spelling (``Critical``, ``diagnosisDescription``,
+  ``"clinical recommendations"``)
+• a single wrapping object (``{"RadiologyReport": {...}}``)
+• booleans given as strings ("true", "yes") – pydantic's lax mode
+
+Anything still invalid raises ``ReportParseError``; its message is what a
+text-only repair request shows the model.
+"""
+import json
+import re
+
+from pydantic import ValidationError
+from pydantic_core import from_json
+
+from schema import PartialRadiologyReport, RadiologyReport
+
+FENCE = re.compile(r"```[a-zA-Z]*\s*(.*?)(```|$)", re.S)
+
+REPORT_SCHEMA = {**RadiologyReport.model_json_schema(), "additionalProperties": False}
+
+REPAIR_PROMPT = """\
+You fix malformed JSON. The text below was meant to be a single JSON object
+matching this schema:
+
+{schema}
+
+Parsing it failed with: {error}
+
+Only fix the formatting. Do not add, remove or change any findings.
+Return only the corrected JSON object.
+
+Text:
+{text}"""
+
+
+class ReportParseError(ValueError):
+    pass
+
+
+def _norm(key: str) -> str:
+    return re.sub(r"[^a-z]", "", key.lower())
+
+
+FIELDS = {_norm(name): name for name in RadiologyReport.model_fields}
+
+
+def _json_text(text: str, fixes: list[str]) -> str:
+    """The part of ``text`` that should be the JSON object."""
+    if m := FENCE.search(text):
+        text = m.group(1)
+        fixes.append("code_fence")
+    start = text.find("{")
+    if start > 0 and text[:start].strip():
+        fixes.append("leading_text")
+    return text[start:] if start >= 0 else text
+
+
+def normalise_keys(data: dict, fixes: list[str] | None = None) -> dict:
+    """Map near-miss keys onto the schema field names."""
+    if len(data) == 1 and isinstance(inner := next(iter(data.values())), dict) and _norm(next(iter(data))) not in FIELDS:
+        data = inner
+        if fixes is not None:
+            fixes.append("unwrapped")
+    out = {}
+    for key, value in data.items():
+        name = FIELDS.get(_norm(key), key)
+        if name != key and fixes is not None:
+            fixes.append("key_case")
+        out[name] = value
+    return out
+
+
+def parse_report(text: str) -> tuple[RadiologyReport, list[str]]:
+    """Parse model output into a report; returns it with the list of local fixes applied."""
+    fixes: list[str] = []
+    body = _json_text(text, fixes)
+    try:
+        data, end = json.JSONDecoder().raw_decode(body)
+    except json.JSONDecodeError as exc:
+        raise ReportParseError(f"invalid JSON: {exc}") from None
+    if body[end:].strip():
+        fixes.append("trailing_text")
+    if not isinstance(data, dict):
+        raise ReportParseError(f"expected a JSON object, got {type(data).__name__}")
+    try:
+        report = RadiologyReport.model_validate(normalise_keys(data, fixes))
+    except ValidationError as exc:
+        errors = "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+        raise ReportParseError(errors) from None
+    return report, fixes
+
+
+def parse_partial(text: str) -> PartialRadiologyReport | None:
+    """Best-effort parse of a report that is still being generated."""
+    body = _json_text(text, [])
+    if not body.startswith("{"):
+        return None
+    try:
+        data = from_json(body, allow_partial="trailing-strings")
+        return PartialRadiologyReport.model_validate(normalise_keys(data) if isinstance(data, dict) else {})
+    except ValueError:
+        return None
+
+
+def repair_prompt(text: str, error: ReportParseError) -> str:
+    return REPAIR_PROMPT.format(schema=json.dumps(REPORT_SCHEMA), error=error, text=text)
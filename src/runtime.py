@@ -0,0 +1,67 @@
+"""
+One long-lived asyncio event loop for the whole process.
+
+Streamlit re-executes the script on every interaction, so anything that has
+to outlive a single turn (MCP stdio subprocesses, their anyio streams) must
+live on a loop that is not torn down by ``asyncio.run``.  The loop runs in a
+daemon thread; the Streamlit thread submits coroutines to it and blocks on
+the result, or consumes an async generator through ``iterate`` so UI
+updates still happen on the script thread.
+"""
+import asyncio
+import concurrent.futures
+import queue
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+_DONE = object()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="runtime-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run(coro: Awaitable[T], timeout: float | None = None) -> T:
+    """Run ``coro`` on the background loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def submit(coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+    """Start ``coro`` on the background loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def iterate(agen: AsyncIterator[T]) -> Iterator[T]:
+    """Drive ``agen`` on the background loop, yielding its items in the calling thread."""
+    items: queue.Queue = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except BaseException as exc:
+            items.put(exc)
+            raise
+        finally:
+            items.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while (item := items.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # the consumer went away early (e.g. Streamlit stopped the script)
+        if not future.done():
+            future.cancel()
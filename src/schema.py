@@ -11,4 +11,10 @@ class RadiologyReport(BaseModel):
     )
     clinical_recommendations: str = Field(
         description="Concrete next steps (imaging, biopsy, labs, referral)"
-    )
\ No newline at end of file
+    )
+
+class PartialRadiologyReport(BaseModel):
+    """The fields of a ``RadiologyReport`` the VLM has produced so far while streaming."""
+    critical: Optional[bool] = None
+    diagnosis_description: Optional[str] = None
+    clinical_recommendations: Optional[str] = None
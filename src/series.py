@@ -0,0 +1,194 @@
+"""
+Study-level analysis of a series of images.
+
+A series is a folder of slices/views, a list of files, or the frames of a
+multi-frame DICOM.  The images are analysed concurrently through the normal
+cached path with at most ``SERIES_CONCURRENCY`` VLM calls in flight.  With
+``SERIES_MONTAGE=n`` every ``n`` downscaled, labelled slices are tiled into
+one montage per request, which cuts the call count roughly n-fold at the
+cost of per-slice resolution.
+
+The per-image reports are merged into one report with the
+``RadiologyReport`` fields: ``critical`` if any image is critical, and
+findings / recommendations with repeated sentences removed.
+"""
+import asyncio
+import io
+import math
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from PIL import Image, ImageDraw
+
+import dicom_io
+import preprocess
+import telemetry
+from config import IMAGE_MAX_EDGE, SERIES_CONCURRENCY, SERIES_MAX_IMAGES, SERIES_MONTAGE
+
+SERIES_SUFFIXES = {".jpg", ".jpeg", ".png", *dicom_io.DICOM_SUFFIXES}
+SIMILAR = 0.8  # word-set Jaccard above which two sentences count as the same finding
+STOPWORDS = frozenset("a an the is are was were of in on at and or with to there this these".split())
+
+
+@dataclass
+class SeriesItem:
+    label: str
+    path: Path
+    frame: int | None = None
+
+    async def load(self) -> bytes:
+        if self.frame is None:
+            return await preprocess.read_bytes(self.path)
+        return await asyncio.to_thread(dicom_io.render_jpeg, self.path, self.frame)
+
+
+def collect_series(source: str | Path | list, max_images: int = SERIES_MAX_IMAGES) -> list[SeriesItem]:
+    """
+    Expand a folder, a list of files or a multi-frame DICOM into series items.
+
+    Longer series are sampled evenly down to ``max_images``.
+    """
+    if isinstance(source, (str, Path)):
+        source = Path(source).expanduser().resolve()
+        if source.is_dir():
+            paths = sorted(p for p in source.iterdir() if p.suffix.lower() in SERIES_SUFFIXES)
+        else:
+            paths = [source]
+    else:
+        paths = [Path(p).expanduser().resolve() for p in source]
+
+    items = []
+    for path in paths:
+        if dicom_io.is_dicom_path(path) and (frames := dicom_io.read_info(path).frames) > 1:
+            items += [SeriesItem(f"{path.stem} frame {i + 1}", path, i) for i in range(frames)]
+        else:
+            items.append(SeriesItem(path.stem, path))
+
+    if max_images and len(items) > max_images:
+        step = (len(items) - 1) / (max_images - 1) if max_images > 1 else 0
+        items = [items[round(i * step)] for i in range(max_images)]
+    return items
+
+
+def make_montage(images: list[bytes], labels: list[str], edge: int = IMAGE_MAX_EDGE) -> bytes:
+    """Tile the images on a square grid, each labelled in its corner."""
+    cols = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / cols)
+    tile = edge // cols
+    sheet = Image.new("L", (cols * tile, rows * tile))
+    draw = ImageDraw.Draw(sheet)
+    for i, (data, label) in enumerate(zip(images, labels)):
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("L", (tile, tile))
+            img = img.convert("L")
+            img.thumbnail((tile, tile), Image.Resampling.LANCZOS)
+        x, y = (i % cols) * tile, (i // cols) * tile
+        sheet.paste(img, (x + (tile - img.width) // 2, y + (tile - img.height) // 2))
+        draw.text((x + 4, y + 4), label, fill=255)
+    buf = io.BytesIO()
+    sheet.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+# ── merging ───────────────────────────────────────────────────────────────
+def _sentences(text: str) -> list[str]:
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+", text or "") if s.strip()]
+
+
+def _words(sentence: str) -> frozenset[str]:
+    return frozenset(re.findall(r"[a-z0-9]+", sentence.lower())) - STOPWORDS
+
+
+def dedupe_sentences(texts: list[str]) -> str:
+    """Join the sentences of ``texts``, dropping any that repeat an earlier one."""
+    kept: list[tuple[str, frozenset[str]]] = []
+    for text in texts:
+        for sentence in _sentences(text):
+            words = _words(sentence)
+            if not words:
+                continue
+            if any(len(words & seen) / len(words | seen) >= SIMILAR for _, seen in kept):
+                continue
+            kept.append((sentence, words))
+    return " ".join(sentence for sentence, _ in kept)
+
+
+def merge_reports(results: list[tuple[str, dict]]) -> dict:
+    """One study-level report from ``(label, report)`` pairs."""
+    critical = [label for label, report in results if report.get("critical")]
+    return {
+        "critical": bool(critical),
+        "diagnosis_description": dedupe_sentences([r.get("diagnosis_description", "") for _, r in results]),
+        "clinical_recommendations": dedupe_sentences([r.get("clinical_recommendations", "") for _, r in results]),
+        "critical_images": critical,
+        "per_image": [{"label": label, "critical": bool(r.get("critical"))} for label, r in results],
+    }
+
+
+# ── fan-out ───────────────────────────────────────────────────────────────
+async def analyse_series(
+    items: list[SeriesItem],
+    analyse: Callable[[bytes], Awaitable[dict]],
+    *,
+    concurrency: int = SERIES_CONCURRENCY,
+    montage: int = SERIES_MONTAGE,
+) -> dict:
+    """
+    Analyse every item (or montage of items) with ``analyse`` and merge the results.
+
+    ``stats`` compares the calls and wall time with analysing the images one
+    by one.  Nothing is run one by one: ``one_by_one_estimate_s`` is the mean
+    latency of this run's calls (load, montage and VLM call, timed while up to
+    ``concurrency`` of them were in flight) times the number of images.  With
+    montages each of those calls covered several images, so the estimate is
+    rougher still; ``bench.run`` times a real sequential pass instead.
+    """
+    if not items:
+        raise ValueError("the series contains no images")
+    per_call = montage if montage > 1 else 1
+    units = [items[i:i + per_call] for i in range(0, len(items), per_call)]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies: list[float] = []
+
+    async def run(unit: list[SeriesItem]) -> dict:
+        async with semaphore:  # also bounds how many decoded images are in memory
+            t0 = time.perf_counter()
+            images = [await item.load() for item in unit]
+            if len(unit) == 1:
+                data = images[0]
+            else:
+                data = await asyncio.to_thread(make_montage, images, [item.label for item in unit])
+            report = await analyse(data)
+            latencies.append(time.perf_counter() - t0)
+            return report
+
+    t0 = time.perf_counter()
+    with telemetry.span("series.analyse", images=len(items), calls=len(units)):
+        outcomes = await asyncio.gather(*(run(unit) for unit in units), return_exceptions=True)
+    wall = time.perf_counter() - t0
+
+    labels = [unit[0].label if len(unit) == 1 else f"{unit[0].label} – {unit[-1].label}" for unit in units]
+    results = [(label, r) for label, r in zip(labels, outcomes) if not isinstance(r, BaseException)]
+    errors = [f"{label}: {type(r).__name__}: {r}" for label, r in zip(labels, outcomes) if isinstance(r, BaseException)]
+    if not results:
+        raise outcomes[0]
+
+    merged = merge_reports(results)
+    mean_call = sum(latencies) / len(latencies) if latencies else 0.0
+    merged["stats"] = {
+        "images": len(items),
+        "calls": len(units),
+        "concurrency": concurrency,
+        "montage": per_call,
+        "wall_s": round(wall, 3),
+        "one_by_one_calls": len(items),
+        "one_by_one_estimate_s": round(mean_call * len(items), 3),
+    }
+    if errors:
+        merged["errors"] = errors
+    telemetry.count("series.images", len(items))
+    telemetry.count("series.calls", len(units))
+    return merged
@@ -0,0 +1,448 @@
+"""
+Headless HTTP service for PACS and other integrations – no Streamlit.
+
+    python src/service.py --port 8080
+
+    POST /v1/uploads               image body → {"ref": "upload:<sha256>"}
+    POST /v1/analyses              image body, or JSON {"image": "upload:<sha256>"}
+                                   → 202 {"id", "status", "links"}; 429 + Retry-After when full
+    GET  /v1/analyses/{id}         status, queue position, report or error
+    GET  /v1/analyses/{id}/events  server-sent events: status, partial…, report | error
+    POST /v1/chat                  JSON {"session_id"?, "message" | "image"} → the assistant's reply
+                                   (server-sent delta / partial / tool / done with Accept: text/event-stream)
+    GET  /healthz                  queue depth, workers, sessions, warm-up
+    GET  /metrics                  Prometheus text from ``telemetry``
+
+Analyses wait in a bounded queue (``SERVICE_QUEUE_SIZE``) drained by
+``SERVICE_WORKERS`` workers through the normal cached, coalesced
+``stream_analysis`` path.  A full queue answers 429 at once, with a
+Retry-After estimated from the recent job time, instead of letting latency
+grow without bound.  Chat turns run the same ``workflow`` fast paths and
+orchestrator as the UI, at most ``SERVICE_CHAT_CONCURRENCY`` at a time;
+sessions are kept by ``session_store``, so a ``session_id`` still works
+after a restart.  File paths are only accepted as images with
+``SERVICE_ALLOW_PATHS=1``.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from aiohttp import web
+from pydantic_ai.agent import AgentRunResult
+from pydantic_ai.messages import FunctionToolResultEvent
+
+import orchestrator
+import telemetry
+import warmup
+from config import (
+    SERVICE_ALLOW_PATHS,
+    SERVICE_CHAT_CONCURRENCY,
+    SERVICE_HOST,
+    SERVICE_JOB_TTL,
+    SERVICE_PORT,
+    SERVICE_QUEUE_SIZE,
+    SERVICE_WORKERS,
+    UPLOAD_MAX_MB,
+    WARMUP,
+)
+from outbox import outbox
+from schema import PartialRadiologyReport
+from session_store import Session, SessionStore, session_store
+from tools_orchestrator import resolve_image_path, stream_analysis
+from upload_store import CHUNK_SIZE, UploadTooLarge, is_ref, upload_store
+
+SUFFIXES = {"image/jpeg": ".jpg", "image/png": ".png", "application/dicom": ".dcm"}
+KEEPALIVE = 15.0  # seconds between SSE comments while nothing happens
+
+
+# ── analysis jobs ─────────────────────────────────────────────────────────
+@dataclass
+class Job:
+    id: str
+    image: str
+    seq: int
+    status: str = "queued"  # queued | running | done | failed
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    partial: dict | None = None
+    report: dict | None = None
+    error: str | None = None
+    listeners: set[asyncio.Queue] = field(default_factory=set, repr=False)
+
+    @property
+    def final(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def publish(self, event: str, data: dict) -> None:
+        for listener in self.listeners:
+            listener.put_nowait((event, data))
+
+
+class AnalysisQueue:
+    def __init__(self, *, workers: int = 4, max_queued: int = 64, ttl: float = 3600.0):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.jobs: dict[str, Job] = {}
+
+        self._queue: asyncio.Queue[Job] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._submitted = 0
+        self._taken = 0
+        self._running = 0
+        self._job_s = 5.0  # moving average of the run time, for Retry-After
+        self._pruned = 0.0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"analysis-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, image: str) -> Job:
+        """Queue an analysis; raises ``asyncio.QueueFull`` when the queue is at capacity."""
+        self._prune()
+        job = Job(uuid.uuid4().hex, image, self._submitted + 1)
+        self._queue.put_nowait(job)
+        self._submitted += 1
+        self.jobs[job.id] = job
+        telemetry.count("service.accepted")
+        return job
+
+    def view(self, job: Job) -> dict:
+        out = {"id": job.id, "status": job.status, "image": job.image, "created": job.created}
+        if job.status == "queued":
+            out["ahead"] = job.seq - self._taken - 1
+        if job.started is not None:
+            out["queued_s"] = round(job.started - job.created, 3)
+        if job.finished is not None:
+            out["run_s"] = round(job.finished - job.started, 3)
+        if job.report is not None:
+            out["report"] = job.report
+        if job.error is not None:
+            out["error"] = job.error
+        return out
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up."""
+        return max(1, math.ceil((self._queue.qsize() + self._running) * self._job_s / self.workers))
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self._running,
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "jobs": len(self.jobs),
+            "mean_job_s": round(self._job_s, 3),
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._taken += 1
+            self._running += 1
+            try:
+                await self._run(job)
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status, job.started = "running", time.time()
+        telemetry.record("service.queue_wait", job.started - job.created)
+        job.publish("status", self.view(job))
+        with telemetry.turn("service"):
+            try:
+                async for item in stream_analysis(job.image):
+                    if isinstance(item, PartialRadiologyReport):
+                        job.partial = item.model_dump(exclude_none=True)
+                        job.publish("partial", job.partial)
+                    else:
+                        job.report = item
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                job.status, job.error = "failed", f"{type(exc).__name__}: {exc}"
+                telemetry.count("service.failed")
+            else:
+                job.status = "done"
+            job.finished = time.time()
+            self._job_s = 0.8 * self._job_s + 0.2 * (job.finished - job.started)
+        job.publish("report" if job.status == "done" else "error", self.view(job))
+
+    def _prune(self) -> None:
+        now = time.time()
+        if now - self._pruned < 10:
+            return
+        self._pruned = now
+        for job_id in [j.id for j in self.jobs.values() if j.final and now - j.finished > self.ttl]:
+            del self.jobs[job_id]
+
+
+# ── HTTP ──────────────────────────────────────────────────────────────────
+class Service:
+    def __init__(
+        self,
+        *,
+        workers: int = SERVICE_WORKERS,
+        max_queued: int = SERVICE_QUEUE_SIZE,
+        chat_concurrency: int = SERVICE_CHAT_CONCURRENCY,
+        job_ttl: float = SERVICE_JOB_TTL,
+        sessions: SessionStore = session_store,
+        allow_paths: bool = SERVICE_ALLOW_PATHS,
+        warm_up: bool = WARMUP,
+    ):
+        self.analyses = AnalysisQueue(workers=workers, max_queued=max_queued, ttl=job_ttl)
+        self.chat_concurrency = chat_concurrency
+        self.allow_paths = allow_paths
+        self.sessions = sessions
+        self.orchestrator = None
+        self.warm_up = warm_up
+        self._chats = 0
+        self._warmup: asyncio.Task | None = None
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=int(UPLOAD_MAX_MB * 1024 * 1024))
+        app.router.add_post("/v1/uploads", self.upload)
+        app.router.add_post("/v1/analyses", self.create_analysis)
+        app.router.add_get("/v1/analyses/{id}", self.get_analysis)
+        app.router.add_get("/v1/analyses/{id}/events", self.analysis_events)
+        app.router.add_post("/v1/chat", self.chat)
+        app.router.add_get("/healthz", self.health)
+        app.router.add_get("/metrics", self.metrics)
+        app.on_startup.append(self._startup)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _startup(self, app: web.Application) -> None:
+        await outbox.start()
+        await self.analyses.start()
+        self.orchestrator = await orchestrator.build_orchestrator()
+        if self.warm_up:  # in the background, so the port opens at once
+            self._warmup = asyncio.create_task(warmup.warm_up(), name="warmup")
+
+    async def _cleanup(self, app: web.Application) -> None:
+        if self._warmup is not None and not self._warmup.done():
+            self._warmup.cancel()
+        await self.analyses.stop()
+        await outbox.stop()
+
+    # ── analyses ──────────────────────────────────────────────────────────
+    async def upload(self, request: web.Request) -> web.Response:
+        ref = await self._store(request)
+        return web.json_response({"ref": ref}, status=201)
+
+    async def create_analysis(self, request: web.Request) -> web.Response:
+        if request.content_type == "application/json":
+            image = self._image_arg((await _json_body(request)).get("image"))
+        else:
+            image = await self._store(request)
+        try:
+            job = self.analyses.submit(image)
+        except asyncio.QueueFull:
+            telemetry.count("service.rejected")
+            retry = self.analyses.retry_after()
+            return web.json_response(
+                {"error": "analysis queue is full", "retry_after_s": retry},
+                status=429, headers={"Retry-After": str(retry)},
+            )
+        links = {"self": f"/v1/analyses/{job.id}", "events": f"/v1/analyses/{job.id}/events"}
+        return web.json_response({**self.analyses.view(job), "links": links}, status=202,
+                                 headers={"Location": links["self"]})
+
+    async def get_analysis(self, request: web.Request) -> web.Response:
+        return web.json_response(self.analyses.view(self._job(request)))
+
+    async def analysis_events(self, request: web.Request) -> web.StreamResponse:
+        job = self._job(request)
+        listener: asyncio.Queue = asyncio.Queue()
+        job.listeners.add(listener)
+        try:
+            resp = await _sse(request)
+            await _send(resp, "status", self.analyses.view(job))
+            if job.final:
+                await _send(resp, "report" if job.status == "done" else "error", self.analyses.view(job))
+                return resp
+            if job.partial:
+                await _send(resp, "partial", job.partial)
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(listener.get(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await resp.write(b": keep-alive\n\n")
+                    continue
+                await _send(resp, event, data)
+                if event in ("report", "error"):
+                    return resp
+        finally:
+            job.listeners.discard(listener)
+
+    # ── chat ──────────────────────────────────────────────────────────────
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await _json_body(request)
+        message, image, session_id = body.get("message"), body.get("image"), body.get("session_id")
+        if not message and not image:
+            raise web.HTTPBadRequest(text="send a message or an image")
+        if not isinstance(message or "", str) or not isinstance(session_id or "", str):
+            raise web.HTTPBadRequest(text='"message" and "session_id" must be strings')
+        if self._chats >= self.chat_concurrency:
+            telemetry.count("service.rejected")
+            return web.json_response({"error": "too many chat turns in flight"}, status=429,
+                                     headers={"Retry-After": "1"})
+        self._chats += 1  # before any await, so concurrent requests see it
+        try:
+            return await self._chat_turn(request, message, image and self._image_arg(image), session_id)
+        finally:
+            self._chats -= 1
+
+    async def _chat_turn(self, request: web.Request, message: str | None, image: str | None,
+                         session_id: str | None) -> web.StreamResponse:
+        session = self._session(session_id)
+        if image:
+            events = session.workflow.on_upload(image, session.history)
+        else:
+            events = session.workflow.on_message(
+                message, session.history, lambda text, messages: orchestrator.turn_events(self.orchestrator, text, messages),
+            )
+
+        stream = "text/event-stream" in request.headers.get("Accept", "")
+        resp = await _sse(request) if stream else None
+        reply, tools = "", []
+        try:
+            async with session.lock:  # one turn at a time per session
+                try:
+                    async for ev in events:
+                        if isinstance(ev, str):
+                            reply += ev
+                            if resp:
+                                await _send(resp, "delta", {"text": ev})
+                        elif isinstance(ev, PartialRadiologyReport):
+                            if resp:
+                                await _send(resp, "partial", ev.model_dump(exclude_none=True))
+                        elif isinstance(ev, FunctionToolResultEvent):
+                            tool = {"tool": ev.result.tool_name, "result": getattr(ev.result, "content", None)}
+                            tools.append(tool)
+                            if resp:
+                                await _send(resp, "tool", tool)
+                        elif isinstance(ev, AgentRunResult):
+                            session.history.append_run(ev)
+                finally:
+                    self.sessions.save(session)  # only what this turn added
+        except FileNotFoundError as exc:  # an upload the turn refers to was evicted meanwhile
+            if not resp:
+                raise web.HTTPGone(text=str(exc))
+            await _send(resp, "error", {"session_id": session.id, "error": str(exc)})
+            return resp
+        finally:
+            session.last_used = time.time()
+
+        done = {"session_id": session.id, "reply": reply, "tools": tools,
+                "step": session.workflow.step.value, "report": session.workflow.report}
+        if resp:
+            await _send(resp, "done", done)
+            return resp
+        return web.json_response(done, dumps=_dumps)
+
+    # ── ops ───────────────────────────────────────────────────────────────
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "analyses": self.analyses.stats(),
+            "chats": self._chats,
+            "sessions": self.sessions.stats(),
+            "outbox": outbox.stats(),
+            "warmup": warmup.status,
+        })
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=telemetry.collector.render_prometheus(), content_type="text/plain")
+
+    # ── helpers ───────────────────────────────────────────────────────────
+    async def _store(self, request: web.Request) -> str:
+        """Stream the body into the upload store; answers 413 as soon as it passes the size limit."""
+        limit = upload_store.max_file_bytes
+        name = request.headers.get("X-Filename") or f"upload{SUFFIXES.get(request.content_type, '')}"
+        if request.content_length is not None and request.content_length > limit:
+            raise web.HTTPRequestEntityTooLarge(max_size=limit, actual_size=request.content_length,
+                                                text=f"{name} is larger than {limit / 2**20:g} MB")
+        incoming = await asyncio.to_thread(upload_store.receive, name)
+        try:
+            with incoming:
+                async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+                    await asyncio.to_thread(incoming.write, chunk)
+                if not incoming.size:
+                    raise web.HTTPBadRequest(text="empty image body")
+                upload = await asyncio.to_thread(incoming.finish)
+        except UploadTooLarge as exc:
+            raise web.HTTPRequestEntityTooLarge(max_size=limit, actual_size=incoming.size, text=str(exc))
+        return upload.ref
+
+    def _image_arg(self, image) -> str:
+        if not isinstance(image, str) or not image:
+            raise web.HTTPBadRequest(text='"image" must be an upload:<sha256> reference')
+        if not is_ref(image) and not self.allow_paths:
+            raise web.HTTPBadRequest(text="file paths are disabled; POST the image to /v1/uploads first")
+        try:
+            resolve_image_path(image)
+        except FileNotFoundError as exc:  # an upload evicted from the store
+            raise web.HTTPGone(text=str(exc))
+        return image
+
+    def _job(self, request: web.Request) -> Job:
+        job = self.analyses.jobs.get(request.match_info["id"])
+        if job is None:
+            raise web.HTTPNotFound(text="no such analysis (finished jobs expire after SERVICE_JOB_TTL)")
+        return job
+
+    def _session(self, session_id: str | None) -> Session:
+        try:
+            return self.sessions.get(session_id)
+        except ValueError as exc:
+            raise web.HTTPBadRequest(text=str(exc))
+
+
+async def _json_body(request: web.Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="the body is not valid JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="the body must be a JSON object")
+    return body
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, default=str)
+
+
+async def _sse(request: web.Request) -> web.StreamResponse:
+    resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await resp.prepare(request)
+    return resp
+
+
+async def _send(resp: web.StreamResponse, event: str, data: dict) -> None:
+    await resp.write(f"event: {event}\ndata: {_dumps(data)}\n\n".encode())
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Headless radiology analysis service.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE)
+    args = parser.parse_args(argv)
+    web.run_app(Service(workers=args.workers, max_queued=args.queue_size).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Persistent chat sessions: one append-only binary log per session.
+
+A session is the orchestrator history (``ConversationHistory``), the
+``Workflow`` state and the chat as the UI shows it.  Each is written to
+``<dir>/<id[:2]>/<id>.log``: the magic ``RSL1`` followed by records
+
+    kind (1 byte) | payload length (4 bytes) | crc32 (4 bytes) | payload
+
+with a zlib-compressed JSON payload (a preset dictionary of the keys
+pydantic-ai messages repeat keeps even a one-message record small):
+
+• ``M`` – the messages a turn added (``ModelMessagesTypeAdapter`` JSON)
+• ``D`` – the chat lines a turn added
+• ``W`` – the workflow state when it changed, and the turn's token stats
+• ``S`` – the whole history; written when ``ConversationHistory`` compacts
+  older turns, which makes everything before it obsolete, so the log is
+  rewritten as ``S`` + ``D`` + ``W`` (temp file + ``os.replace``)
+
+``save`` after a turn appends only what the turn added, in one write.  A
+record torn by a crash fails its length or CRC check and is cut off on the
+next load.
+
+``SessionStore`` keeps the sessions in use in memory.  Any other one is
+read from its log on first access (resume after a restart or eviction);
+sessions idle for ``idle_ttl`` seconds, or beyond ``max_live`` least
+recently used, are dropped from memory.  Logs unused for ``max_age`` are
+deleted.
+"""
+import asyncio
+import json
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+from pydantic_ai.messages import ModelMessagesTypeAdapter
+
+import telemetry
+from config import SESSION_DIR, SESSION_IDLE_TTL, SESSION_MAX_AGE_DAYS, SESSION_MAX_LIVE
+from history import ConversationHistory
+from orchestrator import SYSTEM_PROMPT
+from workflow import Step, Workflow
+
+MAGIC = b"RSL1"
+HEADER = struct.Struct(">cII")
+MESSAGES, DISPLAY, STATE, SNAPSHOT = b"M", b"D", b"W", b"S"
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Part of the format: changing it needs a new MAGIC.  zlib matches the end of
+# the dictionary most cheaply, so the most frequent fragments come last.
+ZDICT = (
+    b'"diagnosis_description":"clinical_recommendations":"critical":true,"critical":false,'
+    b'"show_reference_images_tool","send_email","analyse_series_tool","analyse_image_base64",'
+    b'{"role":"user","content":"{"role":"assistant","content":"Would you like '
+    b'"usage":{"requests":1,"request_tokens":"response_tokens":"total_tokens":"details":null},'
+    b'"vendor_details":null,"vendor_id":null,"model_name":"instructions":null,'
+    b'"dynamic_ref":null,"part_kind":"system-prompt"},"part_kind":"user-prompt"},'
+    b'"part_kind":"tool-call"},"part_kind":"tool-return"},"part_kind":"text"},'
+    b'{"tool_name":"args":{"path":"upload:"tool_call_id":"call_'
+    b'"kind":"response"},"kind":"request"},[{"parts":[{"content":"'
+    b'"timestamp":"20'
+)
+
+
+def _pack(kind: bytes, data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zdict=ZDICT)
+    payload = compressor.compress(data) + compressor.flush()
+    return HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+
+def _records(data: bytes) -> Iterator[tuple[bytes, bytes, int]]:
+    """(kind, JSON, end offset) of every intact record; stops at a torn one."""
+    offset = len(MAGIC)
+    while offset + HEADER.size <= len(data):
+        kind, length, crc = HEADER.unpack_from(data, offset)
+        start, end = offset + HEADER.size, offset + HEADER.size + length
+        payload = data[start:end]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        decompressor = zlib.decompressobj(zdict=ZDICT)
+        yield kind, decompressor.decompress(payload) + decompressor.flush(), end
+        offset = end
+
+
+def _workflow_state(workflow: Workflow) -> dict:
+    return {
+        "step": workflow.step.value,
+        "image_path": workflow.image_path,
+        "report": workflow.report,
+        "stats": workflow.stats,
+    }
+
+
+@dataclass
+class Session:
+    id: str
+    history: ConversationHistory = field(default_factory=ConversationHistory)
+    workflow: Workflow = field(default_factory=lambda: Workflow(SYSTEM_PROMPT))
+    display: list[dict] = field(default_factory=list)  # {"role", "content"} as the UI shows it
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.time)
+
+    # what the log already holds
+    saved_messages: int = field(default=0, repr=False)
+    saved_compactions: int = field(default=0, repr=False)
+    saved_display: int = field(default=0, repr=False)
+    saved_turns: int = field(default=0, repr=False)
+    saved_state: dict | None = field(default=None, repr=False)
+
+
+class SessionStore:
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        idle_ttl: float = 900.0,
+        max_live: int = 1000,
+        max_age: float = 30 * 24 * 3600,
+    ):
+        self.directory = Path(directory)
+        self.idle_ttl = idle_ttl
+        self.max_live = max_live
+        self.max_age = max_age
+
+        self._live: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self._swept = 0.0
+        self._pruned = 0.0
+        self._counters = {"created": 0, "resumed": 0, "evicted": 0, "saves": 0, "bytes_written": 0, "torn": 0}
+
+    # ── sessions ──────────────────────────────────────────────────────────
+    def get(self, session_id: str | None = None) -> Session:
+        """The session ``session_id`` (resumed from its log if not in memory), or a new one."""
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        elif not SESSION_ID.fullmatch(session_id):
+            raise ValueError("session ids are 1-64 letters, digits, '-' or '_'")
+
+        self._sweep()
+        with self._lock:
+            session = self._live.get(session_id)
+            if session is not None:
+                self._live.move_to_end(session_id)
+                session.last_used = time.time()
+                return session
+
+        loaded = self._load(session_id)
+        with self._lock:
+            session = self._live.get(session_id)  # another thread may have loaded it meanwhile
+            if session is None:
+                session = loaded or Session(session_id)
+                self._live[session_id] = session
+                self._counters["resumed" if loaded else "created"] += 1
+            session.last_used = time.time()
+            evicted = self._evict_over(self.max_live)
+        for old in evicted:
+            self.save(old)  # normally a no-op: turns save as they finish
+        return session
+
+    def save(self, session: Session) -> int:
+        """Append what changed since the last save; returns the bytes written."""
+        history = session.history
+        if history.compactions != session.saved_compactions:
+            return self._rewrite(session)
+
+        state = _workflow_state(session.workflow)
+        turns = history.turn_stats[session.saved_turns:]
+        chunks = []
+        if messages := history.messages[session.saved_messages:]:
+            chunks.append(_pack(MESSAGES, ModelMessagesTypeAdapter.dump_json(messages)))
+        if lines := session.display[session.saved_display:]:
+            chunks.append(_pack(DISPLAY, json.dumps(lines).encode()))
+        if turns or state != session.saved_state:
+            record = {"turns": turns}
+            if state != session.saved_state:
+                record["workflow"] = state
+            chunks.append(_pack(STATE, json.dumps(record, default=str).encode()))
+        if not chunks:
+            return 0
+
+        path = self._path(session.id)
+        with telemetry.span("session.save") as attrs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "ab") as f:
+                if f.tell() == 0:
+                    chunks.insert(0, MAGIC)
+                data = b"".join(chunks)
+                f.write(data)
+            attrs["bytes"] = len(data)
+        self._saved(session, state, len(data))
+        return len(data)
+
+    def evict(self, session_id: str) -> bool:
+        """Drop a session from memory (its log stays). Returns True if it was live."""
+        with self._lock:
+            session = self._live.get(session_id)
+            if session is None or session.lock.locked():
+                return False
+            del self._live[session_id]
+            self._counters["evicted"] += 1
+        self.save(session)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "live": len(self._live)}
+
+    # ── disk ──────────────────────────────────────────────────────────────
+    def prune(self) -> int:
+        """Delete logs of sessions unused for ``max_age`` seconds."""
+        now = time.time()
+        removed = 0
+        for path in self.directory.glob("*/*.log"):
+            try:
+                if now - path.stat().st_mtime > self.max_age and path.stem not in self._live:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def _path(self, session_id: str) -> Path:
+        return self.directory / session_id[:2] / f"{session_id}.log"
+
+    def _load(self, session_id: str) -> Session | None:
+        path = self._path(session_id)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(MAGIC):
+            return None
+
+        with telemetry.span("session.load", bytes=len(data)):
+            session = Session(session_id)
+            history, end = session.history, len(MAGIC)
+            for kind, payload, end in _records(data):
+                if kind == SNAPSHOT:
+                    history.messages = ModelMessagesTypeAdapter.validate_json(payload)
+                    history.turn_stats, session.display = [], []
+                elif kind == MESSAGES:
+                    history.messages.extend(ModelMessagesTypeAdapter.validate_json(payload))
+                elif kind == DISPLAY:
+                    session.display.extend(json.loads(payload))
+                elif kind == STATE:
+                    record = json.loads(payload)
+                    history.turn_stats.extend(record["turns"])
+                    if state := record.get("workflow"):
+                        session.workflow = Workflow(
+                            SYSTEM_PROMPT, step=Step(state["step"]), image_path=state["image_path"],
+                            report=state["report"], stats=state["stats"],
+                        )
+            if end < len(data):  # a crash tore the last write; later appends must not follow it
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+                with self._lock:
+                    self._counters["torn"] += 1
+        self._saved(session, _workflow_state(session.workflow), 0, save=False)
+        os.utime(path)
+        return session
+
+    def _rewrite(self, session: Session) -> int:
+        history = session.history
+        state = _workflow_state(session.workflow)
+        data = b"".join([
+            MAGIC,
+            _pack(SNAPSHOT, ModelMessagesTypeAdapter.dump_json(history.messages)),
+            _pack(DISPLAY, json.dumps(session.display).encode()),
+            _pack(STATE, json.dumps({"turns": history.turn_stats, "workflow": state}, default=str).encode()),
+        ])
+        path = self._path(session.id)
+        with telemetry.span("session.snapshot", bytes=len(data)):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        self._saved(session, state, len(data))
+        return len(data)
+
+    def _saved(self, session: Session, state: dict, written: int, *, save: bool = True) -> None:
+        session.saved_messages = len(session.history.messages)
+        session.saved_compactions = session.history.compactions
+        session.saved_display = len(session.display)
+        session.saved_turns = len(session.history.turn_stats)
+        session.saved_state = json.loads(json.dumps(state, default=str))  # a copy, as it was written
+        if save:
+            with self._lock:
+                self._counters["saves"] += 1
+                self._counters["bytes_written"] += written
+
+    # ── memory ────────────────────────────────────────────────────────────
+    def _sweep(self) -> None:
+        now = time.time()
+        if now - self._swept < min(10.0, self.idle_ttl):
+            return
+        self._swept = now
+        with self._lock:
+            idle = [sid for sid, s in self._live.items() if now - s.last_used > self.idle_ttl]
+        for sid in idle:
+            self.evict(sid)
+        if now - self._pruned > 3600:
+            self._pruned = now
+            self.prune()
+
+    def _evict_over(self, limit: int) -> list[Session]:
+        """Drop least recently used sessions beyond ``limit``; called with the lock held."""
+        evicted = []
+        for sid in list(self._live):
+            if len(self._live) <= limit:
+                break
+            if self._live[sid].lock.locked():
+                continue
+            evicted.append(self._live.pop(sid))
+            self._counters["evicted"] += 1
+        return evicted
+
+
+session_store = SessionStore(
+    SESSION_DIR,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_live=SESSION_MAX_LIVE,
+    max_age=SESSION_MAX_AGE_DAYS * 24 * 3600,
+)
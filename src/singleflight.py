@@ -0,0 +1,57 @@
+"""
+In-process single-flight: concurrent calls with the same key share one run.
+
+    report = await inflight.do(key, lambda: expensive(image))
+
+The first caller for a key starts ``fn`` as a task on the running loop;
+callers arriving while it runs await that same task and get its result or
+its exception.  Each caller awaits through ``asyncio.shield``, so cancelling
+one caller (a closed browser tab, a timed-out batch item) never cancels the
+shared run – it finishes for the others, and for the report cache.
+
+Counters: ``<name>.flights`` (runs started) and ``<name>.coalesced``
+(callers that joined a run instead of starting one).
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+import telemetry
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[Hashable, asyncio.Task] = {}
+        self.flights = 0
+        self.coalesced = 0
+
+    def flight(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> tuple["asyncio.Task[T]", bool]:
+        """The shared task for ``key`` (started from ``fn`` if none is running) and whether this call started it."""
+        loop = asyncio.get_running_loop()
+        task = self._flights.get(key)
+        if task is not None and not task.done() and task.get_loop() is loop:
+            self.coalesced += 1
+            telemetry.count(f"{self.name}.coalesced")
+            return task, False
+
+        task = loop.create_task(fn(), name=f"{self.name}-flight")
+        self._flights[key] = task
+        task.add_done_callback(lambda t: self._landed(key, t))
+        self.flights += 1
+        telemetry.count(f"{self.name}.flights")
+        return task, True
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task, _ = self.flight(key, fn)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, int]:
+        return {"flights": self.flights, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+    def _landed(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every caller was cancelled
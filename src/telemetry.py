@@ -0,0 +1,161 @@
+"""
+Lightweight per-stage timing and counters, no network required.
+
+    with telemetry.turn("chat") as t:          # groups everything below
+        with telemetry.span("analyse.read") as attrs:
+            data = ...
+            attrs["bytes"] = len(data)
+        telemetry.count("vlm.repairs", 1)
+
+Spans and counters land on the current turn (a ContextVar, so tool calls
+running in child tasks are attributed correctly) and in the process-wide
+``collector``, which keeps rolling per-stage durations for percentiles.
+Finished turns are optionally appended to ``TELEMETRY_JSONL`` and the
+Prometheus text exposition is rewritten to ``TELEMETRY_PROM_FILE`` (for a
+node_exporter textfile collector).
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from config import TELEMETRY_JSONL, TELEMETRY_PROM_FILE, TELEMETRY_WINDOW
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+@dataclass
+class Turn:
+    kind: str
+    started: float = field(default_factory=time.time)
+    duration: float = 0.0
+    spans: list[dict] = field(default_factory=list)
+    counters: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+
+    def summary(self) -> dict:
+        return {
+            "kind": self.kind,
+            "started": self.started,
+            "duration_s": round(self.duration, 4),
+            "spans": self.spans,
+            "counters": dict(self.counters),
+        }
+
+
+class Collector:
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations: dict[str, deque] = defaultdict(lambda: deque(maxlen=self.window))
+        self._counters: dict[str, float] = defaultdict(float)
+        self.turns: deque[dict] = deque(maxlen=50)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._durations[name].append(seconds)
+
+    def add(self, name: str, value: float) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def finish_turn(self, turn: Turn) -> None:
+        summary = turn.summary()
+        with self._lock:
+            self._durations[f"turn.{turn.kind}"].append(turn.duration)
+            self.turns.append(summary)
+        if TELEMETRY_JSONL:
+            with open(TELEMETRY_JSONL, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+        if TELEMETRY_PROM_FILE:
+            tmp = f"{TELEMETRY_PROM_FILE}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp, TELEMETRY_PROM_FILE)
+
+    def percentiles(self) -> dict[str, dict]:
+        with self._lock:
+            snapshot = {name: list(values) for name, values in self._durations.items()}
+        return {
+            name: {
+                "n": len(values),
+                "p50_ms": round(1000 * percentile(values, 50), 1),
+                "p95_ms": round(1000 * percentile(values, 95), 1),
+            }
+            for name, values in sorted(snapshot.items())
+        }
+
+    def counters(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP radiology_stage_seconds Rolling stage latency quantiles.",
+            "# TYPE radiology_stage_seconds summary",
+        ]
+        with self._lock:
+            snapshot = {name: list(values) for name, values in self._durations.items()}
+            counters = dict(self._counters)
+        for name, values in sorted(snapshot.items()):
+            for q in (0.5, 0.95):
+                lines.append(f'radiology_stage_seconds{{stage="{name}",quantile="{q}"}} {percentile(values, q * 100):.6f}')
+            lines.append(f'radiology_stage_seconds_sum{{stage="{name}"}} {sum(values):.6f}')
+            lines.append(f'radiology_stage_seconds_count{{stage="{name}"}} {len(values)}')
+        lines += [
+            "# HELP radiology_total Token, byte and call counters.",
+            "# TYPE radiology_total counter",
+        ]
+        for name, value in sorted(counters.items()):
+            lines.append(f'radiology_total{{name="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+collector = Collector(window=TELEMETRY_WINDOW)
+_current: ContextVar[Turn | None] = ContextVar("telemetry_turn", default=None)
+
+
+@contextmanager
+def turn(kind: str) -> Iterator[Turn]:
+    t = Turn(kind)
+    token = _current.set(t)
+    start = time.perf_counter()
+    try:
+        yield t
+    finally:
+        t.duration = time.perf_counter() - start
+        _current.reset(token)
+        collector.finish_turn(t)
+
+
+def record(name: str, seconds: float, **attrs) -> None:
+    """Record an already-measured stage duration."""
+    collector.observe(name, seconds)
+    if (t := _current.get()) is not None:
+        t.spans.append({"name": name, "ms": round(seconds * 1000, 2), **attrs})
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[dict]:
+    """Time the block; the yielded dict can be filled with attributes (bytes, tokens…)."""
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record(name, time.perf_counter() - start, **attrs)
+
+
+def count(name: str, value: float = 1) -> None:
+    collector.add(name, value)
+    if (t := _current.get()) is not None:
+        t.counters[name] += value
@@ -1,42 +1,208 @@
 from pydantic_ai import Tool
-import base64, pathlib
-from radiology_agent import radiology_agent
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+from typing import AsyncIterator, Callable
+import asyncio
+import pathlib
+import preprocess
+import series
+import telemetry
+from outbox import outbox
+from config import ANALYSE_STREAM, RAD_MODEL_NAME, REFERENCE_TOP_K
+from reference_index import get_index as get_reference_index
+from radiology_agent import analyse_bytes, stream_bytes, system_prompt as rad_system_prompt
+from report_cache import make_key, report_cache
+from schema import PartialRadiologyReport, RadiologyReport
+from singleflight import SingleFlight
+from upload_store import is_ref, upload_store
 
 DEFAULT_IMAGE = pathlib.Path("data/image.jpg").resolve()
 
+# concurrent analyses of the same image (and settings) share one VLM request
+inflight = SingleFlight("analyse")
+
+
+def resolve_image_path(path: str | None) -> pathlib.Path:
+    if path in (None, "", "str"):
+        return DEFAULT_IMAGE
+    if is_ref(path):
+        return upload_store.resolve(path)
+    return pathlib.Path(path).expanduser().resolve()
+
+
+async def analyse_image(path: str | None = None, *, use_cache: bool = True) -> dict:
+    """
+    Run the radiology VLM on an image, going through the report cache.
+
+    With ``use_cache=False`` the cache lookup is skipped but the fresh
+    report still replaces whatever was stored for the image.
+    """
+    return await analyse_image_data(await _read(path), use_cache=use_cache)
+
+
+async def analyse_image_data(image_bytes: bytes, *, use_cache: bool = True) -> dict:
+    """
+    ``analyse_image`` for bytes already in memory (rendered DICOM frames, montages).
+
+    Concurrent calls for the same image and settings share one VLM request
+    (``singleflight``); with ``use_cache=False`` a caller may still join a
+    request that is already running.
+    """
+    key, cached = _lookup(image_bytes, use_cache)
+    if cached is not None:
+        return cached
+    return await inflight.do(key, lambda: _analyse(image_bytes, key))
+
+
+async def stream_analysis(path: str | None = None, *, use_cache: bool = True) -> AsyncIterator[PartialRadiologyReport | dict]:
+    """
+    Like ``analyse_image`` but yields ``PartialRadiologyReport`` snapshots
+    while the VLM is generating, then the complete report dict.
+
+    Cache hits, callers that joined another caller's in-flight request and
+    ``ANALYSE_STREAM=0`` yield only the complete report.
+    """
+    image_bytes = await _read(path)
+    key, cached = _lookup(image_bytes, use_cache)
+    if cached is not None:
+        yield cached
+        return
+    partials: asyncio.Queue[PartialRadiologyReport] = asyncio.Queue()
+    task, leader = inflight.flight(key, lambda: _analyse(image_bytes, key, on_partial=partials.put_nowait))
+    if leader:
+        while not task.done():
+            getter = asyncio.ensure_future(partials.get())
+            try:
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                getter.cancel()
+            if getter.done() and not getter.cancelled():
+                yield getter.result()
+    yield await asyncio.shield(task)
+
+
+async def _analyse(
+    image_bytes: bytes,
+    key: str,
+    on_partial: Callable[[PartialRadiologyReport], None] | None = None,
+) -> dict:
+    """Preprocess, call the VLM (streaming when ``on_partial`` is given) and cache the report."""
+    image = await _prepare(image_bytes)
+    if on_partial is None or not ANALYSE_STREAM:
+        report = await analyse_bytes(image.data, image.media_type)
+    else:
+        report = None
+        async for report in stream_bytes(image.data, image.media_type):
+            if isinstance(report, PartialRadiologyReport):
+                on_partial(report)
+        if not isinstance(report, RadiologyReport):
+            raise UnexpectedModelBehavior("Radiology report stream ended without a validated report")
+    report = report.model_dump()
+    report_cache.put(key, report)
+    return report
+
+
+async def _read(path: str | None) -> bytes:
+    with telemetry.span("analyse.read") as attrs:
+        image_bytes = await preprocess.read_bytes(resolve_image_path(path))
+        attrs["bytes"] = len(image_bytes)
+    return image_bytes
+
+
+def _lookup(image_bytes: bytes, use_cache: bool) -> tuple[str, dict | None]:
+    """Check the report cache; returns (cache key, cached report or None)."""
+    key = make_key(
+        image_bytes,
+        model_name=RAD_MODEL_NAME,
+        system_prompt=rad_system_prompt,
+        schema=RadiologyReport.model_json_schema(),
+        options=preprocess.settings(),
+    )
+    if not use_cache:
+        return key, None
+    with telemetry.span("analyse.cache") as attrs:
+        cached = report_cache.get(key)
+        attrs["hit"] = cached is not None
+    telemetry.count("cache.hits" if cached is not None else "cache.misses")
+    return key, cached
+
+
+async def _prepare(image_bytes: bytes) -> preprocess.PreparedImage:
+    with telemetry.span("analyse.preprocess") as attrs:
+        image = await preprocess.prepare(image_bytes)
+        attrs.update(bytes_in=image.original_bytes, bytes_out=len(image.data))
+    return image
+
+
 @Tool
 async def analyse_image_base64(path: str | None = None) -> dict:
     """
-    Analyse a JPEG with the radiology VLM and return a structured report.
+    Analyse a JPEG/PNG or DICOM image with the radiology VLM and return a structured report.
 
     Parameters
     ----------
     path : str | None
-        Path to a JPEG.  If omitted ― or equal to a known placeholder like
-        'str' ― we fall back to data/image.jpg.
+        Path to a JPEG, PNG or DICOM file, or an ``upload:<sha256>`` reference to an uploaded
+        image.  If omitted ― or equal to a known placeholder like 'str' ― we fall back to
+        data/image.jpg.
     """
-    if path in (None, "", "str"):
-        path = DEFAULT_IMAGE
-    else:
-        path = pathlib.Path(path).expanduser().resolve()
-
-    b64 = base64.b64encode(path.read_bytes()).decode()
-
-    run = await radiology_agent.run(
-        messages=[{
-            "role": "user",
-            "content": [{
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{b64}"}
-            }],
-        }]
-    )
-    return run.output.model_dump()
+    return await analyse_image(path)
+
+@Tool
+async def analyse_series_tool(paths: list[str] | None = None, folder: str | None = None) -> dict:
+    """
+    Analyse a study made of several images and return one merged report.
+
+    Parameters
+    ----------
+    paths : list[str] | None
+        Image files (JPEG, PNG or DICOM) belonging to the same study.
+    folder : str | None
+        A folder of images, or a multi-frame DICOM file.
+    """
+    items = series.collect_series([resolve_image_path(p) for p in paths] if paths else folder)
+    return await series.analyse_series(items, analyse_image_data)
+
 
 @Tool
-def show_reference_images_tool(confirm: str = "yes") -> dict:
+def show_reference_images_tool(path: str | None = None, confirm: str = "yes") -> dict:
     """
     Display reference medical images from similar confirmed cases. 
     Call this ONLY after the user explicitly asks to see reference images.
+
+    Parameters
+    ----------
+    path : str | None
+        Path of the image that was analysed; the most similar confirmed
+        cases are looked up for it.
+    """
+    return find_reference_cases(path)
+
+
+def find_reference_cases(path: str | None = None) -> dict:
+    index = get_reference_index()
+    cases = index.query_image(resolve_image_path(path), k=REFERENCE_TOP_K) if index else []
+    return {"action": "show_reference_images", "status": "success", "cases": cases}
+
+
+@Tool
+async def send_email(
+    to: list[str],
+    subject: str,
+    body: str,
+    cc: list[str] | None = None,
+    bcc: list[str] | None = None,
+) -> dict:
+    """
+    Send a plain-text email through Gmail.
+
+    The message is queued and delivered in the background; the result
+    carries its outbox id and status ("queued", or "sent" if an identical
+    message already went out).
     """
-    return {"action": "show_reference_images", "status": "success"}
+    payload = {"to": to, "subject": subject, "body": body}
+    if cc:
+        payload["cc"] = cc
+    if bcc:
+        payload["bcc"] = bcc
+    await outbox.start()
+    return {"action": "send_email", **outbox.enqueue(payload)}
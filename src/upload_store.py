@@ -0,0 +1,207 @@
+"""
+Content-addressed store for uploaded images.
+
+Uploads are copied in chunks into a temp file while being hashed (from a
+file object with ``save``, or chunk by chunk with ``receive``), then
+renamed to ``<sha256><suffix>`` – so an identical upload is stored once and
+two different files with the same name never overwrite each other.  The
+rest of the app refers to an upload as ``upload:<sha256>``.
+
+• files over ``UPLOAD_MAX_MB`` are rejected while streaming
+• entries older than ``UPLOAD_MAX_AGE_DAYS`` are dropped, then the least
+  recently used ones once the store exceeds ``UPLOAD_QUOTA_MB`` (resolving
+  a reference refreshes its mtime)
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from config import UPLOAD_DIR, UPLOAD_MAX_AGE_DAYS, UPLOAD_MAX_MB, UPLOAD_QUOTA_MB
+
+REF_PREFIX = "upload:"
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class Upload:
+    digest: str
+    path: Path
+    size: int
+    name: str
+    duplicate: bool = False
+
+    @property
+    def ref(self) -> str:
+        return f"{REF_PREFIX}{self.digest}"
+
+
+def is_ref(value: str | None) -> bool:
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+class UploadStore:
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        max_file_bytes: int = 512 * 1024 * 1024,
+        max_total_bytes: int = 4 * 1024 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+    ):
+        self.directory = Path(directory)
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._total_bytes: int | None = None  # computed lazily on first save
+        self._counters = {"saved": 0, "duplicates": 0, "rejected": 0, "evictions": 0}
+
+    # ── writing ───────────────────────────────────────────────────────────
+    def save(self, stream: BinaryIO, *, filename: str = "") -> Upload:
+        """Copy ``stream`` into the store; raises ``UploadTooLarge`` past the per-file limit."""
+        with self.receive(filename) as incoming:
+            while chunk := stream.read(CHUNK_SIZE):
+                incoming.write(chunk)
+            return incoming.finish()
+
+    def receive(self, filename: str = "") -> "Incoming":
+        """Start an upload that is fed chunk by chunk (e.g. from a request body)."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return Incoming(self, filename)
+
+    def _commit(self, incoming: "Incoming") -> Upload:
+        digest = incoming.hash.hexdigest()
+        if (existing := self._find(digest)) is not None:
+            os.utime(existing)
+            with self._lock:
+                self._counters["duplicates"] += 1
+            return Upload(digest, existing, incoming.size, incoming.filename, duplicate=True)
+
+        path = self._path(digest, Path(incoming.filename).suffix.lower())
+        path.parent.mkdir(exist_ok=True)
+        os.replace(incoming.tmp, path)
+
+        with self._lock:
+            self._counters["saved"] += 1
+            if self._total_bytes is None:
+                self._total_bytes = sum(p.stat().st_size for p in self._files())
+            else:
+                self._total_bytes += incoming.size
+            over_budget = self._total_bytes > self.max_total_bytes
+        if over_budget:
+            self.prune(keep=path)
+        return Upload(digest, path, incoming.size, incoming.filename)
+
+    # ── reading ───────────────────────────────────────────────────────────
+    def resolve(self, ref: str) -> Path:
+        """Path of ``upload:<sha256>`` (or a bare digest); raises FileNotFoundError once evicted."""
+        digest = ref[len(REF_PREFIX):] if is_ref(ref) else ref
+        path = self._find(digest)
+        if path is None:
+            raise FileNotFoundError(f"upload {digest[:12]}… is no longer stored; please upload it again")
+        os.utime(path)
+        return path
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "bytes": self._total_bytes}
+
+    # ── eviction ──────────────────────────────────────────────────────────
+    def prune(self, keep: Path | None = None) -> int:
+        """Remove expired uploads, then the least recently used until under quota."""
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self._files():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if path != keep and now - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_total_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._total_bytes = total
+            self._counters["evictions"] += removed
+        return removed
+
+    # ── internals ─────────────────────────────────────────────────────────
+    def _path(self, digest: str, suffix: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}{suffix}"
+
+    def _find(self, digest: str) -> Path | None:
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        return next((self.directory / digest[:2]).glob(f"{digest}*"), None)
+
+    def _files(self):
+        return self.directory.glob("??/*")
+
+
+class Incoming:
+    """
+    An upload being written to a temp file in the store: ``write`` each
+    chunk, then ``finish``.  Leaving the ``with`` block without finishing
+    (too large, client gone) deletes the temp file.
+    """
+
+    def __init__(self, store: UploadStore, filename: str):
+        self.store = store
+        self.filename = filename
+        self.tmp = store.directory / f".incoming.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self._file = open(self.tmp, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.store.max_file_bytes:
+            with self.store._lock:
+                self.store._counters["rejected"] += 1
+            raise UploadTooLarge(
+                f"{self.filename or 'upload'} is larger than {self.store.max_file_bytes / 2**20:g} MB"
+            )
+        self.hash.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self) -> Upload:
+        self._file.close()
+        return self.store._commit(self)
+
+    def __enter__(self) -> "Incoming":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._file.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+upload_store = UploadStore(
+    UPLOAD_DIR,
+    max_file_bytes=int(UPLOAD_MAX_MB * 1024 * 1024),
+    max_total_bytes=int(UPLOAD_QUOTA_MB * 1024 * 1024),
+    max_age=UPLOAD_MAX_AGE_DAYS * 24 * 3600,
+)
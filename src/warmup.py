@@ -0,0 +1,100 @@
+"""
+Warm-up: pay the cold-start costs before the first turn instead of during it.
+
+Models, providers and the MCP server are all created lazily, so a fresh
+process imports fast but its first turn would build them, open connections,
+hit a cold model server and wait for ``npx -y`` to resolve the Gmail MCP
+package.  ``warm_up()`` does that up front, each step timed as a span of a
+``warmup`` telemetry turn:
+
+• ``warmup.<role>.model``   – build the model (imports the OpenAI SDK,
+  creates the provider and its pooled client)
+• ``warmup.<role>.connect`` – ``GET /models``, which opens the keep-alive
+  connection; with several replicas every one of them is probed
+• ``warmup.<role>.probe``   – a one-token completion carrying the agent's
+  system prompt, so the server has the model loaded and the prompt prefix
+  cached (``WARMUP_PROBE``)
+• ``warmup.mcp``            – ``npx`` fetches the MCP package into the npm
+  cache without starting the server (``WARMUP_MCP``)
+
+A failing step is recorded in ``errors`` and never raised: at worst the
+first turn is as slow as it would have been.  ``status`` holds the latest
+result for the UI and ``/healthz``.
+"""
+import asyncio
+import shutil
+from asyncio import subprocess
+
+import endpoint_router
+import telemetry
+from config import WARMUP_MCP, WARMUP_MCP_TIMEOUT, WARMUP_PROBE, WARMUP_TIMEOUT, orch_model, vlm_model
+from lazy_model import LazyModel
+from mcp_pool import GMAIL_MCP_PACKAGE
+from orchestrator import SYSTEM_PROMPT
+from radiology_agent import system_prompt as rad_system_prompt
+
+status: dict = {"state": "pending"}
+
+
+async def warm_up(*, probe: bool = WARMUP_PROBE, mcp: bool = WARMUP_MCP) -> dict:
+    """Warm both model roles (and the MCP package) concurrently; returns the timed steps."""
+    status.clear()
+    status["state"] = "running"
+    errors: dict[str, str] = {}
+    with telemetry.turn("warmup") as perf:
+        steps = [
+            _warm_role("RAD", vlm_model, rad_system_prompt, probe, errors),
+            _warm_role("ORCH", orch_model, SYSTEM_PROMPT, probe, errors),
+        ]
+        if mcp:
+            steps.append(_warm_mcp(errors))
+        await asyncio.gather(*steps)
+    result = {**perf.summary(), "state": "failed" if errors else "ready", "errors": errors}
+    status.clear()
+    status.update(result)
+    return result
+
+
+async def _warm_role(role: str, model: LazyModel, prompt: str, probe: bool, errors: dict) -> None:
+    name = role.lower()
+    try:
+        with telemetry.span(f"warmup.{name}.model"):
+            built = model.wrapped
+        with telemetry.span(f"warmup.{name}.connect"):
+            await asyncio.wait_for(built.client.models.list(), WARMUP_TIMEOUT)
+            if (router := endpoint_router.routers.get(role)) is not None:
+                await router.probe()
+        if probe:
+            with telemetry.span(f"warmup.{name}.probe"):
+                await asyncio.wait_for(
+                    built.client.chat.completions.create(
+                        model=built.model_name,
+                        messages=[{"role": "system", "content": prompt}, {"role": "user", "content": "ping"}],
+                        max_tokens=1,
+                    ),
+                    WARMUP_TIMEOUT,
+                )
+    except Exception as exc:
+        errors[role] = f"{type(exc).__name__}: {exc}"
+
+
+async def _warm_mcp(errors: dict) -> None:
+    if shutil.which("npx") is None:
+        errors["mcp"] = "npx is not installed"
+        return
+    try:
+        with telemetry.span("warmup.mcp"):
+            proc = await asyncio.create_subprocess_exec(
+                "npx", "-y", f"--package={GMAIL_MCP_PACKAGE}", "--call", "true",
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+            try:
+                _, stderr = await asyncio.wait_for(proc.communicate(), WARMUP_MCP_TIMEOUT)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise
+        if proc.returncode:
+            raise RuntimeError(stderr.decode(errors="replace").strip()[-300:] or f"npx exited with {proc.returncode}")
+    except Exception as exc:
+        errors["mcp"] = f"{type(exc).__name__}: {exc}"
@@ -0,0 +1,233 @@
+"""
+Deterministic fast paths for the scripted parts of the chat FLOW.
+
+Steps B–E of ``orchestrator.SYSTEM_PROMPT`` are a fixed state machine, so
+the transitions that need no language understanding run directly instead of
+costing an orchestrator generation each:
+
+    upload                         → analyse, show summary, offer references
+    OFFER_REFERENCES  + yes / no   → show similar cases (or not), then the
+                                     critical gate if the report is critical
+    OFFER_PEER_REVIEW + no         → acknowledge
+
+Everything else (free-text questions, "yes" to peer review, drafting and
+sending the email, ambiguous answers) goes to the orchestrator as before.
+Fast-path exchanges are written into the conversation history as ordinary
+user / tool-call / tool-return / assistant messages, so the LLM sees the
+same context it would have produced itself.
+"""
+import asyncio
+import re
+import uuid
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import AsyncIterator, Callable
+
+from pydantic_ai.messages import (
+    FunctionToolResultEvent,
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+import telemetry
+from history import ConversationHistory
+from schema import PartialRadiologyReport
+from tools_orchestrator import find_reference_cases, stream_analysis
+
+REFERENCE_OFFER = "Would you like to view reference images from similar confirmed cases?"
+CRITICAL_OFFER = "This case is marked as critical. Would you like to send it for peer review?"
+DONE_REPLY = "Let me know if you have any other questions about this case."
+DECLINED_REVIEW_REPLY = "Understood, the case will not be sent for peer review. " + DONE_REPLY
+
+YES = re.compile(
+    r"\s*(y|yes|yep|yeah|yup|sure|ok|okay|please|of course|show( them| me)?)([\s,]*(please|thanks|show them|show me))*[\s.!]*",
+    re.I,
+)
+NO = re.compile(r"\s*(n|no|nope|nah|not now|skip)[\s,]*(thanks|thank you)?[\s.!]*", re.I)
+
+# orchestrator requests the LLM flow spends on each transition
+_SAVED = {"upload": 2, "references_yes": 2, "references_no": 1, "review_no": 1}
+
+
+class Step(str, Enum):
+    AWAIT_IMAGE = "await_image"
+    OFFER_REFERENCES = "offer_references"
+    OFFER_PEER_REVIEW = "offer_peer_review"
+    FREE = "free"
+
+
+def classify(text: str) -> bool | None:
+    """True for a plain yes, False for a plain no, None for anything longer."""
+    if YES.fullmatch(text):
+        return True
+    if NO.fullmatch(text):
+        return False
+    return None
+
+
+def format_summary(report: dict) -> str:
+    return (
+        f"Diagnosis: {report['diagnosis_description']}\n\n"
+        f"Recommendations: {report['clinical_recommendations']}\n\n"
+        f"Critical: {'Yes' if report['critical'] else 'No'}"
+    )
+
+
+def format_partial(report: PartialRadiologyReport) -> str:
+    """The fields streamed so far, critical flag first so it shows up immediately."""
+    lines = []
+    if report.critical is not None:
+        lines.append(f"**Critical: {'Yes' if report.critical else 'No'}**")
+    if report.diagnosis_description:
+        lines.append(f"Diagnosis: {report.diagnosis_description}")
+    if report.clinical_recommendations:
+        lines.append(f"Recommendations: {report.clinical_recommendations}")
+    return "\n\n".join(lines) + " ▌"
+
+
+@dataclass
+class Workflow:
+    system_prompt: str
+    step: Step = Step.AWAIT_IMAGE
+    image_path: str | None = None
+    report: dict | None = None
+    stats: dict = field(default_factory=lambda: {"fast_path_turns": 0, "llm_turns": 0, "requests_saved": 0})
+
+    # ── entry points ──────────────────────────────────────────────────────
+    async def on_upload(self, path: str, history: ConversationHistory) -> AsyncIterator:
+        """
+        Analyse an uploaded image without asking the orchestrator to call the tool.
+
+        ``PartialRadiologyReport`` snapshots are yielded while the VLM is
+        still generating, so the UI can show them before the summary.
+        """
+        with telemetry.turn("fast_path") as perf:
+            async for item in stream_analysis(path):
+                if isinstance(item, PartialRadiologyReport):
+                    yield item
+                else:
+                    report = item
+            self.image_path, self.report = path, report
+            reply = f"{format_summary(report)}\n\n{REFERENCE_OFFER}"
+            history.append_messages(self._exchange(
+                history, f"Analyze this image: {path}", reply,
+                tool=("analyse_image_base64", {"path": path}, report),
+            ))
+            self.step = Step.OFFER_REFERENCES
+            self._saved("upload")
+            yield reply
+        yield perf
+
+    async def on_message(
+        self,
+        text: str,
+        history: ConversationHistory,
+        llm_turn: Callable[[str, list[ModelMessage]], AsyncIterator],
+    ) -> AsyncIterator:
+        """Handle a chat message, falling back to ``llm_turn`` when it is not a scripted step."""
+        answer = classify(text)
+
+        # a "yes" needs the analysed image; without one the orchestrator asks for it
+        if self.step is Step.OFFER_REFERENCES and (answer is False or (answer and self.image_path)):
+            async for ev in self._references(text, answer, history):
+                yield ev
+            return
+        if self.step is Step.OFFER_PEER_REVIEW and answer is False:
+            with telemetry.turn("fast_path") as perf:
+                history.append_messages(self._exchange(history, text, DECLINED_REVIEW_REPLY))
+                self.step = Step.FREE
+                self._saved("review_no")
+                yield DECLINED_REVIEW_REPLY
+            yield perf
+            return
+
+        self.stats["llm_turns"] += 1
+        telemetry.count("workflow.llm_turns")
+        if self.step is Step.OFFER_PEER_REVIEW:
+            self.step = Step.FREE  # the LLM drafts, confirms and sends the email
+        async for ev in llm_turn(text, history.messages):
+            if hasattr(ev, "new_messages"):
+                self.observe(ev.new_messages())
+            yield ev
+
+    def observe(self, messages: list[ModelMessage]) -> None:
+        """Follow the state machine when the LLM ran a step itself."""
+        calls = {
+            part.tool_call_id: part
+            for msg in messages for part in getattr(msg, "parts", []) if isinstance(part, ToolCallPart)
+        }
+        for msg in messages:
+            for part in getattr(msg, "parts", []):
+                if not isinstance(part, ToolReturnPart) or not isinstance(part.content, dict):
+                    continue
+                if part.tool_name in ("analyse_image_base64", "analyse_series_tool"):
+                    self.report = part.content
+                    self.image_path = _analysed_path(calls.get(part.tool_call_id))
+                    self.step = Step.OFFER_REFERENCES
+                elif part.tool_name == "show_reference_images_tool":
+                    self.step = self._after_references()
+
+    # ── transitions ───────────────────────────────────────────────────────
+    async def _references(self, text: str, answer: bool, history: ConversationHistory) -> AsyncIterator:
+        with telemetry.turn("fast_path") as perf:
+            self.step = self._after_references()
+            follow_up = CRITICAL_OFFER if self.step is Step.OFFER_PEER_REVIEW else DONE_REPLY
+            tool = None
+            if answer:
+                result = await asyncio.to_thread(find_reference_cases, self.image_path)
+                call_id = _call_id()
+                tool = ("show_reference_images_tool", {"path": self.image_path, "confirm": "yes"}, result, call_id)
+                yield FunctionToolResultEvent(
+                    result=ToolReturnPart(tool_name="show_reference_images_tool", content=result, tool_call_id=call_id),
+                    tool_call_id=call_id,
+                )
+            history.append_messages(self._exchange(history, text, follow_up, tool=tool))
+            self._saved("references_yes" if answer else "references_no")
+            yield follow_up
+        yield perf
+
+    def _after_references(self) -> Step:
+        return Step.OFFER_PEER_REVIEW if self.report and self.report.get("critical") else Step.FREE
+
+    # ── helpers ───────────────────────────────────────────────────────────
+    def _saved(self, transition: str) -> None:
+        self.stats["fast_path_turns"] += 1
+        self.stats["requests_saved"] += _SAVED[transition]
+        telemetry.count("workflow.fast_path_turns")
+        telemetry.count("workflow.orchestrator_requests_saved", _SAVED[transition])
+
+    def _exchange(self, history: ConversationHistory, user_text: str, reply: str, tool: tuple | None = None) -> list[ModelMessage]:
+        """The messages the orchestrator would have produced for this step."""
+        first = [SystemPromptPart(content=self.system_prompt)] if not history.messages else []
+        messages: list[ModelMessage] = [ModelRequest(parts=[*first, UserPromptPart(content=user_text)])]
+        if tool is not None:
+            name, args, result, *rest = tool
+            call_id = rest[0] if rest else _call_id()
+            messages.append(ModelResponse(parts=[ToolCallPart(tool_name=name, args=args, tool_call_id=call_id)]))
+            messages.append(ModelRequest(parts=[ToolReturnPart(tool_name=name, content=result, tool_call_id=call_id)]))
+        messages.append(ModelResponse(parts=[TextPart(content=reply)]))
+        return messages
+
+
+def _analysed_path(call: ToolCallPart | None) -> str | None:
+    """The image an analysis tool call was about (a series' first image); None for a folder."""
+    try:
+        args = call.args_as_dict() if call is not None else {}
+    except ValueError:  # malformed JSON arguments
+        return None
+    if isinstance(path := args.get("path"), str) and path:
+        return path
+    paths = args.get("paths")
+    if isinstance(paths, list) and paths and isinstance(paths[0], str):
+        return paths[0]
+    return None
+
+
+def _call_id() -> str:
+    return f"call_wf_{uuid.uuid4().hex[:12]}"
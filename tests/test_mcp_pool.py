@@ -0,0 +1,47 @@
+import asyncio
+import os
+import signal
+import sys
+from pathlib import Path
+
+from pydantic_ai.mcp import MCPServerStdio
+
+from mcp_pool import MCPServerPool
+
+FAKE_MCP = Path(__file__).resolve().parent.parent / "src" / "bench" / "fake_mcp_email.py"
+
+
+def server_pids(marker: str) -> list[int]:
+    pids = []
+    for proc in Path("/proc").iterdir():
+        try:
+            if proc.name.isdigit() and marker in (proc / "cmdline").read_text():
+                pids.append(int(proc.name))
+        except OSError:
+            continue
+    return pids
+
+
+def test_dead_server_fails_the_ping_and_is_restarted(tmp_path):
+    marker = str(tmp_path / "mcp-marker")  # ignored by the server, identifies its process
+    pool = MCPServerPool(
+        MCPServerStdio(command=sys.executable, args=[str(FAKE_MCP), marker], env=dict(os.environ)),
+        health_interval=0, health_timeout=2,
+    )
+
+    async def main():
+        try:
+            async with pool.borrow() as server:
+                assert await server.list_tools()
+            assert await pool._healthy()
+            (pid,) = server_pids(marker)
+            os.kill(pid, signal.SIGKILL)
+            await asyncio.sleep(0.2)
+            assert not await pool._healthy()
+            async with pool.borrow() as server:
+                assert await server.call_tool("send_email", {"to": ["a@b.c"], "subject": "s", "body": "b"})
+            assert pool.starts == 2
+        finally:
+            await pool.close()
+
+    asyncio.run(asyncio.wait_for(main(), 60))
@@ -0,0 +1,125 @@
+"""Outbox delivery against the fake Gmail MCP server (``bench.fake_mcp_email``)."""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from pydantic_ai.mcp import MCPServerStdio
+
+from mcp_pool import MCPServerPool
+from outbox import Outbox
+
+FAKE_MCP = Path(__file__).resolve().parent.parent / "src" / "bench" / "fake_mcp_email.py"
+MESSAGE = {"to": ["reviewer@example.com"], "subject": "Peer review request", "body": "Please review case 7."}
+
+
+def make_outbox(tmp_path: Path, *, fail_first: int = 0, **kwargs) -> Outbox:
+    pool = MCPServerPool(MCPServerStdio(
+        command=sys.executable,
+        args=[str(FAKE_MCP)],
+        env={**os.environ, "FAKE_MCP_OUTBOX": str(tmp_path / "sent.jsonl"), "FAKE_MCP_LATENCY": "0",
+             "FAKE_MCP_FAIL_FIRST": str(fail_first)},
+    ))
+    options = {"base_delay": 0.2, "max_delay": 1.0, "rate_per_min": 0, **kwargs}
+    return Outbox(tmp_path / "outbox.sqlite3", pool, **options)
+
+
+def sent(tmp_path: Path) -> list[dict]:
+    path = tmp_path / "sent.jsonl"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def row(box: Outbox, id_: int) -> dict:
+    with box._conn() as db:
+        status, attempts, error = db.execute(
+            "SELECT status, attempts, last_error FROM emails WHERE id = ?", (id_,),
+        ).fetchone()
+    return {"status": status, "attempts": attempts, "last_error": error}
+
+
+async def run(box: Outbox, body, timeout: float = 30):
+    await box.start()
+    try:
+        return await asyncio.wait_for(body(), timeout)
+    finally:
+        await box.stop()
+        await box.pool.close()
+
+
+def test_failed_sends_are_retried_with_backoff(tmp_path):
+    box = make_outbox(tmp_path, fail_first=2, max_attempts=5)
+
+    async def body():
+        t0 = time.monotonic()
+        queued = box.enqueue(MESSAGE)
+        await box.drain()
+        return queued, time.monotonic() - t0
+
+    queued, elapsed = asyncio.run(run(box, body))
+    assert row(box, queued["id"])["status"] == "sent"
+    assert row(box, queued["id"])["attempts"] == 3
+    assert len(sent(tmp_path)) == 1
+    assert elapsed >= 0.8 * (0.2 + 0.4)  # two retries: base_delay, then doubled (±20% jitter)
+
+
+def test_permanent_failure_ends_failed(tmp_path):
+    box = make_outbox(tmp_path, fail_first=100, max_attempts=3, base_delay=0.05)
+
+    async def body():
+        queued = box.enqueue(MESSAGE)
+        await box.drain()
+        return queued
+
+    queued = asyncio.run(run(box, body))
+    state = row(box, queued["id"])
+    assert state["status"] == "failed"
+    assert state["attempts"] == 3
+    assert "503" in state["last_error"]
+    assert sent(tmp_path) == []
+    assert box.stats()["failed"] == 1
+
+
+def test_repeated_send_is_deduplicated(tmp_path):
+    box = make_outbox(tmp_path)
+
+    async def body():
+        first = box.enqueue(MESSAGE)
+        # same message with different case/whitespace in the addresses
+        again = box.enqueue({**MESSAGE, "to": [" Reviewer@Example.com "]})
+        await box.drain()
+        after = box.enqueue(MESSAGE)  # already sent
+        return first, again, after
+
+    first, again, after = asyncio.run(run(box, body))
+    assert not first["duplicate"]
+    assert again == {"id": first["id"], "status": "queued", "duplicate": True}
+    assert after == {"id": first["id"], "status": "sent", "duplicate": True}
+    assert len(sent(tmp_path)) == 1
+
+
+def test_stale_sending_lease_is_requeued_after_restart(tmp_path):
+    crashed = make_outbox(tmp_path, lease=0.5)
+    stale = crashed.enqueue(MESSAGE)
+    live = crashed.enqueue({**MESSAGE, "subject": "Second opinion"})
+    assert [id_ for id_, _, _ in crashed._claim_due()] == [stale["id"], live["id"]]
+    with crashed._conn() as db:  # the first claim's worker died long ago; the second is still renewing
+        db.execute("UPDATE emails SET lease_until = ? WHERE id = ?", (time.time() - 60, stale["id"]))
+        db.execute("UPDATE emails SET lease_until = ? WHERE id = ?", (time.time() + 60, live["id"]))
+
+    box = make_outbox(tmp_path, lease=0.5)
+
+    async def body():
+        deadline = time.monotonic() + 20
+        while row(box, stale["id"])["status"] != "sent":
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.05)
+
+    asyncio.run(run(box, body))
+    assert row(box, live["id"])["status"] == "sending"  # a live lease from another worker is left alone
+    assert [m["subject"] for m in sent(tmp_path)] == [MESSAGE["subject"]]
+    assert sqlite3.connect(box.path).execute(
+        "SELECT owner FROM emails WHERE id = ?", (live["id"],),
+    ).fetchone() == (crashed.owner,)
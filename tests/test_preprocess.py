@@ -0,0 +1,38 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import preprocess
+
+
+def _png16(values: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(values.astype(np.uint16)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _decode(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.mode == "L"
+        return np.asarray(img)
+
+
+def test_16bit_png_round_trip_keeps_contrast():
+    ramp = np.linspace(0, 4095, 256 * 256).reshape(256, 256)  # 12-bit data, as most scanners store it
+    raw = _png16(ramp)
+    assert Image.open(io.BytesIO(raw)).mode == "I;16"
+
+    for grayscale in (True, False):
+        prepared = preprocess.prepare_image(raw, grayscale=grayscale)
+        assert prepared.media_type == "image/jpeg"
+        out = _decode(prepared.data).astype(np.float32)
+        assert out.min() <= 2 and out.max() >= 253
+        assert (out >= 250).mean() < 0.05  # convert("L") alone leaves ~94% of pixels at 255
+        expected = ramp * 255.0 / 4095.0
+        assert np.abs(out - expected).mean() < 3
+
+
+def test_flat_16bit_image_is_black_not_an_error():
+    prepared = preprocess.prepare_image(_png16(np.full((64, 64), 3000)))
+    assert _decode(prepared.data).max() <= 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from reference_index import ReferenceIndex, benchmark, build_index
+
+
+@pytest.fixture
+def index(tmp_path) -> ReferenceIndex:
+    rng = np.random.default_rng(0)
+    cases = tmp_path / "cases"
+    cases.mkdir()
+    for i in range(12):
+        Image.fromarray(rng.integers(0, 256, (32, 32), dtype=np.uint8)).save(cases / f"case_{i:02d}.png")
+    build_index(cases, tmp_path / "index", n_lists=3, workers=2)
+    return ReferenceIndex(tmp_path / "index")
+
+
+def test_query_finds_the_case_itself(index):
+    vector = np.asarray(index.embeddings[5])
+    for n_probe in (1, 3):
+        assert index.query(vector, k=2, n_probe=n_probe)[0]["case"] == index.metadata[5]["case"]
+
+
+def test_query_rejects_n_probe_below_one(index):
+    with pytest.raises(ValueError, match="n_probe"):
+        index.query(np.asarray(index.embeddings[0]), n_probe=0)
+
+
+def test_benchmark_needs_two_queries(index):
+    with pytest.raises(ValueError, match="queries"):
+        benchmark(index, queries=1)
+    assert set(benchmark(index, queries=2, n_probe=1)) == {"brute_force", "partitioned"}